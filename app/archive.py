@@ -0,0 +1,100 @@
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+from app.downloader import get_data_dir
+
+# Default archive file inside the app data folder
+ARCHIVE_FILE = "archive.sqlite3"
+
+
+# One downloaded video as stored in the archive:
+@dataclass
+class ArchiveEntry:
+    video_id: str
+    path: str
+    size: int
+    codec: str
+    downloaded_at: float
+
+
+# On-disk index of finished downloads keyed by YouTube video ID, used to skip
+# videos that were already fetched. Safe to share between worker threads.
+class DownloadArchive:
+    def __init__(self, path=None):
+        self.path = path or os.path.join(get_data_dir(), ARCHIVE_FILE)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS downloads (
+                    video_id TEXT PRIMARY KEY,
+                    path TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    codec TEXT NOT NULL,
+                    downloaded_at REAL NOT NULL
+                )
+                """)
+
+    def get(self, video_id) -> Optional[ArchiveEntry]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT video_id, path, size, codec, downloaded_at"
+                " FROM downloads WHERE video_id = ?",
+                (video_id,),
+            ).fetchone()
+        return ArchiveEntry(*row) if row else None
+
+    # Entry of the video only if its file still exists in output_folder
+    # (and has the wanted codec, if one is given):
+    def find(self, video_id, output_folder, codec=None) -> Optional[ArchiveEntry]:
+        entry = self.get(video_id)
+        if not entry or not os.path.isfile(entry.path):
+            return None
+        if codec and entry.codec != codec:
+            return None
+        if os.path.normcase(os.path.dirname(os.path.abspath(entry.path))) != (
+            os.path.normcase(os.path.abspath(output_folder))
+        ):
+            return None
+        return entry
+
+    def add(self, video_id, path, codec="mp3"):
+        entry = ArchiveEntry(
+            video_id=video_id,
+            path=os.path.abspath(path),
+            size=os.path.getsize(path),
+            codec=codec,
+            downloaded_at=time.time(),
+        )
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO downloads VALUES (?, ?, ?, ?, ?)",
+                (
+                    entry.video_id,
+                    entry.path,
+                    entry.size,
+                    entry.codec,
+                    entry.downloaded_at,
+                ),
+            )
+        return entry
+
+    def remove(self, video_id):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM downloads WHERE video_id = ?", (video_id,))
+
+    def __contains__(self, video_id):
+        return self.get(video_id) is not None
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM downloads").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
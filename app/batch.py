@@ -0,0 +1,160 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+from app.downloader import (
+    clean_youtube_url,
+    download_audio,
+    extract_video_id,
+    file_extension,
+    get_profile,
+)
+
+# How many downloads run at the same time when no worker count is given
+DEFAULT_WORKERS = 4
+
+
+# Outcome of a single URL from the batch:
+@dataclass
+class BatchResult:
+    index: int
+    url: str
+    file_name: Optional[str] = None
+    error: Optional[Exception] = None
+    cancelled: bool = False
+    # Already in the archive or a repeat of an earlier URL, nothing was downloaded
+    skipped: bool = False
+
+    @property
+    def ok(self):
+        return self.error is None and not self.cancelled
+
+
+# Splits the batch into jobs to run and repeats of an earlier URL (same video):
+def split_duplicates(results):
+    first_by_key = {}
+    jobs, duplicates = [], []
+    for result in results:
+        key = extract_video_id(clean_youtube_url(result.url)) or result.url
+        original = first_by_key.setdefault(key, result)
+        if original is result:
+            jobs.append(result)
+        else:
+            duplicates.append((result, original))
+    return jobs, duplicates
+
+
+# Gives a repeated URL the outcome of its first occurrence:
+def copy_duplicate(result, original):
+    result.file_name = original.file_name
+    result.error = original.error
+    result.cancelled = original.cancelled
+    result.skipped = True
+
+
+# Archive entry of the URL's video if it is already in output_folder
+# in the output format of the profile:
+def find_archived(archive, url, output_folder, profile=None):
+    video_id = extract_video_id(url)
+    if archive is None or not video_id:
+        return None
+    return archive.find(video_id, output_folder, get_profile(profile).ext)
+
+
+def record_archived(archive, url, file_path):
+    video_id = extract_video_id(url)
+    if archive is not None and video_id:
+        archive.add(video_id, file_path, file_extension(file_path))
+
+
+# Runs many downloads at once on a bounded pool of worker threads.
+# Usable without the GUI: BatchDownloader(folder).run(urls) returns the
+# results in the same order as the input URLs.
+class BatchDownloader:
+    def __init__(
+        self,
+        output_folder,
+        workers=DEFAULT_WORKERS,
+        download: Callable = download_audio,
+        archive=None,
+        force=False,
+        profile=None,
+    ):
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
+        self.output_folder = output_folder
+        self.workers = workers
+        self.download = download
+        # Output profile (name or OutputProfile), None keeps the download default
+        self.profile = profile
+        if profile is not None:
+            self.download = partial(download, profile=profile)
+        self.archive = archive
+        self.force = force
+        self._cancel_event = threading.Event()
+
+    # Stops the batch: jobs that have not started yet are skipped,
+    # jobs already running are allowed to finish.
+    def cancel(self):
+        self._cancel_event.set()
+
+    @property
+    def cancelled(self):
+        return self._cancel_event.is_set()
+
+    # Downloads every URL, calling on_result (from a worker thread) as each job ends:
+    def run(self, urls, on_result=None):
+        self._cancel_event.clear()
+        results = [
+            BatchResult(index=index, url=url) for index, url in enumerate(urls, start=1)
+        ]
+        jobs, duplicates = split_duplicates(results)
+        print(f"Batch downloading {len(jobs)} URLs with {self.workers} workers")
+
+        with ThreadPoolExecutor(
+            max_workers=self.workers, thread_name_prefix="batch"
+        ) as executor:
+            futures = [
+                executor.submit(self._run_job, result, on_result) for result in jobs
+            ]
+            for future in futures:
+                future.result()
+
+        for result, original in duplicates:
+            copy_duplicate(result, original)
+            if on_result:
+                on_result(result)
+        return results
+
+    def _run_job(self, result, on_result):
+        if self._cancel_event.is_set():
+            result.cancelled = True
+        else:
+            try:
+                clean_url = clean_youtube_url(result.url)
+                entry = None
+                if not self.force:
+                    entry = find_archived(
+                        self.archive, clean_url, self.output_folder, self.profile
+                    )
+                if entry:
+                    print(f"Already downloaded, skipping: {entry.path}")
+                    result.file_name = os.path.basename(entry.path)
+                    result.skipped = True
+                else:
+                    result.file_name = self.download(clean_url, self.output_folder)
+                    record_archived(
+                        self.archive,
+                        clean_url,
+                        os.path.join(self.output_folder, result.file_name),
+                    )
+            except Exception as e:
+                print(f"Batch job {result.index} failed: {e}")
+                result.error = e
+
+        if on_result:
+            on_result(result)
+        return result
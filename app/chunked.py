@@ -0,0 +1,310 @@
+# Parallel ranged download of one large file: the file is split into byte
+# ranges that are fetched over several connections at once, each into its
+# own part file next to the target, and joined in order once all are
+# complete. Part files survive failures and interruptions; the next attempt
+# at the same path continues every part where it stopped, as long as the
+# server still has the same file (size and ETag/Last-Modified). When ranges
+# stop working the parts are removed, the plain download starts from zero.
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Files below this size are not worth splitting
+CHUNKED_MIN_SIZE = 16 * 1024 * 1024
+# Smallest range per connection, the connection count grows with the file
+MIN_RANGE_SIZE = 8 * 1024 * 1024
+MAX_CONNECTIONS = 8
+# Attempts per range before the download fails (it resumes on the next call)
+RANGE_ATTEMPTS = 3
+READ_SIZE = 64 * 1024
+
+_CONTENT_RANGE_RE = re.compile(r"bytes (\d+)-(\d+)/(\d+|\*)")
+
+
+# The server cannot serve this file in ranges (or the file changed under
+# us), the caller should fall back to a plain download.
+class RangeNotSupported(Exception):
+    pass
+
+
+# Connections for a file of `size` bytes, 1 means not worth splitting:
+def connection_count(size, max_connections=MAX_CONNECTIONS):
+    if size < CHUNKED_MIN_SIZE:
+        return 1
+    return max(2, min(max_connections, size // MIN_RANGE_SIZE))
+
+
+# `count` contiguous (start, end) byte ranges covering `size` bytes:
+def split_ranges(size, count):
+    step = -(-size // count)
+    return [(start, min(start + step, size) - 1) for start in range(0, size, step)]
+
+
+# (start, end, total) of a 206 response, total is None when unknown:
+def parse_content_range(response):
+    match = _CONTENT_RANGE_RE.fullmatch(
+        (response.headers.get("Content-Range") or "").strip()
+    )
+    if not match:
+        return None
+    total = match.group(3)
+    return (
+        int(match.group(1)),
+        int(match.group(2)),
+        (int(total) if total.isdigit() else None),
+    )
+
+
+# What identifies this version of the file, sent back as If-Range:
+def response_validator(response):
+    return response.headers.get("ETag") or response.headers.get("Last-Modified")
+
+
+# Size and validator of the file behind open_range, from a one byte request.
+# Raises RangeNotSupported when the server ignores ranges.
+def probe_range(open_range):
+    response = open_range(0, 0, None)
+    try:
+        content_range = parse_content_range(response)
+        if response.status != 206 or not content_range or not content_range[2]:
+            raise RangeNotSupported("the server does not support range requests")
+        return content_range[2], response_validator(response)
+    finally:
+        response.close()
+
+
+def _part_path(path, index):
+    return f"{path}.part{index}"
+
+
+def _state_path(path):
+    return f"{path}.ranges"
+
+
+# Ranges of an earlier attempt at `path` if it was for the same file,
+# otherwise its part files are removed and None is returned.
+def _load_state(path, size, validator):
+    try:
+        with open(_state_path(path), encoding="utf-8") as file:
+            state = json.load(file)
+    except (OSError, ValueError):
+        return None
+    if state.get("size") == size and state.get("validator") == validator:
+        return [tuple(r) for r in state["ranges"]]
+    print(f"Server file changed since the last attempt, starting over: {path}")
+    _remove_parts(path, len(state.get("ranges", ())))
+    return None
+
+
+# Removes the part files of an earlier attempt at `path`, as many as its
+# state lists:
+def _discard_attempt(path):
+    try:
+        with open(_state_path(path), encoding="utf-8") as file:
+            count = len(json.load(file)["ranges"])
+    except (OSError, ValueError, KeyError, TypeError):
+        count = 0
+    _remove_parts(path, count)
+
+
+def _remove_parts(path, count):
+    for index in range(count):
+        try:
+            os.remove(_part_path(path, index))
+        except FileNotFoundError:
+            pass
+    try:
+        os.remove(_state_path(path))
+    except FileNotFoundError:
+        pass
+
+
+# Downloads the file behind open_range to `path` over several connections.
+# open_range(start, end, validator) opens a request for the inclusive byte
+# range, with If-Range set to the validator when there is one.
+# progress_hook gets yt-dlp style "downloading"/"finished" dicts, called
+# from the connection threads one at a time. request_size caps the bytes per
+# request, larger ranges take several requests (servers that throttle long
+# responses). Returns False without downloading when the file is smaller
+# than CHUNKED_MIN_SIZE; raises RangeNotSupported when ranges do not work,
+# after removing the part files.
+def download_chunked(
+    open_range,
+    path,
+    max_connections=MAX_CONNECTIONS,
+    progress_hook=None,
+    request_size=None,
+):
+    try:
+        return _download_chunked(
+            open_range, path, max_connections, progress_hook, request_size
+        )
+    except RangeNotSupported:
+        # Useless to a plain download, which writes its own .part file
+        _discard_attempt(path)
+        raise
+
+
+def _download_chunked(open_range, path, max_connections, progress_hook, request_size):
+    size, validator = probe_range(open_range)
+    ranges = _load_state(path, size, validator)
+    if ranges is None:
+        count = connection_count(size, max_connections)
+        if count == 1:
+            return False
+        ranges = split_ranges(size, count)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(_state_path(path), "w", encoding="utf-8") as file:
+            json.dump({"size": size, "validator": validator, "ranges": ranges}, file)
+
+    parts = [_part_path(path, index) for index in range(len(ranges))]
+    resumed = sum(
+        min(os.path.getsize(part), end - start + 1)
+        for part, (start, end) in zip(parts, ranges)
+        if os.path.exists(part)
+    )
+    if resumed:
+        print(f"Resuming {len(ranges)} ranges at {resumed}/{size} bytes: {path}")
+    else:
+        print(f"Downloading in {len(ranges)} ranges ({size} bytes): {path}")
+
+    lock = threading.Lock()
+    failed = threading.Event()
+    started = time.perf_counter()
+    downloaded = resumed
+
+    def report(received):
+        nonlocal downloaded
+        with lock:
+            downloaded += received
+            if progress_hook:
+                elapsed = time.perf_counter() - started
+                progress_hook(
+                    {
+                        "status": "downloading",
+                        "filename": path,
+                        "downloaded_bytes": downloaded,
+                        "total_bytes": size,
+                        "elapsed": elapsed,
+                        "speed": (downloaded - resumed) / elapsed if elapsed else None,
+                    }
+                )
+
+    def fetch(part, start, end):
+        length = end - start + 1
+        attempt = 0
+        while True:
+            done = os.path.getsize(part) if os.path.exists(part) else 0
+            if done > length:
+                # Not ours, or a range that changed with the file
+                os.remove(part)
+                done = 0
+            if done == length:
+                return
+            if failed.is_set():
+                # Another range failed, its error is the one raised
+                return
+            first = start + done
+            last = end if not request_size else min(end, first + request_size - 1)
+            try:
+                received = _fetch_range(
+                    open_range, part, first, last, validator, report, failed
+                )
+                if not received and not failed.is_set():
+                    raise IOError(f"no data for bytes {first}-{last}")
+            except RangeNotSupported:
+                failed.set()
+                raise
+            except Exception as e:
+                attempt += 1
+                if attempt >= RANGE_ATTEMPTS:
+                    failed.set()
+                    raise
+                print(f"Range {start}-{end} failed ({e}), retrying")
+                time.sleep(attempt)
+                continue
+            # Progress resets the attempts, a long range may take many requests
+            attempt = 0
+
+    with ThreadPoolExecutor(
+        max_workers=len(ranges), thread_name_prefix="range"
+    ) as executor:
+        futures = [
+            executor.submit(fetch, part, start, end)
+            for part, (start, end) in zip(parts, ranges)
+        ]
+    for future in futures:
+        # The first failure, the parts on disk are kept for the next attempt
+        future.result()
+
+    _join_parts(path, parts, ranges, size)
+    _remove_parts(path, len(parts))
+    if progress_hook:
+        progress_hook(
+            {
+                "status": "finished",
+                "filename": path,
+                "downloaded_bytes": size,
+                "total_bytes": size,
+                "elapsed": time.perf_counter() - started,
+            }
+        )
+    return True
+
+
+# One request for bytes first-last, appended to the part file. Returns the
+# bytes received, which may be fewer when the connection ends early.
+def _fetch_range(open_range, part, first, last, validator, report, failed):
+    response = open_range(first, last, validator)
+    try:
+        content_range = parse_content_range(response)
+        if response.status != 206 or not content_range:
+            # A 200 answer to If-Range means the file changed
+            raise RangeNotSupported(
+                f"expected bytes {first}-{last}, got HTTP {response.status}"
+            )
+        if content_range[:2] != (first, last):
+            raise RangeNotSupported(
+                f"expected bytes {first}-{last}, got {content_range[0]}-{content_range[1]}"
+            )
+        validator_now = response_validator(response)
+        if validator and validator_now and validator_now != validator:
+            raise RangeNotSupported("the file changed on the server")
+        received = 0
+        with open(part, "ab") as file:
+            while not failed.is_set() and received <= last - first:
+                block = response.read(READ_SIZE)
+                if not block:
+                    break
+                file.write(block)
+                received += len(block)
+                report(len(block))
+        return received
+    finally:
+        response.close()
+
+
+# Checks every part against its range, then writes them in order into
+# `path` (through a temporary file, so `path` never holds a partial file).
+def _join_parts(path, parts, ranges, size):
+    for part, (start, end) in zip(parts, ranges):
+        if os.path.getsize(part) != end - start + 1:
+            raise IOError(
+                f"{part} has {os.path.getsize(part)} bytes, expected {end - start + 1}"
+            )
+    joined = f"{path}.joining"
+    with open(joined, "wb") as out:
+        for part in parts:
+            with open(part, "rb") as file:
+                while True:
+                    block = file.read(1024 * 1024)
+                    if not block:
+                        break
+                    out.write(block)
+    if os.path.getsize(joined) != size:
+        os.remove(joined)
+        raise IOError(f"Joined file has the wrong size, expected {size} bytes")
+    os.replace(joined, path)
@@ -0,0 +1,459 @@
+# Headless entry point: `python -m app URL [URL ...]` or `python -m app -f links.txt`.
+# Progress is written to stdout as JSON lines, log output goes to stderr.
+# Only the download modules are imported, none of the GUI stack.
+import argparse
+import contextlib
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+
+from app.archive import DownloadArchive
+from app.batch import BatchDownloader, DEFAULT_WORKERS
+from app.client import DEFAULT_HOST, DEFAULT_PORT
+from app.downloader import (
+    PROFILES,
+    DEFAULT_PROFILE,
+    clean_youtube_url,
+    download_audio,
+    get_default_downloader,
+)
+from app.ffmpeg import set_ffmpeg_location
+from app.metrics import REGISTRY
+from app.playlist import is_playlist_url
+from app.prefetch import prefetch_infos, shortest_first
+from app.scheduler import SCHEDULER, parse_rate
+from app.staging import Staging
+from app.urls import iter_file_links, iter_unique_urls
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="python -m app",
+        description="Download YouTube audio as MP3 or other formats.",
+    )
+    parser.add_argument(
+        "urls",
+        nargs="*",
+        metavar="URL",
+        help="YouTube links, playlist and channel links are expanded (uses --queue)",
+    )
+    parser.add_argument(
+        "-f",
+        "--file",
+        help="read links (separated by spaces or newlines) from a file, - for stdin",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        default=str(Path.home() / "Downloads"),
+        help="output folder (default: ~/Downloads)",
+    )
+    parser.add_argument(
+        "-n", "--name", help="file name, only for a single link (no extension)"
+    )
+    parser.add_argument(
+        "-p",
+        "--profile",
+        choices=PROFILES,
+        default=DEFAULT_PROFILE.name,
+        metavar="PROFILE",
+        help="output format: "
+        + ", ".join(f"{p.name} ({p.label})" for p in PROFILES.values())
+        + f" (default: {DEFAULT_PROFILE.name})",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=DEFAULT_WORKERS,
+        help=f"parallel downloads in batch mode (default: {DEFAULT_WORKERS})",
+    )
+    parser.add_argument(
+        "--pipeline",
+        action="store_true",
+        help="run fetching and transcoding in separate pools",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="pipe downloads straight into FFmpeg without writing the source file",
+    )
+    parser.add_argument(
+        "--chunked",
+        action="store_true",
+        help="download large files (16 MB and up) over several connections at once",
+    )
+    parser.add_argument(
+        "--staging",
+        metavar="DIR",
+        help="folder for downloads in progress, finished files are moved to the"
+        " output folder (default: ~/.portableyt/staging)",
+    )
+    parser.add_argument(
+        "--ffmpeg",
+        metavar="PATH",
+        help="FFmpeg binary or the folder with ffmpeg and ffprobe (default: the"
+        " PORTABLEYT_FFMPEG variable, the app folder, then PATH)",
+    )
+    parser.add_argument(
+        "--prefetch",
+        action="store_true",
+        help="check every link before downloading (reports title, duration and"
+        " size, fails bad links early) and download the shortest videos first",
+    )
+    parser.add_argument(
+        "--limit-rate",
+        type=parse_rate,
+        metavar="RATE",
+        help="total bandwidth of all downloads, e.g. 500K or 2M (default: no limit)",
+    )
+    parser.add_argument(
+        "--max-per-host",
+        type=int,
+        metavar="N",
+        help="parallel downloads against the same host (default: no limit)",
+    )
+    parser.add_argument(
+        "--queue",
+        nargs="?",
+        const="",
+        metavar="FILE",
+        help="run through the persistent job queue with retries"
+        " (default file: ~/.portableyt/jobs.sqlite3)",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="continue the unfinished jobs of the queue (implies --queue)",
+    )
+    parser.add_argument(
+        "--retries",
+        type=int,
+        default=5,
+        help="attempts per job for transient errors with --queue (default: 5)",
+    )
+    parser.add_argument(
+        "--serve",
+        action="store_true",
+        help="run the job server: keep the workers loaded and take links over"
+        " HTTP (see app/server.py), the given links are queued first",
+    )
+    parser.add_argument(
+        "--host",
+        default=DEFAULT_HOST,
+        help=f"address of the job server (default: {DEFAULT_HOST})",
+    )
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=DEFAULT_PORT,
+        help=f"port of the job server (default: {DEFAULT_PORT})",
+    )
+    parser.add_argument(
+        "--allow-any-output",
+        action="store_true",
+        help="let job server clients choose any output folder, not only"
+        " folders inside --output",
+    )
+    parser.add_argument(
+        "--force", action="store_true", help="re-download already downloaded videos"
+    )
+    parser.add_argument(
+        "--metrics-jsonl",
+        metavar="FILE",
+        help="append per-job timings to this JSON-lines file",
+    )
+    parser.add_argument(
+        "--metrics-prom",
+        metavar="FILE",
+        help="write totals in Prometheus text format to this file",
+    )
+    parser.add_argument(
+        "--no-archive",
+        action="store_true",
+        help="neither check nor update the download archive",
+    )
+    return parser
+
+
+# Links from the arguments and the --file, canonical and without repeats.
+# The file is read line by line as the links are consumed.
+def read_urls(args):
+    links = iter(args.urls)
+    if args.file:
+        links = itertools.chain(links, iter_file_links(args.file))
+    return iter_unique_urls(links)
+
+
+# Writes one JSON object per line to the real stdout:
+class EventWriter:
+    def __init__(self, stream):
+        self.stream = stream
+        self._lock = threading.Lock()
+
+    def emit(self, event, **fields):
+        line = json.dumps({"event": event, "time": time.time(), **fields})
+        with self._lock:
+            self.stream.write(line + "\n")
+            self.stream.flush()
+
+
+def result_status(result):
+    if result.cancelled:
+        return "cancelled"
+    if result.error:
+        return "failed"
+    return "skipped" if result.skipped else "done"
+
+
+def run_single(args, url, archive, events):
+    events.emit("start", url=url)
+    try:
+        file_name = download_audio(
+            clean_youtube_url(url),
+            args.output,
+            args.name,
+            archive=archive,
+            force=args.force,
+            profile=args.profile,
+        )
+    except Exception as e:
+        events.emit("result", index=1, url=url, status="failed", error=str(e))
+        return 1
+    events.emit("result", index=1, url=url, status="done", file=file_name)
+    return 0
+
+
+# For prefetch_infos: reports each checked link as an "info" event
+def info_emitter(events):
+    def on_info(info):
+        events.emit(
+            "info",
+            url=info.url,
+            title=info.title,
+            duration=info.duration,
+            size=info.size,
+            error=str(info.error) if info.error else None,
+        )
+
+    return on_info
+
+
+def run_batch(args, urls, archive, events):
+    unavailable = 0
+    if args.prefetch:
+        infos = prefetch_infos(urls, profile=args.profile, on_info=info_emitter(events))
+        urls = [info.url for info in shortest_first(infos) if info.ok]
+        unavailable = len(infos) - len(urls)
+    if args.pipeline:
+        from app.pipeline import PipelinedBatchDownloader
+
+        engine = PipelinedBatchDownloader(
+            args.output,
+            download_workers=args.workers,
+            archive=archive,
+            force=args.force,
+            profile=args.profile,
+        )
+    else:
+        engine = BatchDownloader(
+            args.output,
+            workers=args.workers,
+            archive=archive,
+            force=args.force,
+            profile=args.profile,
+        )
+
+    def on_result(result):
+        events.emit(
+            "result",
+            index=result.index,
+            url=result.url,
+            status=result_status(result),
+            file=result.file_name,
+            error=str(result.error) if result.error else None,
+        )
+
+    events.emit("start", total=len(urls))
+    results = []
+    worker = threading.Thread(
+        target=lambda: results.extend(engine.run(urls, on_result=on_result))
+    )
+    worker.start()
+    try:
+        # Joining with a timeout keeps Ctrl+C deliverable to the main thread
+        while worker.is_alive():
+            worker.join(0.2)
+    except KeyboardInterrupt:
+        engine.cancel()
+        events.emit("cancelling")
+        worker.join()
+
+    counts = {"failed": unavailable} if unavailable else {}
+    for result in results:
+        status = result_status(result)
+        counts[status] = counts.get(status, 0) + 1
+    events.emit("finished", total=len(urls) + unavailable, **counts)
+    return 1 if counts.get("failed") or counts.get("cancelled") else 0
+
+
+def run_queue(args, urls, archive, events):
+    from app.jobqueue import JobQueue, QueueInUse, QueueRunner, RetryPolicy
+
+    try:
+        queue = JobQueue(
+            args.queue or None, retry=RetryPolicy(max_attempts=args.retries)
+        )
+    except QueueInUse as e:
+        events.emit("error", error=str(e))
+        return 1
+    try:
+        queue.clear_finished(keep_failed=True)
+        runner = QueueRunner(
+            queue,
+            workers=args.workers,
+            archive=archive,
+            force=args.force,
+            transcode_workers=(os.cpu_count() or 1) if args.pipeline else None,
+        )
+        runner.feed(
+            urls,
+            args.output,
+            args.profile,
+            prefetch=args.prefetch,
+            on_info=info_emitter(events),
+        )
+
+        def on_event(event, job):
+            events.emit(
+                event,
+                job=job.id,
+                url=job.url,
+                attempt=job.attempts,
+                file=job.file_name,
+                error=job.last_error,
+            )
+
+        events.emit("start", queued=queue.unfinished())
+        worker = threading.Thread(target=lambda: runner.run(on_event=on_event))
+        worker.start()
+        try:
+            while worker.is_alive():
+                worker.join(0.2)
+        except KeyboardInterrupt:
+            runner.cancel()
+            events.emit("cancelling")
+            worker.join()
+
+        counts = queue.counts()
+        events.emit("finished", **counts)
+        return 1 if counts.get("failed") or queue.unfinished() else 0
+    finally:
+        queue.close()
+
+
+# Runs the job server until Ctrl+C. The queue file is the server's own
+# unless --queue FILE is given.
+def run_server(args, urls, archive, events):
+    from app.jobqueue import QueueInUse
+    from app.server import JobServer
+
+    try:
+        server = JobServer(
+            args.output,
+            host=args.host,
+            port=args.port,
+            workers=args.workers,
+            archive=archive,
+            force=args.force,
+            profile=args.profile,
+            queue_path=args.queue or None,
+            allow_any_output=args.allow_any_output,
+        )
+    except QueueInUse as e:
+        events.emit("error", error=str(e))
+        return 1
+    urls = list(urls)
+    if urls:
+        server.submit(urls, prefetch=args.prefetch)
+    events.emit("listening", url=server.url)
+    try:
+        server.serve()
+    except KeyboardInterrupt:
+        events.emit("stopped")
+    return 0
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    urls = read_urls(args)
+    # Enough links to tell a single download from a batch
+    head = list(itertools.islice(urls, 2))
+    if args.resume and args.queue is None:
+        args.queue = ""
+    if not head and not args.resume and not args.serve:
+        parser.error("no URLs given")
+    if args.name and len(head) > 1:
+        parser.error("--name can only be used with a single URL")
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if args.stream and args.pipeline:
+        parser.error("--stream and --pipeline cannot be combined")
+    if args.stream and args.chunked:
+        parser.error("--stream and --chunked cannot be combined")
+    if args.serve and (args.pipeline or args.name):
+        parser.error("--serve cannot be combined with --pipeline or --name")
+    if args.max_per_host is not None and args.max_per_host < 0:
+        parser.error("--max-per-host must be at least 0")
+
+    if args.ffmpeg:
+        # Before the first get_default_downloader(), which takes the default
+        set_ffmpeg_location(args.ffmpeg)
+    if args.staging:
+        staging = Staging(args.staging)
+        staging.cleanup_stale()
+        get_default_downloader().staging = staging
+    if args.stream:
+        get_default_downloader().stream = True
+    if args.chunked:
+        get_default_downloader().chunked = True
+    if args.limit_rate:
+        SCHEDULER.set_rate(args.limit_rate)
+    if args.max_per_host:
+        SCHEDULER.set_per_host(args.max_per_host)
+    events = EventWriter(sys.stdout)
+    archive = None if args.no_archive else DownloadArchive()
+    # Library prints would break the JSON lines, send them to stderr
+    with contextlib.redirect_stdout(sys.stderr):
+        try:
+            if args.serve:
+                return run_server(args, itertools.chain(head, urls), archive, events)
+            # The queue takes the links as they are read, the batch engines
+            # need the whole list
+            if args.queue is not None:
+                return run_queue(args, itertools.chain(head, urls), archive, events)
+            urls = head + list(urls)
+            # Playlists are expanded into the queue while it runs
+            if any(map(is_playlist_url, urls)):
+                args.queue = ""
+                return run_queue(args, urls, archive, events)
+            if len(urls) == 1:
+                return run_single(args, urls[0], archive, events)
+            return run_batch(args, urls, archive, events)
+        finally:
+            if archive is not None:
+                archive.close()
+            write_metrics(args, events)
+
+
+def write_metrics(args, events):
+    events.emit("metrics", **REGISTRY.summary())
+    if args.metrics_jsonl:
+        REGISTRY.to_jsonl(args.metrics_jsonl)
+    if args.metrics_prom:
+        REGISTRY.to_prometheus(args.metrics_prom)
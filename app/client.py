@@ -0,0 +1,128 @@
+# Client of the job server (app.server), standard library only. The window
+# uses it when PORTABLEYT_SERVER is set, e.g. to http://127.0.0.1:8765.
+import json
+import os
+import urllib.error
+import urllib.request
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+# Environment variable with the address of the job server to use
+SERVER_ENV = "PORTABLEYT_SERVER"
+
+
+# The job server address from the environment, None to download locally
+def configured_server():
+    return os.environ.get(SERVER_ENV) or None
+
+
+# Error reply of the server (or no server at the address):
+class ServerError(Exception):
+    pass
+
+
+class JobClient:
+    def __init__(self, url, timeout=10):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+
+    def _request(self, method, path, data=None, timeout=None):
+        body = json.dumps(data).encode("utf-8") if data is not None else None
+        request = urllib.request.Request(
+            self.url + path,
+            data=body,
+            method=method,
+            headers={"Content-Type": "application/json"} if body else {},
+        )
+        try:
+            return urllib.request.urlopen(request, timeout=timeout or self.timeout)
+        except urllib.error.HTTPError as e:
+            try:
+                message = json.load(e).get("error")
+            except ValueError:
+                message = None
+            raise ServerError(f"{e.code} {message or e.reason}") from e
+        except urllib.error.URLError as e:
+            raise ServerError(f"No job server at {self.url}: {e.reason}") from e
+
+    def _json(self, method, path, data=None):
+        with self._request(method, path, data) as response:
+            return json.load(response)
+
+    def health(self):
+        return self._json("GET", "/health")
+
+    # Queues the links, returns {"jobs": [new job ids], "expanding": count}
+    def submit(self, urls, output_folder=None, profile=None, prefetch=False):
+        data = {"urls": list(urls), "prefetch": prefetch}
+        if output_folder:
+            data["output"] = output_folder
+        if profile:
+            data["profile"] = profile
+        return self._json("POST", "/jobs", data)
+
+    def jobs(self, state=None):
+        return self._json("GET", "/jobs" + (f"?state={state}" if state else ""))
+
+    def job(self, job_id):
+        return self._json("GET", f"/jobs/{job_id}")
+
+    def retry_failed(self):
+        return self._json("POST", "/jobs/retry", {})["retried"]
+
+    def limits(self):
+        return self._json("GET", "/limits")
+
+    # rate: bytes per second or text like "2M", None removes a limit
+    def set_limits(self, **limits):
+        return self._json("PUT", "/limits", limits)
+
+    # Opens the event stream of the server. Iterating the returned response
+    # yields its JSON lines as bytes, see iter_events.
+    def open_events(self):
+        return self._request("GET", "/events", timeout=60)
+
+
+# Decoded events of an open_events() response (heartbeats skipped):
+def iter_events(response):
+    for line in response:
+        if line.strip():
+            yield json.loads(line)
+
+
+# One batch of the window sent to the server: run() submits the links and
+# reports the rows of the server's jobs (on_row(job_id, fields), fields as in
+# the window's batch list, other clients' jobs included) until the server
+# runs out of work. cancel() only
+# stops following the batch, the server keeps working through it.
+class RemoteBatch:
+    def __init__(self, client):
+        self.client = client
+        self.cancelled = False
+
+    # Returns the number of jobs per final status:
+    def run(self, urls, output_folder, profile=None, prefetch=False, on_row=None):
+        statuses = {}
+        # Subscribed before submitting so no change of the new jobs is missed
+        with self.client.open_events() as events:
+            reply = self.client.submit(urls, output_folder, profile, prefetch)
+            if not reply["jobs"] and not reply["expanding"]:
+                return statuses
+            for event in iter_events(events):
+                if self.cancelled or event.get("event") == "idle":
+                    break
+                job_id = event.pop("job", None)
+                if job_id is None:
+                    continue
+                if event.get("status") in ("done", "skipped", "failed"):
+                    statuses[job_id] = event["status"]
+                if on_row:
+                    on_row(job_id, event)
+        counts = {}
+        for status in statuses.values():
+            counts[status] = counts.get(status, 0) + 1
+        return counts
+
+    def cancel(self):
+        self.cancelled = True
@@ -1,18 +1,150 @@
 import os
-import sys
-from yt_dlp import YoutubeDL
+import subprocess
+import threading
+import time
+from collections import deque
+from contextlib import ExitStack, contextmanager
+from dataclasses import dataclass
+from functools import partial
+from typing import Optional
 from urllib.parse import urlparse, parse_qs, urlunparse, urlencode
 
+from app.chunked import CHUNKED_MIN_SIZE, RangeNotSupported, download_chunked
+from app.ffmpeg import (
+    VBR_ENCODERS,
+    VBR_FALLBACK_KBPS,
+    Capabilities,
+    get_ffmpeg,
+)
+from app.metrics import REGISTRY, JobTimer
+from app.scheduler import SCHEDULER
+from app.staging import (
+    STAGING_DIR,
+    STAGING_ENV,
+    JobDirInUse,
+    NotEnoughSpace,
+    Staging,
+)
+from app.urls import canonical_url, video_id
 
+# Bitrate (kbps) of the produced mp3 files
+MP3_QUALITY = "192"
+
+
+# What a download produces. `quality` is a bitrate in kbps, a VBR level (0-9,
+# 0 is best) or None to keep the source stream without re-encoding when the
+# codec already matches. `format` is the yt-dlp selector, it prefers sources
+# that need the least work to reach `codec`.
+@dataclass(frozen=True)
+class OutputProfile:
+    name: str
+    label: str
+    codec: str
+    quality: Optional[str]
+    format: str
+
+    # Extension of the produced files (None: depends on the source)
+    @property
+    def ext(self):
+        return None if self.codec == "best" else CODEC_EXTENSIONS[self.codec]
+
+
+# Output codec -> (file extension, codec name reported by ffprobe); the
+# FFmpeg encoder is picked from what the build has (app.ffmpeg)
+CODEC_EXTENSIONS = {"mp3": "mp3", "opus": "opus", "m4a": "m4a", "vorbis": "ogg"}
+SOURCE_CODECS = {"mp3": "mp3", "opus": "opus", "m4a": "aac", "vorbis": "vorbis"}
+# FFmpeg muxer of each output extension, for outputs without a usable file name
+EXTENSION_MUXERS = {"mp3": "mp3", "opus": "opus", "m4a": "ipod", "ogg": "ogg"}
+
+# Download protocols that can be streamed straight into FFmpeg. Fragmented
+# formats (HLS, DASH segments) go through yt-dlp's own downloaders instead.
+STREAM_PROTOCOLS = ("http", "https")
+# Bytes requested per HTTP range when the extractor does not suggest a size
+# (YouTube throttles single requests for a whole file)
+STREAM_CHUNK_SIZE = 10 * 1024 * 1024
+STREAM_READ_SIZE = 64 * 1024
+# Lines of FFmpeg's error output kept for the message of a failed stream
+STREAM_ERROR_LINES = 20
+
+PROFILES = {
+    profile.name: profile
+    for profile in (
+        OutputProfile(
+            "mp3-320",
+            "MP3 320 kbps",
+            "mp3",
+            "320",
+            "bestaudio[acodec=mp3]/bestaudio/best",
+        ),
+        OutputProfile(
+            "mp3-192",
+            "MP3 192 kbps",
+            "mp3",
+            MP3_QUALITY,
+            "bestaudio[acodec=mp3]/bestaudio/best",
+        ),
+        OutputProfile(
+            "mp3-128",
+            "MP3 128 kbps",
+            "mp3",
+            "128",
+            "bestaudio[acodec=mp3]/bestaudio/best",
+        ),
+        OutputProfile(
+            "mp3-v0",
+            "MP3 VBR (best)",
+            "mp3",
+            "0",
+            "bestaudio[acodec=mp3]/bestaudio/best",
+        ),
+        OutputProfile(
+            "opus",
+            "Opus (no re-encode)",
+            "opus",
+            None,
+            "bestaudio[acodec=opus]/bestaudio/best",
+        ),
+        OutputProfile(
+            "m4a",
+            "M4A/AAC (no re-encode)",
+            "m4a",
+            None,
+            "bestaudio[ext=m4a]/bestaudio[acodec^=mp4a]/bestaudio/best",
+        ),
+        OutputProfile(
+            "original", "Original (no re-encode)", "best", None, "bestaudio/best"
+        ),
+    )
+}
+DEFAULT_PROFILE = PROFILES["mp3-192"]
+
+
+def get_profile(name=None):
+    if name is None:
+        return DEFAULT_PROFILE
+    if isinstance(name, OutputProfile):
+        return name
+    try:
+        return PROFILES[name]
+    except KeyError:
+        raise ValueError(
+            f"Unknown output profile {name!r}, choose from: {', '.join(PROFILES)}"
+        )
+
+
+# Paths of ffmpeg and ffprobe, looked up once per process (app.ffmpeg):
 def get_ffmpeg_paths():
-    if getattr(sys, "frozen", False):
-        base_path = sys._MEIPASS  # folder tymczasowy exe
-    else:
-        base_path = os.path.abspath(".")
+    ffmpeg = get_ffmpeg()
+    return ffmpeg.path, ffmpeg.probe_path
 
-    ffmpeg_path = os.path.join(base_path, "ffmpeg.exe")
-    ffprobe_path = os.path.join(base_path, "ffprobe.exe")
-    return ffmpeg_path, ffprobe_path
+
+# Per-user folder for the app's own files (download archive, caches):
+def get_data_dir():
+    data_dir = os.environ.get("PORTABLEYT_HOME") or os.path.join(
+        os.path.expanduser("~"), ".portableyt"
+    )
+    os.makedirs(data_dir, exist_ok=True)
+    return data_dir
 
 
 def normalize_url(url: str) -> str:
@@ -22,45 +154,884 @@ def normalize_url(url: str) -> str:
     return url
 
 
-def download_audio(url, output_folder, output_name=None):
-    print(
-        f"Starting download: url={url}, output_folder={output_folder}, output_name={output_name}"
-    )
-    outtmpl = (
+# Size of the selected format: exact when the site reports it, else estimated
+# from the bitrate and duration.
+def estimate_size(info):
+    formats = info.get("requested_formats") or [info]
+    total = 0
+    for fmt in formats:
+        size = fmt.get("filesize") or fmt.get("filesize_approx")
+        if not size:
+            bitrate = fmt.get("abr") or fmt.get("tbr")
+            if not bitrate or not info.get("duration"):
+                return None
+            size = info["duration"] * bitrate * 1000 / 8
+        total += size
+    return int(total)
+
+
+# The NotEnoughSpace behind a failed download (yt-dlp wraps the ones raised
+# by progress hooks, sometimes twice), else None:
+def _no_space(error):
+    seen = set()
+    while error is not None and id(error) not in seen:
+        if isinstance(error, NotEnoughSpace):
+            return error
+        seen.add(id(error))
+        original = getattr(error, "exc_info", None)
+        if original and original[1] is not None:
+            error = original[1]
+        else:
+            error = error.__cause__ or error.__context__
+    return None
+
+
+# Lets a full disk through as NotEnoughSpace instead of a download error:
+def _raise_no_space(error):
+    space = _no_space(error)
+    if space is not None and space is not error:
+        raise space from error
+    if space is not None:
+        raise error
+
+
+def default_staging_root():
+    return os.environ.get(STAGING_ENV) or os.path.join(get_data_dir(), STAGING_DIR)
+
+
+def build_outtmpl(output_folder, output_name=None):
+    return (
         os.path.join(output_folder, f"{output_name}.%(ext)s")
         if output_name
         else os.path.join(output_folder, "%(title)s.%(ext)s")
     )
 
-    ffmpeg_path, ffprobe_path = get_ffmpeg_paths()
+
+# Options of a YoutubeDL that only fetches the profile's source format, the
+# conversion is our own FFmpeg run (transcode_audio).
+def build_ydl_opts(outtmpl, ffmpeg_path=None, profile=None):
+    if ffmpeg_path is None:
+        ffmpeg_path, ffprobe_path = get_ffmpeg_paths()
+    profile = get_profile(profile)
 
     ydl_opts = {
-        "ffmpeg_location": ffmpeg_path,
-        "format": "bestaudio/best",
+        "format": profile.format,
         "outtmpl": outtmpl,
-        "postprocessors": [
-            {
-                "key": "FFmpegExtractAudio",
-                "preferredcodec": "mp3",
-                "preferredquality": "192",
-            }
-        ],
         "quiet": True,
     }
+    # An FFmpeg that was not found is left for yt-dlp to look up on PATH
+    if os.path.isfile(ffmpeg_path):
+        ydl_opts["ffmpeg_location"] = ffmpeg_path
+    return ydl_opts
+
 
-    with YoutubeDL(ydl_opts) as ydl:
-        info = ydl.extract_info(url, download=True)
+# Long-lived download session. FFmpeg paths and options are resolved once and
+# the YoutubeDL instances (loaded extractors plus their pooled HTTP session)
+# are kept warm and handed out one per running job, so a batch only pays the
+# setup cost once per worker instead of once per file.
+# Every job is timed through yt-dlp's hooks into `metrics` (app.metrics) and
+# takes its bandwidth from `scheduler` (app.scheduler) through the same hooks.
+# Jobs work in `staging` (app.staging) and only their result is moved to the
+# output folder.
+class Downloader:
+    def __init__(
+        self,
+        metrics=None,
+        profile=None,
+        stream=False,
+        scheduler=None,
+        info_cache=None,
+        chunked=False,
+        staging=None,
+        ffmpeg=None,
+    ):
+        # app.ffmpeg.FFmpeg, its capabilities are probed with the first job
+        self.ffmpeg = ffmpeg if ffmpeg is not None else get_ffmpeg()
+        self.ffmpeg_path, self.ffprobe_path = self.ffmpeg.path, self.ffmpeg.probe_path
+        self.metrics = metrics if metrics is not None else REGISTRY
+        self.scheduler = scheduler if scheduler is not None else SCHEDULER
+        # app.infocache.InfoCache filled by probe(), opened on the first probe
+        self.info_cache = info_cache
+        self.profile = get_profile(profile)
+        # Pipe downloads into FFmpeg instead of writing the source file first
+        self.stream = stream
+        # Fetch large single files over several connections (app.chunked)
+        self.chunked = chunked
+        if staging is None:
+            staging = Staging(default_staging_root())
+            staging.cleanup_stale()
+        self.staging = staging
+        # Idle instances by (profile name, extract audio)
+        self._idle = {}
+        self._instances = []
+        self._lock = threading.Lock()
+        # Timer and bandwidth share of the job running on each thread, hooks
+        # run on the job's thread
+        self._local = threading.local()
+        # Timers of fetched files waiting for their transcode
+        self._fetched = {}
 
-    # The final downloaded file path (full path)
-    file_path = info["requested_downloads"][0]["filepath"]
-    print(f"Download finished: {file_path}")
+    def _progress_hook(self, d):
+        if d["status"] == "downloading" and d.get("total_bytes"):
+            # Sites that only tell the size once the transfer starts
+            self._admit_format({"filesize": d["total_bytes"]})
+        timer = getattr(self._local, "timer", None)
+        if timer:
+            timer.progress_hook(d)
+        share = getattr(self._local, "share", None)
+        if share:
+            # Blocks the download loop until the bytes fit the budget
+            share.progress_hook(d)
+        on_progress = getattr(self._local, "on_progress", None)
+        if on_progress:
+            on_progress(d)
 
-    # If you want just the file name without folder path:
-    file_name = os.path.basename(file_path)
-    return file_name
+    # _progress_hook for helper threads of the job running on this thread:
+    def _job_progress_hook(self):
+        timer = getattr(self._local, "timer", None)
+        share = getattr(self._local, "share", None)
+        on_progress = getattr(self._local, "on_progress", None)
+
+        def hook(d):
+            self._local.timer = timer
+            self._local.share = share
+            self._local.on_progress = on_progress
+            self._progress_hook(d)
+
+        return hook
+
+    # Borrows an idle YoutubeDL (or creates one) for the duration of a job:
+    @contextmanager
+    def _checkout(self, profile=None):
+        profile = get_profile(profile or self.profile)
+        with self._lock:
+            idle = self._idle.setdefault(profile.name, [])
+            ydl = idle.pop() if idle else None
+        if ydl is None:
+            # Imported here so that runs where every video is skipped
+            # (and `python -m app --help`) never pay for loading yt-dlp
+            from yt_dlp import YoutubeDL
+
+            ydl_opts = build_ydl_opts(
+                build_outtmpl("."), ffmpeg_path=self.ffmpeg_path, profile=profile
+            )
+            ydl_opts["progress_hooks"] = [self._progress_hook]
+            ydl = YoutubeDL(ydl_opts)
+            with self._lock:
+                self._instances.append(ydl)
+        try:
+            yield ydl
+        finally:
+            with self._lock:
+                self._idle[profile.name].append(ydl)
+
+    # Creates `count` YoutubeDL instances for the profile ahead of the first
+    # job (loading yt-dlp with them), so a long-running process pays for it
+    # at startup rather than on its first downloads:
+    def warm_up(self, count=1, profile=None):
+        with ExitStack() as stack:
+            for _ in range(count):
+                stack.enter_context(self._checkout(profile))
+
+    # Metadata only: runs the extraction (format selection included) without
+    # downloading anything and keeps the info dict in the info cache, where
+    # the download of the same video picks it up instead of extracting again.
+    def probe(self, url, profile=None):
+        if self.info_cache is None:
+            from app.infocache import InfoCache
+
+            with self._lock:
+                if self.info_cache is None:
+                    self.info_cache = InfoCache()
+        with self._checkout(profile) as ydl:
+            info = ydl.sanitize_info(ydl.extract_info(url, download=False))
+        self.info_cache.put(info_key(url), info)
+        return info
+
+    def _cached_info(self, url):
+        if self.info_cache is None:
+            return None
+        return self.info_cache.get(info_key(url))
+
+    def _extract(self, url, output_folder, output_name, timer, profile, info=None):
+        self._local.timer = timer
+        try:
+            with self._checkout(profile) as ydl:
+                # The output template is the only option that changes between jobs
+                ydl.params["outtmpl"]["default"] = build_outtmpl(
+                    output_folder, output_name
+                )
+                if self.chunked:
+                    info = self._fetch_chunked(ydl, url, info)
+                elif info is None and self._unsized():
+                    # Select the format first so the job is admitted by its size
+                    info = ydl.extract_info(url, download=False)
+                if info is not None:
+                    self._admit_format(info)
+                    try:
+                        info = ydl.process_ie_result(info, download=True)
+                    except Exception as e:
+                        _raise_no_space(e)
+                        # Expired format URLs and the like, start over
+                        print(f"Cached info failed ({e}), extracting again")
+                        info = ydl.extract_info(url, download=True)
+                else:
+                    info = ydl.extract_info(url, download=True)
+        except Exception as e:
+            self.metrics.record(timer.finish("failed", _no_space(e) or e))
+            _raise_no_space(e)
+            raise
+        finally:
+            self._local.timer = None
+        return info["requested_downloads"][0]["filepath"]
+
+    # Large single-file formats are fetched over several connections
+    # (app.chunked) before yt-dlp's own download runs, which then finds the
+    # file in place and only post-processes it. Returns the processed info.
+    def _fetch_chunked(self, ydl, url, info=None):
+        if info is not None:
+            try:
+                info = ydl.process_ie_result(info, download=False)
+            except Exception as e:
+                _raise_no_space(e)
+                print(f"Cached info failed ({e}), extracting again")
+                info = None
+        if info is None:
+            info = ydl.extract_info(url, download=False)
+        self._admit_format(info)
+        size = info.get("filesize") or info.get("filesize_approx")
+        if (
+            info.get("_type", "video") != "video"
+            or info.get("requested_formats")
+            or info.get("protocol") not in STREAM_PROTOCOLS
+            or (size and size < CHUNKED_MIN_SIZE)
+        ):
+            return info
+        path = ydl.prepare_filename(info)
+        if os.path.exists(path):
+            return info
+        try:
+            download_chunked(
+                partial(open_http_range, ydl, info),
+                path,
+                progress_hook=self._job_progress_hook(),
+                request_size=(info.get("downloader_options") or {}).get(
+                    "http_chunk_size"
+                ),
+            )
+        except RangeNotSupported as e:
+            print(f"Ranged download not possible ({e}), downloading in one piece")
+        return info
+
+    # Streaming variant of _extract + _convert: the selected audio format is
+    # fetched over HTTP and piped into FFmpeg's stdin, so encoding starts with
+    # the first chunk and the source file never touches the disk.
+    # Returns (target path, processed info), the path is None when the format
+    # cannot be streamed (fragmented, merged) and the download falls back to
+    # _extract with the info instead of extracting again.
+    def _stream(self, url, output_folder, output_name, timer, profile, info=None):
+        profile = get_profile(profile or self.profile)
+        try:
+            with self._checkout(profile) as ydl:
+                if info is not None:
+                    info = ydl.process_ie_result(info, download=False)
+                else:
+                    info = ydl.extract_info(url, download=False)
+                self._admit_format(info)
+                if (
+                    info.get("_type", "video") != "video"
+                    or info.get("requested_formats")
+                    or info.get("protocol") not in STREAM_PROTOCOLS
+                ):
+                    return None, info
+                ydl.params["outtmpl"]["default"] = build_outtmpl(
+                    output_folder, output_name
+                )
+                source_path = ydl.prepare_filename(info)
+                extension, codec_args = encoder_args(
+                    profile,
+                    source_codec_name(info.get("acodec")),
+                    self.ffmpeg.capabilities,
+                )
+                target_path = f"{os.path.splitext(source_path)[0]}.{extension}"
+                print(f"Streaming ({' '.join(codec_args)}) into: {target_path}")
+                # Progress goes through the same hook as yt-dlp's downloads
+                # (timer, bandwidth share, listener)
+                self._local.timer = timer
+                stream_to_ffmpeg(
+                    iter_http_chunks(ydl, info),
+                    target_path,
+                    codec_args,
+                    ffmpeg_path=self.ffmpeg_path,
+                    timer=timer,
+                    progress_hook=self._progress_hook,
+                    total_bytes=info.get("filesize"),
+                )
+        except Exception as e:
+            self.metrics.record(timer.finish("failed", e))
+            raise
+        finally:
+            self._local.timer = None
+        return target_path, info
+
+    # Converts a fetched file next to itself with the encoder this FFmpeg
+    # has (transcode_audio) and returns the result's path, timed as the
+    # job's transcode:
+    def _convert(self, timer, source_path, profile):
+        start = time.perf_counter()
+        file_name = transcode_audio(
+            source_path,
+            profile,
+            ffmpeg_path=self.ffmpeg_path,
+            ffprobe_path=self.ffprobe_path,
+            capabilities=self.ffmpeg.capabilities,
+        )
+        timer.add_transcode(time.perf_counter() - start)
+        return os.path.join(os.path.dirname(source_path), file_name)
+
+    # The staging folder of a job (see Staging.job_dir), the job fails when
+    # another process works on it:
+    def _job_dir(self, timer, *key):
+        try:
+            return self.staging.job_dir(*key)
+        except JobDirInUse as e:
+            self.metrics.record(timer.finish("failed", e))
+            raise
+
+    # Admits the job on the staging and output drives (see Staging.reserve),
+    # sized by the cached (prefetched) info when there is one. Without a size
+    # the reservation is sized again by _admit_format once the format is
+    # selected.
+    def _reserve(self, timer, info, output_folder):
+        size = estimate_size(info) if info else None
+        try:
+            reservation = self.staging.reserve(size, output_folder)
+        except NotEnoughSpace as e:
+            self.metrics.record(timer.finish("failed", e))
+            raise
+        self._local.unsized = None if size else (reservation, output_folder)
+        return reservation
+
+    # Whether the job on this thread still waits for its size:
+    def _unsized(self):
+        return getattr(self._local, "unsized", None) is not None
+
+    # (Job thread) Sizes the job's reservation by the selected format of
+    # `info` (Staging.resize) if it was admitted without a size, or by the
+    # first progress event that has the total. May wait for space, raises
+    # NotEnoughSpace when the file does not fit.
+    def _admit_format(self, info):
+        unsized = getattr(self._local, "unsized", None)
+        if unsized is None:
+            return
+        size = estimate_size(info)
+        if size:
+            self._local.unsized = None
+            reservation, output_folder = unsized
+            self.staging.resize(reservation, size, output_folder)
+
+    # Runs the network part of a job within the scheduler's host limit.
+    # on_progress(d) gets the job's progress hook events.
+    @contextmanager
+    def _scheduled(self, url, on_progress=None):
+        with self.scheduler.job(url) as share:
+            self._local.share = share
+            self._local.on_progress = on_progress
+            try:
+                yield share
+            finally:
+                self._local.share = None
+                self._local.on_progress = None
+
+    # Pass a DownloadArchive (app.archive) to skip videos that are already in
+    # output_folder, force=True downloads them again anyway.
+    # profile: an OutputProfile or its name, the session's profile by default.
+    # stream: pipe the download into FFmpeg (see _stream), the session's
+    # setting by default.
+    # on_progress: called with yt-dlp's progress hook dicts from the
+    # downloading thread.
+    def download(
+        self,
+        url,
+        output_folder,
+        output_name=None,
+        archive=None,
+        force=False,
+        profile=None,
+        stream=None,
+        on_progress=None,
+    ):
+        print(
+            f"Starting download: url={url}, output_folder={output_folder}, output_name={output_name}"
+        )
+        profile = get_profile(profile or self.profile)
+        timer = JobTimer(url)
+        video_id = extract_video_id(url)
+        if archive is not None and video_id and not force:
+            entry = archive.find(video_id, output_folder, profile.ext)
+            if entry:
+                print(f"Already downloaded, skipping: {entry.path}")
+                self.metrics.record(timer.finish("skipped"))
+                return os.path.basename(entry.path)
+
+        # The final downloaded file path (full path)
+        file_path = None
+        info = self._cached_info(url)
+        job_dir = self._job_dir(timer, url, output_folder, profile.name, output_name)
+        try:
+            reservation = self._reserve(timer, info, output_folder)
+            try:
+                with self._scheduled(url, on_progress):
+                    if self.stream if stream is None else stream:
+                        file_path, info = self._stream(
+                            url, job_dir, output_name, timer, profile, info
+                        )
+                    converted = file_path is not None
+                    if not converted:
+                        # yt-dlp only fetches the source, see below
+                        file_path = self._extract(
+                            url, job_dir, output_name, timer, profile, info
+                        )
+                if not converted:
+                    # Converted by our own FFmpeg run rather than yt-dlp's
+                    # ExtractAudio, which insists on libmp3lame/libopus, and
+                    # outside the host slot: the network is free for the
+                    # next job
+                    try:
+                        file_path = self._convert(timer, file_path, profile)
+                    except Exception as e:
+                        self.metrics.record(timer.finish("failed", e))
+                        raise
+                file_path = self.staging.finalize(file_path, output_folder)
+            finally:
+                self.staging.release(reservation)
+        except BaseException:
+            # Kept for the retry to resume
+            self.staging.leave(job_dir)
+            raise
+        self.staging.discard(job_dir)
+        print(f"Download finished: {file_path}")
+        self.metrics.record(timer.finish("done"))
+
+        if archive is not None and video_id:
+            archive.add(video_id, file_path, file_extension(file_path))
+
+        # If you want just the file name without folder path:
+        file_name = os.path.basename(file_path)
+        return file_name
+
+    # Network half of download: saves the best audio stream as-is (webm/m4a)
+    # and returns its full path, the conversion is left to transcode.
+    # final=True means no transcode follows and the job is recorded right away.
+    def fetch(
+        self,
+        url,
+        output_folder,
+        output_name=None,
+        final=False,
+        profile=None,
+        on_progress=None,
+    ):
+        print(f"Fetching audio: url={url}, output_folder={output_folder}")
+        timer = JobTimer(url)
+        info = self._cached_info(url)
+        job_dir = self._job_dir(
+            timer,
+            url,
+            output_folder,
+            get_profile(profile or self.profile).name,
+            output_name,
+            "fetch",
+        )
+        try:
+            reservation = self._reserve(timer, info, output_folder)
+        except BaseException:
+            self.staging.leave(job_dir)
+            raise
+        try:
+            with self._scheduled(url, on_progress):
+                file_path = self._extract(
+                    url, job_dir, output_name, timer, profile, info
+                )
+            if final:
+                file_path = self.staging.finalize(file_path, output_folder)
+        except BaseException:
+            self.staging.release(reservation)
+            self.staging.leave(job_dir)
+            raise
+        print(f"Fetch finished: {file_path}")
+        if final:
+            self.staging.release(reservation)
+            self.staging.discard(job_dir)
+            self.metrics.record(timer.finish("done"))
+        else:
+            # The file stays in staging (and keeps its disk space) until
+            # transcode moves the result to the output folder
+            with self._lock:
+                self._fetched[file_path] = (timer, output_folder, job_dir, reservation)
+        return file_path
+
+    def transcode(self, source_path, profile=None):
+        with self._lock:
+            fetched = self._fetched.pop(source_path, None)
+        timer, output_folder, job_dir, reservation = fetched or (
+            JobTimer(source_path),
+            None,
+            None,
+            None,
+        )
+        try:
+            file_path = self._convert(
+                timer, source_path, get_profile(profile or self.profile)
+            )
+            if output_folder is not None:
+                self.staging.finalize(file_path, output_folder)
+                self.staging.discard(job_dir)
+        except Exception as e:
+            self.metrics.record(timer.finish("failed", e))
+            if job_dir is not None:
+                self.staging.leave(job_dir)
+            raise
+        finally:
+            if reservation is not None:
+                self.staging.release(reservation)
+        self.metrics.record(timer.finish("done"))
+        return os.path.basename(file_path)
+
+    # Gives up on a file from fetch() that will not be transcoded (an
+    # aborted pipeline): its disk space is released, its folder kept for a
+    # retry and the job recorded as cancelled.
+    def discard_fetched(self, source_path):
+        with self._lock:
+            fetched = self._fetched.pop(source_path, None)
+        if fetched is None:
+            return
+        timer, output_folder, job_dir, reservation = fetched
+        self.staging.release(reservation)
+        self.staging.leave(job_dir)
+        self.metrics.record(timer.finish("cancelled"))
+
+    # Closes every YoutubeDL created by the session (and their HTTP sessions)
+    # and lets go of fetched files nobody transcoded:
+    def close(self):
+        with self._lock:
+            instances, self._instances = self._instances, []
+            self._idle = {}
+            fetched = list(self._fetched)
+        for ydl in instances:
+            ydl.close()
+        for source_path in fetched:
+            self.discard_fetched(source_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+_default_downloader = None
+_default_downloader_lock = threading.Lock()
+
+
+# Session shared by the module level helpers below:
+def get_default_downloader():
+    global _default_downloader
+    with _default_downloader_lock:
+        if _default_downloader is None:
+            _default_downloader = Downloader()
+        return _default_downloader
+
+
+def download_audio(
+    url, output_folder, output_name=None, archive=None, force=False, profile=None
+):
+    return get_default_downloader().download(
+        url, output_folder, output_name, archive=archive, force=force, profile=profile
+    )
+
+
+def fetch_audio(url, output_folder, output_name=None, profile=None):
+    return get_default_downloader().fetch(
+        url, output_folder, output_name, profile=profile
+    )
+
+
+# Key of a video in the info cache: its YouTube ID, else the link itself
+def info_key(url):
+    return extract_video_id(url) or normalize_url(url)
+
+
+def file_extension(path):
+    return os.path.splitext(path)[1].lstrip(".").lower()
+
+
+# Codec name of the first audio stream of a file, as reported by ffprobe:
+def probe_audio_codec(path, ffprobe_path=None):
+    if ffprobe_path is None:
+        ffmpeg_path, ffprobe_path = get_ffmpeg_paths()
+    process = subprocess.run(
+        [
+            ffprobe_path,
+            "-v",
+            "error",
+            "-select_streams",
+            "a:0",
+            "-show_entries",
+            "stream=codec_name",
+            "-of",
+            "csv=p=0",
+            path,
+        ],
+        capture_output=True,
+        text=True,
+    )
+    return process.stdout.strip() or None
+
+
+# ffprobe's name for a yt-dlp `acodec` value ("mp4a.40.2" -> "aac"):
+def source_codec_name(acodec):
+    if not acodec or acodec == "none":
+        return None
+    name = acodec.split(".")[0].lower()
+    return {"mp4a": "aac"}.get(name, name)
+
+
+# FFmpeg arguments that turn a `source_codec` stream into the profile's output.
+# Returns (extension, codec arguments), the stream is copied when possible.
+# The encoder and its threads follow `capabilities` (app.ffmpeg), without it
+# the usual encoder of the codec is used.
+def encoder_args(profile, source_codec, capabilities=None):
+    codec = profile.codec
+    if codec == "best":
+        # Keep whatever came in if it fits a known container, else make mp3
+        codec = next(
+            (out for out, src in SOURCE_CODECS.items() if src == source_codec), "mp3"
+        )
+        if SOURCE_CODECS[codec] == source_codec:
+            return CODEC_EXTENSIONS[codec], ["-codec:a", "copy"]
+        profile = DEFAULT_PROFILE
+
+    # Same codec already: re-encoding could only lose quality, like yt-dlp copy it
+    if SOURCE_CODECS[codec] == source_codec:
+        return CODEC_EXTENSIONS[codec], ["-codec:a", "copy"]
+
+    capabilities = capabilities or Capabilities()
+    encoder, extra_args = capabilities.encoder(codec)
+    args = ["-codec:a", encoder, *extra_args]
+    if profile.quality is not None:
+        if float(profile.quality) > 10:
+            args += ["-b:a", f"{profile.quality}k"]
+        elif encoder in VBR_ENCODERS:
+            args += ["-q:a", profile.quality]
+        else:
+            args += ["-b:a", f"{VBR_FALLBACK_KBPS}k"]
+    args += capabilities.thread_args(encoder)
+    return CODEC_EXTENSIONS[codec], args
+
+
+# CPU half of download_audio: converts a fetched file to the profile's format
+# with one FFmpeg process (a stream copy when the codec already matches),
+# removes the source and returns the new file name.
+def transcode_audio(
+    source_path, profile=None, ffmpeg_path=None, ffprobe_path=None, capabilities=None
+):
+    profile = get_profile(profile)
+    if ffmpeg_path is None or ffprobe_path is None:
+        ffmpeg_path, ffprobe_path = get_ffmpeg_paths()
+
+    base, ext = os.path.splitext(source_path)
+    source_codec = probe_audio_codec(source_path, ffprobe_path)
+    extension, codec_args = encoder_args(profile, source_codec, capabilities)
+    if ext.lower() == f".{extension}" and codec_args == ["-codec:a", "copy"]:
+        print(f"Already in target format, not transcoding: {source_path}")
+        return os.path.basename(source_path)
+
+    target_path = f"{base}.{extension}"
+    if target_path == source_path:
+        target_path = f"{base}.temp.{extension}"
+    command = [
+        ffmpeg_path,
+        "-y",
+        "-loglevel",
+        "error",
+        "-i",
+        source_path,
+        "-vn",
+        *codec_args,
+        target_path,
+    ]
+    print(f"Transcoding ({' '.join(codec_args)}): {source_path}")
+    process = subprocess.run(command, capture_output=True, text=True)
+    if process.returncode != 0:
+        if os.path.exists(target_path):
+            os.remove(target_path)
+        raise RuntimeError(f"FFmpeg failed: {process.stderr.strip()}")
+
+    os.remove(source_path)
+    if target_path.endswith(f".temp.{extension}"):
+        os.replace(target_path, source_path)
+        target_path = source_path
+    print(f"Transcode finished: {target_path}")
+    return os.path.basename(target_path)
+
+
+# Yields the body of a resolved yt-dlp format in blocks, requested in HTTP
+# ranges of the size the extractor suggests. Requests go through the
+# YoutubeDL's own HTTP session (cookies, proxy, impersonation).
+def iter_http_chunks(ydl, info, read_size=STREAM_READ_SIZE):
+    from yt_dlp.networking import Request
+
+    headers = info.get("http_headers") or {}
+    chunk_size = (info.get("downloader_options") or {}).get(
+        "http_chunk_size"
+    ) or STREAM_CHUNK_SIZE
+    total = info.get("filesize")
+    start = 0
+    while total is None or start < total:
+        end = start + chunk_size - 1
+        if total is not None:
+            end = min(end, total - 1)
+        requested = end - start + 1
+        response = ydl.urlopen(
+            Request(info["url"], headers={**headers, "Range": f"bytes={start}-{end}"})
+        )
+        try:
+            ranged = response.status == 206
+            content_range = response.headers.get("Content-Range") or ""
+            if ranged and "/" in content_range:
+                size = content_range.rsplit("/", 1)[1]
+                if size.isdigit():
+                    total = int(size)
+            received = 0
+            while True:
+                block = response.read(read_size)
+                if not block:
+                    break
+                received += len(block)
+                yield block
+        finally:
+            response.close()
+        start += received
+        # The server sent the whole file, or less than asked: nothing is left
+        if not ranged or received < requested:
+            break
+
+
+# Opens a request for bytes start-end of the info's format, for app.chunked:
+def open_http_range(ydl, info, start, end, validator=None):
+    from yt_dlp.networking import Request
+
+    headers = {**(info.get("http_headers") or {}), "Range": f"bytes={start}-{end}"}
+    if validator:
+        headers["If-Range"] = validator
+    return ydl.urlopen(Request(info["url"], headers=headers))
+
+
+# Feeds `chunks` (bytes) into an FFmpeg process that writes the target file.
+# The output goes to a .part file that is renamed once FFmpeg is done, so an
+# interrupted stream never leaves a truncated file under the final name.
+# Progress is reported in yt-dlp's hook format to progress_hook (by default
+# the timer's), the transcode time after the last chunk to the timer.
+def stream_to_ffmpeg(
+    chunks,
+    target_path,
+    codec_args,
+    ffmpeg_path=None,
+    timer=None,
+    progress_hook=None,
+    total_bytes=None,
+):
+    if ffmpeg_path is None:
+        ffmpeg_path, ffprobe_path = get_ffmpeg_paths()
+    extension = file_extension(target_path)
+    part_path = f"{target_path}.part"
+    command = [
+        ffmpeg_path,
+        "-y",
+        "-loglevel",
+        "error",
+        "-i",
+        "pipe:0",
+        "-vn",
+        *codec_args,
+        "-f",
+        EXTENSION_MUXERS[extension],
+        part_path,
+    ]
+    process = subprocess.Popen(
+        command,
+        stdin=subprocess.PIPE,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+    )
+    # Drained while the chunks go in: a source that logs an error per frame
+    # would otherwise fill the pipe and stall FFmpeg and our writes with it
+    errors = deque(maxlen=STREAM_ERROR_LINES)
+    reader = threading.Thread(target=errors.extend, args=(process.stderr,), daemon=True)
+    reader.start()
+    if progress_hook is None and timer:
+        progress_hook = timer.progress_hook
+    downloaded = 0
+    started = time.perf_counter()
+
+    def report(status):
+        if progress_hook:
+            elapsed = time.perf_counter() - started
+            progress_hook(
+                {
+                    "status": status,
+                    "downloaded_bytes": downloaded,
+                    "total_bytes": total_bytes,
+                    "speed": downloaded / elapsed if elapsed else None,
+                }
+            )
+
+    report("downloading")
+    try:
+        try:
+            for chunk in chunks:
+                process.stdin.write(chunk)
+                downloaded += len(chunk)
+                report("downloading")
+        except BrokenPipeError:
+            # FFmpeg quit early, its error output says why
+            pass
+        finally:
+            process.stdin.close()
+        report("finished")
+
+        # Encoding overlaps the download, only the tail after the last chunk
+        # counts as transcode time
+        start = time.perf_counter()
+        returncode = process.wait()
+        reader.join()
+        if returncode != 0:
+            error = b"".join(errors).decode(errors="replace").strip()
+            raise RuntimeError(f"FFmpeg failed: {error}")
+        if timer:
+            timer.add_transcode(time.perf_counter() - start)
+    except BaseException:
+        process.kill()
+        process.wait()
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        raise
+    finally:
+        reader.join()
+        process.stderr.close()
+
+    os.replace(part_path, target_path)
+    print(f"Stream finished: {target_path}")
+    return target_path
 
 
 def clean_youtube_url(url: str) -> str:
+    # Any form of video link becomes the plain watch URL
+    found = video_id(url)
+    if found:
+        return canonical_url(found)
+
     # Normalize URL (add https if missing)
     if not url.startswith("http"):
         url = "https://" + url
@@ -68,10 +1039,12 @@ def clean_youtube_url(url: str) -> str:
     parsed_url = urlparse(url)
     query_params = parse_qs(parsed_url.query)
 
-    # Keep only the 'v' param if it exists
+    # Keep only the 'v' param if it exists ('list' too for playlist pages)
     clean_params = {}
     if "v" in query_params:
         clean_params["v"] = query_params["v"]
+    elif parsed_url.path.rstrip("/") == "/playlist" and "list" in query_params:
+        clean_params["list"] = query_params["list"]
 
     # Rebuild query string
     clean_query = urlencode(clean_params, doseq=True)
@@ -89,3 +1062,8 @@ def clean_youtube_url(url: str) -> str:
     )
 
     return clean_url
+
+
+# Extracting the ID of the video from the URL (app.urls matcher):
+def extract_video_id(url):
+    return video_id(url)
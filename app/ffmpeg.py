@@ -0,0 +1,224 @@
+# FFmpeg discovery and capabilities. The binaries are looked up once per
+# process: in the configured location (PORTABLEYT_FFMPEG or --ffmpeg, a
+# binary or its folder), next to the app (the PyInstaller bundle, or the
+# current folder when run from source) and on PATH. What the found FFmpeg can
+# do (version, audio encoders and their threading) is probed once and kept
+# in the app data folder until the binary changes.
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import threading
+from dataclasses import dataclass, field
+from typing import Optional
+
+# Environment variable with the FFmpeg to use (binary or folder)
+FFMPEG_ENV = "PORTABLEYT_FFMPEG"
+# Probe results inside the app data folder, by binary path
+PROBE_CACHE_FILE = "ffmpeg-probe.json"
+
+# Encoders of each output codec in order of preference: the usual external
+# library first, FFmpeg's own encoder (or a fast fixed-point one) when the
+# build lacks it
+ENCODER_CHOICES = {
+    "mp3": ("libmp3lame", "libshine"),
+    "opus": ("libopus", "opus"),
+    "m4a": ("libfdk_aac", "aac"),
+    "vorbis": ("libvorbis", "vorbis"),
+}
+# Encoders that take a VBR level through -q:a
+VBR_ENCODERS = ("libmp3lame", "libvorbis")
+# Bitrate (kbps) for VBR profiles on encoders without VBR: the standard MP3
+# bitrate closest to LAME's V0
+VBR_FALLBACK_KBPS = "256"
+
+# " A....D libmp3lame   libmp3lame MP3 (MPEG audio layer 3) (codec mp3)"
+_ENCODER_RE = re.compile(r"^\s*([VAS.])([F.])([S.])([X.])[B.][D.]\s+(\S+)")
+_VERSION_RE = re.compile(r"^ffmpeg version (\S+)")
+
+
+def executable(name):
+    return f"{name}.exe" if os.name == "nt" else name
+
+
+# Folder the app ships FFmpeg in: the unpacked bundle of the frozen exe,
+# else the current folder
+def bundle_dir():
+    if getattr(sys, "frozen", False):
+        return sys._MEIPASS
+    return os.path.abspath(".")
+
+
+# Paths of ffmpeg and ffprobe. `location` (default: PORTABLEYT_FFMPEG) may
+# name the ffmpeg binary or its folder. A tool that is found nowhere is
+# returned as its bare name, so running it fails with a clear "not found".
+def find_tools(location=None):
+    location = location or os.environ.get(FFMPEG_ENV)
+    folders = [bundle_dir()]
+    if location:
+        location = os.path.abspath(location)
+        # A configured binary brings its ffprobe along
+        folders.insert(
+            0, location if os.path.isdir(location) else os.path.dirname(location)
+        )
+
+    tools = []
+    for name in ("ffmpeg", "ffprobe"):
+        if name == "ffmpeg" and location and os.path.isfile(location):
+            tools.append(location)
+            continue
+        candidates = [os.path.join(folder, executable(name)) for folder in folders]
+        path = next((path for path in candidates if os.path.isfile(path)), None)
+        tools.append(path or shutil.which(name) or executable(name))
+    return tools[0], tools[1]
+
+
+# What one FFmpeg binary can do, from `ffmpeg -version` and `-encoders`:
+@dataclass
+class Capabilities:
+    version: Optional[str] = None
+    # Audio encoder name -> FFmpeg's flags ("A.S..D": F frame threads,
+    # S slice threads, X experimental)
+    encoders: dict = field(default_factory=dict)
+
+    @property
+    def probed(self):
+        return bool(self.encoders)
+
+    # The encoder for an output codec and the arguments it needs beyond
+    # -codec:a. Without probe results the usual encoder is assumed.
+    def encoder(self, codec):
+        choices = ENCODER_CHOICES[codec]
+        if not self.probed:
+            return choices[0], []
+        for name in choices:
+            flags = self.encoders.get(name)
+            if flags is None:
+                continue
+            return name, ["-strict", "-2"] if "X" in flags else []
+        return choices[0], []
+
+    # -threads for an encoder: the audio encoders without frame or slice
+    # threading run on one thread anyway, a single thread keeps FFmpeg from
+    # starting a pool per process when several transcodes run in parallel.
+    # Threaded ones get FFmpeg's automatic count.
+    def thread_args(self, encoder):
+        flags = self.encoders.get(encoder)
+        if flags is None or "F" in flags[1:3] or "S" in flags[1:3]:
+            return []
+        return ["-threads", "1"]
+
+
+def _run(ffmpeg_path, *args):
+    return subprocess.run(
+        [ffmpeg_path, "-hide_banner", *args],
+        capture_output=True,
+        text=True,
+        errors="replace",
+        timeout=30,
+    ).stdout
+
+
+def run_probe(ffmpeg_path):
+    capabilities = Capabilities()
+    match = _VERSION_RE.match(_run(ffmpeg_path, "-version"))
+    if match:
+        capabilities.version = match.group(1)
+    # The encoders follow a legend of the flags, up to a "------" line
+    listing = _run(ffmpeg_path, "-encoders").partition("------")[2]
+    for line in listing.splitlines():
+        match = _ENCODER_RE.match(line)
+        if match and match.group(1) == "A":
+            capabilities.encoders[match.group(5)] = "".join(match.group(1, 2, 3, 4))
+    return capabilities
+
+
+# Capabilities of the binary, probed on the first call for each binary
+# version and then read from the cache file. A missing or broken FFmpeg gives
+# empty capabilities (not cached).
+def probe(ffmpeg_path, cache_path=None):
+    if cache_path is None:
+        from app.downloader import get_data_dir
+
+        cache_path = os.path.join(get_data_dir(), PROBE_CACHE_FILE)
+    try:
+        stat = os.stat(ffmpeg_path)
+    except OSError:
+        return Capabilities()
+    key = os.path.abspath(ffmpeg_path)
+    stamp = [stat.st_mtime_ns, stat.st_size]
+
+    try:
+        with open(cache_path, encoding="utf-8") as file:
+            cache = json.load(file)
+    except (OSError, ValueError):
+        cache = {}
+    entry = cache.get(key)
+    if entry and entry.get("stamp") == stamp:
+        return Capabilities(entry["version"], entry["encoders"])
+
+    try:
+        capabilities = run_probe(ffmpeg_path)
+    except (OSError, subprocess.SubprocessError) as e:
+        print(f"Could not probe FFmpeg at {ffmpeg_path}: {e}")
+        return Capabilities()
+    print(
+        f"FFmpeg {capabilities.version} at {ffmpeg_path}: "
+        f"{len(capabilities.encoders)} audio encoders"
+    )
+    cache[key] = {
+        "stamp": stamp,
+        "version": capabilities.version,
+        "encoders": capabilities.encoders,
+    }
+    temp_path = f"{cache_path}.tmp"
+    try:
+        with open(temp_path, "w", encoding="utf-8") as file:
+            json.dump(cache, file, indent=1)
+        os.replace(temp_path, cache_path)
+    except OSError as e:
+        print(f"Could not save the FFmpeg probe: {e}")
+    return capabilities
+
+
+# FFmpeg of a session: paths resolved when created, capabilities probed on
+# first use.
+class FFmpeg:
+    def __init__(self, location=None):
+        self.path, self.probe_path = find_tools(location)
+        self._capabilities = None
+        self._lock = threading.Lock()
+
+    @property
+    def found(self):
+        return os.path.isfile(self.path)
+
+    @property
+    def capabilities(self):
+        with self._lock:
+            if self._capabilities is None:
+                self._capabilities = probe(self.path)
+            return self._capabilities
+
+
+_default_ffmpeg = None
+_default_ffmpeg_lock = threading.Lock()
+
+
+# The FFmpeg every download uses unless told otherwise, looked up once:
+def get_ffmpeg():
+    global _default_ffmpeg
+    with _default_ffmpeg_lock:
+        if _default_ffmpeg is None:
+            _default_ffmpeg = FFmpeg()
+        return _default_ffmpeg
+
+
+# Points the default FFmpeg somewhere else (before the first download):
+def set_ffmpeg_location(location):
+    global _default_ffmpeg
+    with _default_ffmpeg_lock:
+        _default_ffmpeg = FFmpeg(location)
+        return _default_ffmpeg
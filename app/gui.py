@@ -1,13 +1,32 @@
+import os
 import threading
 import pyperclip
-import requests
-from io import BytesIO
 from pathlib import Path
 from PIL import Image
 import customtkinter as ctk
 from tkinter import messagebox, filedialog
 
-from app.downloader import download_audio, clean_youtube_url
+from app.downloader import (
+    DEFAULT_PROFILE,
+    PROFILES,
+    download_audio,
+    clean_youtube_url,
+    extract_video_id,
+)
+from app.archive import DownloadArchive
+from app.scheduler import SCHEDULER, parse_rate
+from app.thumbnails import ThumbnailService
+from app.jobqueue import JobQueue, QueueInUse, QueueRunner
+from app.urls import iter_links, iter_unique_urls
+from app.progress import FRAME_MS, ProgressBus, progress_fields
+from app.progressview import ProgressList
+from app.tasks import TaskExecutor
+from app.client import JobClient, RemoteBatch, ServerError, configured_server
+
+# Fields of the batch list rows a job server reports
+ROW_FIELDS = ("name", "status", "percent", "speed")
+# Seconds closing the window waits for a cancelled batch to stop
+CLOSE_WAIT_SECONDS = 10
 
 
 class App(ctk.CTk):
@@ -15,18 +34,32 @@ class App(ctk.CTk):
         # Class constructing
         super().__init__()
         self.title("YT to MP3 Converter")
-        self.geometry("500x500")
+        self.geometry("500x605")
         self.resizable(False, False)
         self.configure(
             fg_color="#1e1e1e",  # Background color of window
             corner_radius=10,  # Rounded window corners (not all platforms)
         )
-        # Setting up object to delay function call:
-        self.url_check_timer = None
+        # Background work started by the window (debounced URL checks,
+        # thumbnail lookups, downloads on their own threads), results come
+        # back on this thread:
+        self.tasks = TaskExecutor(self)
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
 
         # Tracking if batch mode is ON/OFF
         self.is_batch_mode = False
 
+        # Batch engine of the currently running batch (None when idle)
+        self.batch_downloader = None
+
+        # Batch jobs are kept on disk so a batch survives closing the app
+        # (None while another window or a --queue run has the queue open):
+        self.job_queue = self.open_job_queue()
+
+        # With PORTABLEYT_SERVER set, batches go to that job server instead
+        server_url = configured_server()
+        self.server_client = JobClient(server_url) if server_url else None
+
         # Setting background color
         bg_color = self.cget("bg")  # get main window background color
 
@@ -36,9 +69,28 @@ class App(ctk.CTk):
             light_image=black_img, dark_image=black_img, size=(250, 150)
         )
 
+        # Background thumbnail loader and the video ID the window wants to show:
+        self.thumbnails = ThumbnailService()
+        self.thumbnail_video_id = None
+
         # Default download folder for mp3:
         self.output_folder = str(Path.home() / "Downloads")
 
+        # Index of already downloaded videos, used to skip them:
+        self.archive = DownloadArchive()
+        self.force_download = ctk.BooleanVar(value=False)
+        # Batch: check every link before downloading, shortest videos first
+        self.prefetch_links = ctk.BooleanVar(value=False)
+
+        # Batch progress posted by the download workers, applied once per frame:
+        self.progress_bus = ProgressBus()
+
+        # Output format, the option menu shows the profile labels:
+        self.profile_label = ctk.StringVar(value=DEFAULT_PROFILE.label)
+
+        # Total bandwidth of all downloads, applied right away when changed:
+        self.speed_limit = ctk.StringVar(value="Unlimited")
+
         # -------------------------FRAMES----------------------------------
 
         # Input frame - fixed spot in the main layout 1 (row=0)
@@ -92,14 +144,15 @@ class App(ctk.CTk):
         # -------------------------- Input frame widgets ------------------------------
         # Batch
         self.batch_label = ctk.CTkLabel(
-            self.input_frame, text="Batch URLs (one per line)"
+            self.input_frame,
+            text="Batch URLs (one per line, playlists and channels too)",
         )
         self.batch_label.grid(row=0, column=0, pady=(5, 0), sticky="")
         self.batch_label.grid_remove()
 
         self.batch_textbox = ctk.CTkTextbox(
             self.input_frame,
-            height=244,
+            height=110,
             width=400,
             fg_color="#2b2b2b",
             text_color="white",
@@ -108,6 +161,11 @@ class App(ctk.CTk):
         self.batch_textbox.bind("<<Paste>>", self.on_batch_paste)
         self.batch_textbox.grid_remove()
 
+        # Status, percent and speed of every item of the batch
+        self.progress_list = ProgressList(self.input_frame, height=126)
+        self.progress_list.grid(row=2, column=0, pady=(0, 5), sticky="")
+        self.progress_list.grid_remove()
+
         # Single
         self.url_label = ctk.CTkLabel(self.input_frame, text="YouTube URL")
         self.url_label.grid(row=0, column=0, pady=(5, 0), sticky="")
@@ -162,6 +220,41 @@ class App(ctk.CTk):
             text_color="white",
         )
         self.folder_path_label.grid(row=2, column=0, pady=5, sticky="")
+
+        self.force_checkbox = ctk.CTkCheckBox(
+            self.directory_frame,
+            text="Re-download already downloaded videos",
+            variable=self.force_download,
+        )
+        self.force_checkbox.grid(row=3, column=0, pady=5, sticky="")
+
+        self.prefetch_checkbox = ctk.CTkCheckBox(
+            self.directory_frame,
+            text="Batch: check all links first, shortest videos first",
+            variable=self.prefetch_links,
+        )
+        self.prefetch_checkbox.grid(row=5, column=0, pady=5, sticky="")
+
+        # Output format and speed limit side by side
+        self.options_frame = ctk.CTkFrame(
+            self.directory_frame, fg_color=bg_color, border_width=0, corner_radius=0
+        )
+        self.options_frame.grid(row=4, column=0, pady=5, sticky="")
+
+        self.profile_menu = ctk.CTkOptionMenu(
+            self.options_frame,
+            values=[profile.label for profile in PROFILES.values()],
+            variable=self.profile_label,
+        )
+        self.profile_menu.grid(row=0, column=0, padx=5, sticky="")
+
+        self.speed_menu = ctk.CTkOptionMenu(
+            self.options_frame,
+            values=["Unlimited", "512 KB/s", "1 MB/s", "2 MB/s", "5 MB/s", "10 MB/s"],
+            variable=self.speed_limit,
+            command=self.set_speed_limit,
+        )
+        self.speed_menu.grid(row=0, column=1, padx=5, sticky="")
         # ----------------------------------------------------------------------------
 
         # ------------------------ Button frame widgets ------------------------------
@@ -193,8 +286,67 @@ class App(ctk.CTk):
         else:
             self.show_placeholder(self.placeholder_image)
 
+        # Offer to continue a batch that was interrupted last time (a job
+        # server resumes its own)
+        if not self.server_client and self.job_queue and self.job_queue.unfinished():
+            self.after(500, self.offer_resume)
+
+        self.pump_id = self.after(FRAME_MS, self.pump_progress)
+
     # ------------------------- FUNCTIONS -------------------------------
 
+    # Applies what the workers posted since the last frame:
+    def pump_progress(self):
+        changes, status = self.progress_bus.drain()
+        if changes:
+            self.progress_list.apply(changes)
+        if status:
+            self.update_status(*status)
+        self.pump_id = self.after(FRAME_MS, self.pump_progress)
+
+    # Window closed: a running batch stops taking new jobs, pending background
+    # work is dropped and the stores are closed. Downloads still running end
+    # with the process; their queue jobs go back to pending and resume next
+    # time.
+    def on_close(self):
+        print("Closing window")
+        runner = self.batch_downloader
+        if runner:
+            runner.cancel()
+        self.after_cancel(self.pump_id)
+        self.tasks.shutdown()
+        self.thumbnails.close()
+        # The queue workers use the queue and the archive until their job is
+        # done; still running after the wait, they are left open for the exit
+        if not isinstance(runner, QueueRunner) or runner.join(CLOSE_WAIT_SECONDS):
+            if self.job_queue is not None:
+                self.job_queue.close()
+            self.archive.close()
+        else:
+            print("Batch still running, leaving the queue for the next start")
+        self.destroy()
+
+    # The job queue, or None when another process owns it:
+    def open_job_queue(self):
+        try:
+            return JobQueue()
+        except QueueInUse as e:
+            print(e)
+            return None
+
+    # Asking whether to resume the unfinished batch jobs from the last session:
+    def offer_resume(self):
+        unfinished = self.job_queue.unfinished()
+        if messagebox.askyesno(
+            "Resume batch",
+            f"{unfinished} downloads from the last batch did not finish. Resume them?",
+        ):
+            if not self.is_batch_mode:
+                self.toggle_batch_mode()
+            self.start_batch("", self.force_download.get(), self.selected_profile())
+        else:
+            self.job_queue.discard_unfinished()
+
     def on_batch_paste(self, event):
         cursor_pos = self.batch_textbox.index("insert")
         clipboard = self.batch_textbox.clipboard_get()
@@ -226,6 +378,7 @@ class App(ctk.CTk):
             # Show batch widgets
             self.batch_label.grid()
             self.batch_textbox.grid()
+            self.progress_list.grid()
 
         else:
             print("Batch mode OFF")
@@ -233,6 +386,7 @@ class App(ctk.CTk):
             # Hide batch widgets
             self.batch_label.grid_remove()
             self.batch_textbox.grid_remove()
+            self.progress_list.grid_remove()
 
             # Restore single URL inputs
             self.url_label.grid()
@@ -249,18 +403,14 @@ class App(ctk.CTk):
             self.thumbnail_frame.grid_propagate(True)
             self.thumb_label.grid()
 
-    # Starts timer after the user URL input for the validity check:
+    # Checks the URL once the user stopped typing for a moment:
     def on_url_change(self, event=None):
-        if self.url_check_timer:
-            self.url_check_timer.cancel()  # Cancel previous timer if still running
-
-        self.url_check_timer = threading.Timer(0.7, self.check_url_validity)
-        self.url_check_timer.start()
+        self.tasks.debounce("url-check", 700, self.check_url_validity)
 
-    # (Background thread) Swap to main thread, strips the URL and starts the process for validation:
+    # Strips the URL and starts the process for validation:
     def check_url_validity(self):
         url = self.url_entry.get().strip()
-        self.after(0, lambda: self._process_url(url))
+        self._process_url(url)
 
     # Showing the thumbnail call:
     def _process_url(self, url):
@@ -275,52 +425,50 @@ class App(ctk.CTk):
         self.thumb_label.configure(image=ctk_image)
         self.thumb_label.image = ctk_image
 
-    # Showing the thumbnail of the video:
+    # Showing the thumbnail of the video (cached images show instantly,
+    # others are loaded in the background and shown when ready):
     def show_thumbnail_from_url(self, url):
         print(f"Fetching thumbnail for URL: {url}")
-        try:
-            # 1. Extract the YouTube video ID from the URL (you need a method `extract_video_id` for this)
-            video_id = self.extract_video_id(url)
-
-            if video_id:
-                # 2. Construct the thumbnail URL based on the video ID
-                thumb_url = f"https://img.youtube.com/vi/{video_id}/hqdefault.jpg"
-
-                # 3. Send a GET request to fetch the thumbnail image bytes
-                response = requests.get(thumb_url, timeout=3)
+        video_id = self.extract_video_id(url)
+        self.thumbnail_video_id = video_id
 
-                # 4. Open the image from the downloaded bytes and resize it to 250x150 px
-                image = Image.open(BytesIO(response.content)).resize((250, 150))
-
-                # 5. Wrap the image for CustomTkinter to handle light/dark mode
-                ctk_image = ctk.CTkImage(
-                    light_image=image, dark_image=image, size=(250, 150)
-                )
+        if not video_id:
+            # If video ID couldn't be extracted, show the placeholder instead
+            print("Invalid video ID, showing placeholder")
+            self.show_placeholder(self.placeholder_image)
+            return
 
-                # 6. Update your thumbnail label to display this image
-                self.thumb_label.configure(image=ctk_image)
-                self.thumb_label.image = (
-                    ctk_image  # keep reference to prevent garbage collection
-                )
+        ctk_image = self.thumbnails.get_cached(video_id)
+        if ctk_image is not None:
+            self.show_thumbnail(video_id, ctk_image)
+            return
 
-                print(f"Thumbnail loaded for video ID: {video_id}")
-            else:
-                # If video ID couldn't be extracted, show the placeholder instead
-                print("Invalid video ID, showing placeholder")
-                self.show_placeholder(self.placeholder_image)
+        # A newer lookup replaces this one, stale images are never shown
+        self.tasks.submit(
+            "thumbnail",
+            self.thumbnails.load,
+            video_id,
+            on_done=lambda ctk_image: self.show_thumbnail(video_id, ctk_image),
+            on_error=lambda e: self.show_thumbnail(video_id, None),
+        )
 
-        except Exception as e:
-            # Catch any errors (network, invalid image, etc.) and fallback to placeholder
-            print(f"Exception while loading thumbnail: {e}")
+    # Showing a loaded thumbnail unless the URL changed in the meantime:
+    def show_thumbnail(self, video_id, ctk_image):
+        if video_id != self.thumbnail_video_id:
+            return
+        if ctk_image is None:
+            # Errors (network, invalid image, etc.) fall back to the placeholder
             self.show_placeholder(self.placeholder_image)
+            return
+        self.thumb_label.configure(image=ctk_image)
+        self.thumb_label.image = (
+            ctk_image  # keep reference to prevent garbage collection
+        )
+        print(f"Thumbnail loaded for video ID: {video_id}")
 
     # Extracting the ID of the video from the URL:
     def extract_video_id(self, url):
-        if "v=" in url:
-            return url.split("v=")[-1].split("&")[0]
-        elif "youtu.be/" in url:
-            return url.split("youtu.be/")[-1].split("?")[0]
-        return None
+        return extract_video_id(url)
 
     # User choice of the output folder:
     def select_folder(self):
@@ -353,32 +501,59 @@ class App(ctk.CTk):
             self.update_status("Downloading...", "orange")
             self.show_thumbnail_from_url(url)
 
-            # Starts the download process in the side thread:
-            threading.Thread(
-                target=self._run_download, args=(url, name), daemon=True
-            ).start()
-
-    def _run_download(self, url, name):
-        try:
-            print(f"Download started for URL: {url}")
+            # Starts the download process in the background:
+            self.tasks.start_thread(
+                self._run_download,
+                url,
+                name,
+                self.force_download.get(),
+                self.selected_profile(),
+                on_done=self.on_download_done,
+                on_error=self.on_download_failed,
+                name="download",
+            )
 
-            # Download audio (blocking call)
-            download_audio(url, self.output_folder, name if name else None)
+    # Changes the shared bandwidth budget, running downloads included:
+    def set_speed_limit(self, choice):
+        if choice == "Unlimited":
+            SCHEDULER.set_rate(None)
+        else:
+            SCHEDULER.set_rate(parse_rate(choice.replace(" ", "")))
+
+    # Name of the output profile picked in the option menu:
+    def selected_profile(self):
+        label = self.profile_label.get()
+        for profile in PROFILES.values():
+            if profile.label == label:
+                return profile.name
+        return DEFAULT_PROFILE.name
+
+    # (Worker thread) The download itself, results go to the callbacks below:
+    def _run_download(self, url, name, force=False, profile=None):
+        print(f"Download started for URL: {url}")
+
+        # Download audio (blocking call)
+        return download_audio(
+            url,
+            self.output_folder,
+            name if name else None,
+            archive=self.archive,
+            force=force,
+            profile=profile,
+        )
 
-            # Schedule UI update back on main thread
-            self.after(0, lambda: self.update_status("Download complete!", "green"))
-            print("Download succeeded")
+    def on_download_done(self, file_name):
+        print("Download succeeded")
+        self.update_status("Download complete!", "green")
 
-        except Exception as e:
-            self.after(0, lambda: self.update_status("Failed to download", "red"))
-            print(f"Download failed: {e}")
-            self.after(0, lambda: messagebox.showerror("Error", str(e)))
+    def on_download_failed(self, error):
+        print(f"Download failed: {error}")
+        self.update_status("Failed to download", "red")
+        messagebox.showerror("Error", str(error))
 
-    # Initialize batch download in the side thread:
+    # Initialize batch download in the background:
     def batch_download(self):
-        self.after(
-            0, lambda: self.update_status("Starting batch download...", "orange")
-        )
+        self.update_status("Starting batch download...", "orange")
         if not hasattr(self, "batch_textbox"):
             messagebox.showerror("Error", "Batch mode is not enabled.")
             return
@@ -387,52 +562,182 @@ class App(ctk.CTk):
             messagebox.showerror("Error", "Please enter at least one URL")
             return
 
-        # Now start the thread and pass the urls_text as argument
-        threading.Thread(
-            target=self._batch_download_worker, args=(urls_text,), daemon=True
-        ).start()
-
-    # Proper batch download:
-    def _batch_download_worker(self, urls_text):
-        urls = [url.strip() for url in urls_text.split() if url.strip()]
-        print(f"Batch downloading {len(urls)} URLs")
-
-        # Disable download buttons during batch
-        self.after(
-            0,
-            lambda: (
-                self.download_button.configure(state="disabled"),
-                self.batch_button.configure(state="disabled"),
-            ),
-        )
-
-        for i, url in enumerate(urls, start=1):
-            try:
-                clean_url = clean_youtube_url(url)
-                name = download_audio(clean_url, self.output_folder)
-                self.after(
-                    0,
-                    lambda name=name, idx=i: self.update_status(
-                        f"Downloaded {idx}/{len(urls)}: {name}", "green"
-                    ),
-                )
-            except Exception as e:
-                self.after(
-                    0,
-                    lambda url=url, idx=i: self.update_status(
-                        f"Failed {idx}/{len(urls)}: {url}", "red"
-                    ),
-                )
+        self.start_batch(
+            urls_text,
+            self.force_download.get(),
+            self.selected_profile(),
+            self.prefetch_links.get(),
+        )
+
+    # Runs the batch worker in the background, the download button turns
+    # into the cancel button until it is done:
+    def start_batch(self, urls_text, force=False, profile=None, prefetch=False):
+        self.progress_list.clear()
+        self.download_button.configure(text="Cancel", command=self.cancel_batch)
+        self.batch_button.configure(state="disabled")
+        self.tasks.start_thread(
+            self._batch_download_worker,
+            urls_text,
+            force,
+            profile,
+            prefetch,
+            on_done=self.on_batch_finished,
+            on_error=self.on_batch_finished,
+            name="batch",
+        )
 
-        self.after(
-            0, lambda: self.update_status("Batch download complete!", color="#800080")
+    def on_batch_finished(self, result=None):
+        if isinstance(result, Exception):
+            print(f"Batch download failed: {result}")
+            self.progress_bus.post_status("Batch download failed", "red")
+        self.download_button.configure(
+            text="Download MP3", command=self.download, state="normal"
         )
+        self.batch_button.configure(state="normal")
+
+    # Batch on the job server: the window only shows the rows. Cancelling
+    # stops following it, the server finishes the jobs on its own.
+    def _remote_batch_worker(self, urls, profile=None, prefetch=False):
+        self.batch_downloader = RemoteBatch(self.server_client)
+
+        # (Worker thread) Rows as the server reports them:
+        def on_row(job_id, fields):
+            self.progress_bus.post(
+                job_id,
+                **{name: fields[name] for name in ROW_FIELDS if name in fields},
+            )
+            if fields.get("status") == "failed":
+                self.progress_bus.post_status(f"Failed: {fields.get('error')}", "red")
 
-        # Re-enable buttons on main thread
-        self.after(
-            0,
-            lambda: (
-                self.download_button.configure(state="normal"),
-                self.batch_button.configure(state="normal"),
-            ),
+        self.progress_bus.post_status(
+            f"Sending batch to {self.server_client.url}", "orange"
+        )
+        try:
+            counts = self.batch_downloader.run(
+                urls, self.output_folder, profile, prefetch, on_row
+            )
+        except ServerError as e:
+            print(f"Job server failed: {e}")
+            self.progress_bus.post_status(str(e), "red")
+            return
+        finally:
+            cancelled = self.batch_downloader.cancelled
+            self.batch_downloader = None
+
+        if cancelled:
+            message = "Left the batch to the job server"
+        elif counts.get("failed"):
+            message = f"Batch download complete! ({counts['failed']} failed)"
+        else:
+            message = "Batch download complete!"
+        self.progress_bus.post_status(message, color="#800080")
+
+    # (Worker thread) Reports a link checked by the prefetch pass:
+    def on_link_checked(self, info):
+        if info.ok:
+            minutes, seconds = divmod(int(info.duration or 0), 60)
+            self.progress_bus.post_status(
+                f"Checked: {info.title} ({minutes}:{seconds:02d})", "orange"
+            )
+        else:
+            print(f"Link check failed: {info.url}: {info.error}")
+            self.progress_bus.post_status(f"Check failed: {info.url}", "red")
+
+    # Cancels the running batch, jobs already downloading are allowed to finish
+    # and the rest stays in the queue:
+    def cancel_batch(self):
+        if self.batch_downloader:
+            print("Cancelling batch download")
+            self.batch_downloader.cancel()
+            self.download_button.configure(state="disabled")
+            self.update_status("Cancelling batch...", "orange")
+
+    # Proper batch download (queues the URLs and works through the queue):
+    def _batch_download_worker(
+        self, urls_text, force=False, profile=None, prefetch=False
+    ):
+        urls = iter_unique_urls(iter_links(urls_text.splitlines()))
+        if self.server_client:
+            self._remote_batch_worker(list(urls), profile, prefetch)
+            return
+        if self.job_queue is None:
+            # The other process may have finished in the meantime
+            self.job_queue = self.open_job_queue()
+            if self.job_queue is None:
+                self.progress_bus.post_status(
+                    "The download queue is in use by another PortableYT, try"
+                    " again when it is done",
+                    "red",
+                )
+                return
+        self.job_queue.clear_finished(keep_failed=True)
+        # Fetching and converting overlap: one FFmpeg worker per core
+        self.batch_downloader = QueueRunner(
+            self.job_queue,
+            archive=self.archive,
+            force=force,
+            transcode_workers=os.cpu_count() or 1,
+        )
+        # Playlists and channels are expanded while the first jobs already run
+        self.batch_downloader.feed(
+            urls,
+            self.output_folder,
+            profile,
+            prefetch=prefetch,
+            on_info=self.on_link_checked,
         )
+        done = 0
+        failed = 0
+        done_lock = threading.Lock()
+
+        # (Worker thread) Called as the jobs of the batch change state:
+        def on_event(event, job):
+            nonlocal done, failed
+            if event == "running":
+                self.progress_bus.post(
+                    job.id, name=job.url, status="downloading", percent=None
+                )
+                return
+            if event == "retry":
+                self.progress_bus.post(job.id, status="retrying", speed=None)
+                self.progress_bus.post_status(
+                    f"Retrying later (attempt {job.attempts} failed): {job.url}",
+                    "orange",
+                )
+                return
+            with done_lock:
+                done += 1
+                idx = done
+                if event == "failed":
+                    failed += 1
+            # The total grows while playlists are being expanded
+            total = idx + self.job_queue.unfinished()
+            self.progress_bus.post(
+                job.id, name=job.file_name or job.url, status=event, speed=None
+            )
+            if event == "skipped":
+                self.progress_bus.post_status(
+                    f"Skipped {idx}/{total}: {job.file_name} (already downloaded)",
+                    "gray",
+                )
+            elif event == "done":
+                self.progress_bus.post_status(
+                    f"Downloaded {idx}/{total}: {job.file_name}", "green"
+                )
+            else:
+                self.progress_bus.post_status(f"Failed {idx}/{total}: {job.url}", "red")
+
+        # (Worker thread) Percent and speed of the running downloads:
+        def on_progress(job, d):
+            self.progress_bus.post(job.id, **progress_fields(d))
+
+        self.batch_downloader.run(on_event=on_event, on_progress=on_progress)
+
+        if self.batch_downloader.cancelled:
+            message = f"Batch paused ({done} done), the rest resumes next time"
+        elif failed:
+            message = f"Batch download complete! ({failed} failed)"
+        else:
+            message = "Batch download complete!"
+        self.batch_downloader = None
+        self.progress_bus.post_status(message, color="#800080")
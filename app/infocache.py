@@ -0,0 +1,76 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+from app.downloader import get_data_dir
+
+# Default cache file inside the app data folder
+INFO_CACHE_FILE = "info.sqlite3"
+
+# Format URLs in the info dicts expire (YouTube: after about 6 hours)
+DEFAULT_MAX_AGE = 4 * 60 * 60
+
+# Parts of the info dict the download does not use, dropped to keep the
+# cache small (captions alone are often hundreds of KB)
+DROPPED_KEYS = ("automatic_captions", "subtitles", "thumbnails", "heatmap")
+
+
+# On-disk cache of yt-dlp info dicts from extract_info(download=False), keyed
+# by video ID, so a download can skip the extraction when the metadata was
+# already fetched. Expired entries are dropped when the cache is opened.
+# Safe to share between worker threads.
+class InfoCache:
+    def __init__(self, path=None, max_age=DEFAULT_MAX_AGE):
+        self.path = path or os.path.join(get_data_dir(), INFO_CACHE_FILE)
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS infos (
+                    key TEXT PRIMARY KEY,
+                    info BLOB NOT NULL,
+                    fetched_at REAL NOT NULL
+                )
+                """)
+        self.purge()
+
+    # The cached info dict, None when missing or older than max_age:
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT info, fetched_at FROM infos WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None or time.time() - row[1] > self.max_age:
+            return None
+        return json.loads(zlib.decompress(row[0]))
+
+    # Stores an info dict (already passed through YoutubeDL.sanitize_info):
+    def put(self, key, info):
+        info = {k: v for k, v in info.items() if k not in DROPPED_KEYS}
+        blob = zlib.compress(json.dumps(info).encode("utf-8"))
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO infos VALUES (?, ?, ?)",
+                (key, blob, time.time()),
+            )
+
+    def remove(self, key):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM infos WHERE key = ?", (key,))
+
+    # Drops the entries that are too old to be used:
+    def purge(self):
+        with self._lock, self._conn:
+            return self._conn.execute(
+                "DELETE FROM infos WHERE fetched_at < ?",
+                (time.time() - self.max_age,),
+            ).rowcount
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
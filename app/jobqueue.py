@@ -0,0 +1,642 @@
+import os
+import queue
+import random
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from functools import partial
+from typing import Optional
+
+from app.batch import DEFAULT_WORKERS, find_archived, record_archived
+from app.downloader import (
+    clean_youtube_url,
+    extract_video_id,
+    get_data_dir,
+    get_default_downloader,
+    get_profile,
+)
+from app.playlist import is_playlist_url, iter_playlist_entries
+from app.prefetch import prefetch_infos, shortest_first
+from app.staging import try_lock
+
+# Default queue file inside the app data folder
+QUEUE_FILE = "jobs.sqlite3"
+
+# Playlist entries are written to the queue in groups of this size
+FEED_BATCH_SIZE = 25
+
+# Marks the end of the work for a transcode worker
+_STOP = object()
+
+# Job states
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# Error texts (lower case) that mean trying again later cannot help
+PERMANENT_ERRORS = (
+    "private video",
+    "video unavailable",
+    "this video is not available",
+    "has been removed",
+    "copyright",
+    "sign in to confirm your age",
+    "unsupported url",
+    "is not a valid url",
+    "http error 404",
+    "http error 410",
+)
+# Error texts (lower case) of network blips and server side throttling
+TRANSIENT_ERRORS = (
+    "timed out",
+    "timeout",
+    "temporarily",
+    "temporary failure",
+    "connection reset",
+    "connection aborted",
+    "connection refused",
+    "remote end closed",
+    "network is unreachable",
+    "incomplete read",
+    "unable to download webpage",
+    "http error 429",
+    "http error 500",
+    "http error 502",
+    "http error 503",
+    "http error 504",
+)
+
+
+# The queue file is open in another process (another window, a --queue run
+# or a job server on the same file):
+class QueueInUse(RuntimeError):
+    pass
+
+
+# Whether a failed download is worth retrying:
+def is_transient_error(error):
+    message = str(error).lower()
+    if any(marker in message for marker in PERMANENT_ERRORS):
+        return False
+    if any(marker in message for marker in TRANSIENT_ERRORS):
+        return True
+    # yt-dlp wraps the original exception, network errors are OSErrors
+    original = getattr(error, "exc_info", None)
+    if original and original[1] is not None:
+        error = original[1]
+    return isinstance(error, (OSError, TimeoutError))
+
+
+# Exponential backoff with full jitter between attempts of a job:
+@dataclass
+class RetryPolicy:
+    max_attempts: int = 5
+    base_delay: float = 2.0
+    max_delay: float = 300.0
+
+    def delay(self, attempt):
+        return random.uniform(
+            0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        )
+
+
+# One URL of the queue as stored on disk:
+@dataclass
+class Job:
+    id: int
+    url: str
+    video_id: Optional[str]
+    output_folder: str
+    state: str
+    attempts: int
+    next_attempt_at: float
+    last_error: Optional[str]
+    file_name: Optional[str]
+    profile: Optional[str] = None
+
+
+_JOB_COLUMNS = (
+    "id, url, video_id, output_folder, state, attempts,"
+    " next_attempt_at, last_error, file_name, profile"
+)
+
+
+# Persistent queue of download jobs. Every state change is written to SQLite,
+# so a batch survives crashes and restarts: jobs that were running when the
+# process died go back to pending when the queue is opened again.
+# One process at a time owns a queue file, through an exclusive lock on
+# <file>.lock held until close(); opening it elsewhere raises QueueInUse.
+class JobQueue:
+    def __init__(self, path=None, retry=None):
+        self.path = path or os.path.join(get_data_dir(), QUEUE_FILE)
+        self.retry = retry or RetryPolicy()
+        self._lock = threading.Lock()
+        self._lock_file = open(f"{self.path}.lock", "a+")
+        if not try_lock(self._lock_file):
+            self._lock_file.close()
+            raise QueueInUse(f"The job queue {self.path} is in use by another process")
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    url TEXT NOT NULL,
+                    video_id TEXT,
+                    output_folder TEXT NOT NULL,
+                    state TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt_at REAL NOT NULL DEFAULT 0,
+                    last_error TEXT,
+                    file_name TEXT,
+                    profile TEXT
+                )
+                """)
+            # Queue files from before output profiles existed
+            columns = [row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")]
+            if "profile" not in columns:
+                self._conn.execute("ALTER TABLE jobs ADD COLUMN profile TEXT")
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, next_attempt_at)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS jobs_video_id ON jobs (video_id)"
+            )
+            self._conn.execute(
+                "UPDATE jobs SET state = ? WHERE state = ?", (PENDING, RUNNING)
+            )
+
+    # Queues the URLs, skipping videos that are already waiting in the queue
+    # for the same folder and profile. Returns the ids of the added jobs.
+    # Videos that were downloaded before are queued again, the archive tells
+    # whether the file in that folder and format still exists.
+    def add(self, urls, output_folder, profile=None):
+        profile_name = get_profile(profile).name if profile else None
+        added = []
+        with self._lock, self._conn:
+            for url in urls:
+                video_id = extract_video_id(clean_youtube_url(url))
+                if (
+                    video_id
+                    and self._conn.execute(
+                        "SELECT 1 FROM jobs WHERE video_id = ? AND state IN (?, ?)"
+                        " AND output_folder = ? AND profile IS ?",
+                        (video_id, PENDING, RUNNING, output_folder, profile_name),
+                    ).fetchone()
+                ):
+                    continue
+                cursor = self._conn.execute(
+                    "INSERT INTO jobs (url, video_id, output_folder, state, profile)"
+                    " VALUES (?, ?, ?, ?, ?)",
+                    (url, video_id, output_folder, PENDING, profile_name),
+                )
+                added.append(cursor.lastrowid)
+        return added
+
+    # Marks the next job that is due as running and returns it (None if none is due):
+    def claim(self):
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                f"SELECT {_JOB_COLUMNS} FROM jobs"
+                " WHERE state = ? AND next_attempt_at <= ? ORDER BY id LIMIT 1",
+                (PENDING, time.time()),
+            ).fetchone()
+            if row is None:
+                return None
+            job = Job(*row)
+            job.state = RUNNING
+            job.attempts += 1
+            self._conn.execute(
+                "UPDATE jobs SET state = ?, attempts = ? WHERE id = ?",
+                (job.state, job.attempts, job.id),
+            )
+        return job
+
+    def complete(self, job, file_name):
+        job.state, job.file_name, job.last_error = DONE, file_name, None
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE jobs SET state = ?, file_name = ?, last_error = NULL"
+                " WHERE id = ?",
+                (job.state, job.file_name, job.id),
+            )
+
+    # Schedules a retry with backoff for transient errors, otherwise (or once
+    # the attempts are used up) moves the job to the failed list.
+    def fail(self, job, error, transient=True):
+        job.last_error = str(error)
+        if transient and job.attempts < self.retry.max_attempts:
+            job.state = PENDING
+            job.next_attempt_at = time.time() + self.retry.delay(job.attempts)
+        else:
+            job.state = FAILED
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE jobs SET state = ?, next_attempt_at = ?, last_error = ?"
+                " WHERE id = ?",
+                (job.state, job.next_attempt_at, job.last_error, job.id),
+            )
+
+    # Time of the earliest scheduled retry, None when nothing is pending:
+    def next_due(self):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT MIN(next_attempt_at) FROM jobs WHERE state = ?", (PENDING,)
+            ).fetchone()[0]
+
+    def counts(self):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT state, COUNT(*) FROM jobs GROUP BY state"
+            ).fetchall()
+        return dict(rows)
+
+    def jobs(self, state=None):
+        query = f"SELECT {_JOB_COLUMNS} FROM jobs"
+        params = ()
+        if state:
+            query += " WHERE state = ?"
+            params = (state,)
+        with self._lock:
+            rows = self._conn.execute(query + " ORDER BY id", params).fetchall()
+        return [Job(*row) for row in rows]
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {_JOB_COLUMNS} FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        return Job(*row) if row else None
+
+    # Permanently failed jobs, kept apart from the rest of the queue:
+    def failed_jobs(self):
+        return self.jobs(FAILED)
+
+    def unfinished(self):
+        counts = self.counts()
+        return counts.get(PENDING, 0) + counts.get(RUNNING, 0)
+
+    # Gives the failed jobs a fresh set of attempts:
+    def retry_failed(self):
+        with self._lock, self._conn:
+            return self._conn.execute(
+                "UPDATE jobs SET state = ?, attempts = 0, next_attempt_at = 0"
+                " WHERE state = ?",
+                (PENDING, FAILED),
+            ).rowcount
+
+    # Drops the pending jobs (the user chose not to resume them):
+    def discard_unfinished(self):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "DELETE FROM jobs WHERE state IN (?, ?)", (PENDING, RUNNING)
+            )
+
+    # Forgets done jobs, and the failed list too unless keep_failed is set:
+    def clear_finished(self, keep_failed=False):
+        states = (DONE,) if keep_failed else (DONE, FAILED)
+        with self._lock, self._conn:
+            self._conn.execute(
+                f"DELETE FROM jobs WHERE state IN ({', '.join('?' * len(states))})",
+                states,
+            )
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+            self._lock_file.close()
+
+
+# Works through a JobQueue with a pool of worker threads until no job is left
+# (retries that are scheduled for later are waited for). Cancelling lets the
+# running jobs finish and leaves the rest pending in the queue for next time.
+# With transcode_workers the jobs run in two stages like in
+# PipelinedBatchDownloader (app.pipeline): the workers only fetch the raw
+# audio and a pool of transcode_workers converts it, the bounded hand-over
+# between them keeps the network and the cores busy at the same time.
+class QueueRunner:
+    def __init__(
+        self,
+        queue,
+        workers=DEFAULT_WORKERS,
+        downloader=None,
+        archive=None,
+        force=False,
+        transcode_workers=None,
+    ):
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
+        if transcode_workers is not None and transcode_workers < 1:
+            raise ValueError("transcode_workers must be at least 1")
+        self.queue = queue
+        self.workers = workers
+        self.transcode_workers = transcode_workers
+        self.downloader = downloader or get_default_downloader()
+        self.archive = archive
+        self.force = force
+        self._cancel_event = threading.Event()
+        self._feeders = 0
+        self._feeders_lock = threading.Lock()
+        self._forever = False
+        # Threads of the feeds and of the current run(), for join()
+        self._threads = []
+
+    # Adds URLs to the queue on a background thread, also while run() works.
+    # `urls` may be any iterable (app.urls.iter_unique_urls over a file), it is
+    # consumed lazily so link lists of any length are fed in bounded memory.
+    # Playlist and channel links are expanded lazily: their entries go into the
+    # queue as they are discovered, so the workers start on the first ones
+    # right away. Videos already waiting in the queue are not added twice.
+    # prefetch=True checks every link first (app.prefetch), reporting each to
+    # on_info(info), and queues them shortest first. Links that fail for good
+    # are not queued at all.
+    def feed(self, urls, output_folder, profile=None, prefetch=False, on_info=None):
+        with self._feeders_lock:
+            self._feeders += 1
+        thread = threading.Thread(
+            target=self._feed,
+            args=(iter(urls), output_folder, profile, prefetch, on_info),
+            daemon=True,
+        )
+        thread.start()
+        self._threads.append(thread)
+        return thread
+
+    @property
+    def feeding(self):
+        with self._feeders_lock:
+            return self._feeders > 0
+
+    def _feed(self, urls, output_folder, profile, prefetch=False, on_info=None):
+        try:
+            if prefetch:
+                self._feed_prefetched(list(urls), output_folder, profile, on_info)
+                return
+            pending = []
+            found = 0
+            try:
+                for url in urls:
+                    if self._cancel_event.is_set():
+                        break
+                    if is_playlist_url(url):
+                        self._feed_playlist(url, output_folder, profile)
+                        continue
+                    pending.append(url)
+                    found += 1
+                    # The first link goes in alone so a worker can start on it
+                    if found == 1 or len(pending) >= FEED_BATCH_SIZE:
+                        self.queue.add(pending, output_folder, profile)
+                        pending = []
+            finally:
+                self.queue.add(pending, output_folder, profile)
+        finally:
+            with self._feeders_lock:
+                self._feeders -= 1
+
+    def _feed_playlist(self, url, output_folder, profile):
+        print(f"Expanding playlist: {url}")
+        pending = []
+        found = 0
+        try:
+            for entry_url in iter_playlist_entries(url):
+                if self._cancel_event.is_set():
+                    break
+                pending.append(entry_url)
+                found += 1
+                # The first entry goes in alone so a worker can start on it
+                if found == 1 or len(pending) >= FEED_BATCH_SIZE:
+                    self.queue.add(pending, output_folder, profile)
+                    pending = []
+        except Exception as e:
+            print(f"Failed to expand playlist {url}: {e}")
+        finally:
+            self.queue.add(pending, output_folder, profile)
+        print(f"Playlist expanded ({found} entries): {url}")
+
+    # Unlike the lazy feed, every playlist is expanded before the first job
+    # is queued, the order of the whole batch is only known after the pass.
+    def _feed_prefetched(self, urls, output_folder, profile, on_info):
+        expanded = {}
+        for url in urls:
+            if not is_playlist_url(url):
+                expanded.setdefault(
+                    extract_video_id(clean_youtube_url(url)) or url, url
+                )
+                continue
+            try:
+                for entry_url in iter_playlist_entries(url):
+                    if self._cancel_event.is_set():
+                        return
+                    expanded.setdefault(
+                        extract_video_id(entry_url) or entry_url, entry_url
+                    )
+            except Exception as e:
+                print(f"Failed to expand playlist {url}: {e}")
+
+        # Already downloaded videos need no metadata, the workers skip them
+        archived, to_check = [], []
+        for url in expanded.values():
+            if not self.force and find_archived(
+                self.archive, clean_youtube_url(url), output_folder, profile
+            ):
+                archived.append(url)
+            else:
+                to_check.append(url)
+        self.queue.add(archived, output_folder, profile)
+
+        print(f"Checking {len(to_check)} links before downloading")
+        infos = prefetch_infos(
+            to_check,
+            self.downloader,
+            profile=profile,
+            on_info=on_info,
+            cancel_event=self._cancel_event,
+        )
+        if self._cancel_event.is_set():
+            return
+        self.queue.add(
+            [
+                info.url
+                for info in shortest_first(infos)
+                if info.ok or is_transient_error(info.error)
+            ],
+            output_folder,
+            profile,
+        )
+
+    def cancel(self):
+        self._cancel_event.set()
+
+    # Waits up to `timeout` seconds in all for the feeds and the workers to
+    # finish (after cancel(), they end after their current job). Returns
+    # whether they did, until then they may still use the queue and archive.
+    def join(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for thread in list(self._threads):
+            thread.join(
+                None if deadline is None else max(deadline - time.monotonic(), 0)
+            )
+        return not any(thread.is_alive() for thread in self._threads)
+
+    @property
+    def cancelled(self):
+        return self._cancel_event.is_set()
+
+    # Blocks until the queue is drained or cancelled. on_event(event, job) is
+    # called from the workers with event "running", "done", "skipped",
+    # "retry" or "failed", on_progress(job, d) with the yt-dlp hook events of
+    # the running jobs. forever=True keeps the workers waiting for new jobs
+    # once the queue is drained, until cancel() (the job server).
+    def run(self, on_event=None, on_progress=None, forever=False):
+        self._cancel_event.clear()
+        self._forever = forever
+        print(f"Running job queue with {self.workers} workers: {self.queue.counts()}")
+        fetched = None
+        transcoders = []
+        if self.transcode_workers:
+            print(f"Converting on {self.transcode_workers} transcode workers")
+            fetched = queue.Queue(maxsize=self.transcode_workers * 2)
+            transcoders = [
+                threading.Thread(
+                    target=self._transcode_loop,
+                    args=(fetched, on_event),
+                    name=f"queue-transcode-{n}",
+                    daemon=True,
+                )
+                for n in range(self.transcode_workers)
+            ]
+        threads = [
+            threading.Thread(
+                target=self._work,
+                args=(on_event, on_progress, fetched),
+                name=f"queue-{n}",
+                daemon=True,
+            )
+            for n in range(self.workers)
+        ]
+        for thread in transcoders + threads:
+            thread.start()
+        self._threads += transcoders + threads
+        try:
+            for thread in threads:
+                thread.join()
+        except BaseException:
+            # Interrupted: the workers stop after their job, files waiting for
+            # a transcoder are dropped (their jobs resume on the next run)
+            self.cancel()
+            self._discard_waiting(fetched)
+            raise
+        finally:
+            # Files fetched before a cancel are still converted
+            for _ in transcoders:
+                fetched.put(_STOP)
+            for thread in transcoders:
+                thread.join()
+        return self.queue.counts()
+
+    def _discard_waiting(self, fetched):
+        while fetched is not None:
+            try:
+                job, clean_url, source_path = fetched.get_nowait()
+            except queue.Empty:
+                return
+            self.downloader.discard_fetched(source_path)
+
+    def _emit(self, on_event, event, job):
+        if on_event:
+            on_event(event, job)
+
+    # Puts a failed job back for a retry or on the failed list:
+    def _fail(self, on_event, job, error):
+        transient = is_transient_error(error)
+        print(
+            f"Job {job.id} failed (attempt {job.attempts}, "
+            f"{'transient' if transient else 'permanent'}): {error}"
+        )
+        self.queue.fail(job, error, transient)
+        self._emit(on_event, "retry" if job.state == PENDING else "failed", job)
+
+    # (Transcode worker) Converts fetched files until told to stop:
+    def _transcode_loop(self, fetched, on_event):
+        while True:
+            item = fetched.get()
+            if item is _STOP:
+                return
+            job, clean_url, source_path = item
+            try:
+                file_name = self.downloader.transcode(source_path, profile=job.profile)
+                record_archived(
+                    self.archive, clean_url, os.path.join(job.output_folder, file_name)
+                )
+            except Exception as e:
+                self._fail(on_event, job, e)
+                continue
+            self.queue.complete(job, file_name)
+            self._emit(on_event, "done", job)
+
+    # (Worker) Runs jobs until the queue is drained, with `fetched` only
+    # fetches them and hands the files to the transcode workers.
+    def _work(self, on_event, on_progress=None, fetched=None):
+        emit = partial(self._emit, on_event)
+        while not self._cancel_event.is_set():
+            job = self.queue.claim()
+            if job is None:
+                # Every worker stays until no job is left: running jobs may
+                # still fail into a retry, pending ones wait for their backoff
+                if (
+                    not self.queue.unfinished()
+                    and not self.feeding
+                    and not self._forever
+                ):
+                    return
+                next_due = self.queue.next_due()
+                if next_due is None:
+                    # Jobs are still running, or more links are on their way
+                    # from a playlist (or a client)
+                    self._cancel_event.wait(0.2)
+                    continue
+                # A retry is scheduled for later, sleep until it is due
+                self._cancel_event.wait(min(max(next_due - time.time(), 0.05), 1.0))
+                continue
+
+            emit("running", job)
+            try:
+                clean_url = clean_youtube_url(job.url)
+                entry = None
+                if not self.force:
+                    entry = find_archived(
+                        self.archive, clean_url, job.output_folder, job.profile
+                    )
+                if entry:
+                    print(f"Already downloaded, skipping: {entry.path}")
+                    self.queue.complete(job, os.path.basename(entry.path))
+                    emit("skipped", job)
+                    continue
+                job_progress = partial(on_progress, job) if on_progress else None
+                if fetched is not None:
+                    source_path = self.downloader.fetch(
+                        clean_url,
+                        job.output_folder,
+                        profile=job.profile,
+                        on_progress=job_progress,
+                    )
+                    # Blocks while the transcode workers are behind
+                    fetched.put((job, clean_url, source_path))
+                    continue
+                file_name = self.downloader.download(
+                    clean_url,
+                    job.output_folder,
+                    profile=job.profile,
+                    on_progress=job_progress,
+                )
+                record_archived(
+                    self.archive, clean_url, os.path.join(job.output_folder, file_name)
+                )
+            except Exception as e:
+                self._fail(on_event, job, e)
+                continue
+
+            self.queue.complete(job, file_name)
+            emit("done", job)
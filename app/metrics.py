@@ -0,0 +1,195 @@
+import json
+import os
+import statistics
+import threading
+import time
+from collections import deque
+from dataclasses import asdict, dataclass, field
+from typing import Optional
+
+# Stages of a job that are timed
+STAGES = ("extract", "download", "transcode", "total")
+# Percentiles of the stage times in summary() and the Prometheus summary
+QUANTILES = {"p50": 0.5, "p95": 0.95}
+
+
+# Timings of one download job:
+@dataclass
+class JobMetrics:
+    url: str
+    status: str = "running"
+    started_at: float = field(default_factory=time.time)
+    extract_seconds: Optional[float] = None
+    download_seconds: Optional[float] = None
+    downloaded_bytes: int = 0
+    transcode_seconds: Optional[float] = None
+    total_seconds: Optional[float] = None
+    error: Optional[str] = None
+
+    # Average download speed in bytes per second:
+    @property
+    def throughput(self):
+        if not self.download_seconds:
+            return None
+        return self.downloaded_bytes / self.download_seconds
+
+    def to_dict(self):
+        return {**asdict(self), "throughput": self.throughput}
+
+
+# Fills a JobMetrics from yt-dlp's progress_hooks, and the transcode time
+# from the download session.
+# The time from the start of the job to the first download event is the
+# extractor time (page, player and format resolution).
+class JobTimer:
+    def __init__(self, url):
+        self.metrics = JobMetrics(url=url)
+        self._start = time.perf_counter()
+        self._download_start = None
+        self._file_bytes = 0
+
+    def progress_hook(self, d):
+        now = time.perf_counter()
+        if self._download_start is None:
+            self._download_start = now
+            self.metrics.extract_seconds = now - self._start
+
+        if d["status"] == "downloading":
+            self._file_bytes = d.get("downloaded_bytes") or 0
+        elif d["status"] == "finished":
+            # One event per downloaded file, add them up
+            self.metrics.downloaded_bytes += (
+                d.get("total_bytes") or d.get("downloaded_bytes") or self._file_bytes
+            )
+            self._file_bytes = 0
+            self.metrics.download_seconds = now - self._download_start
+
+    # Transcodes run outside of yt-dlp, timed by the session:
+    def add_transcode(self, seconds):
+        self.metrics.transcode_seconds = (self.metrics.transcode_seconds or 0) + seconds
+
+    def finish(self, status, error=None):
+        self.metrics.status = status
+        self.metrics.error = str(error) if error else None
+        self.metrics.total_seconds = time.perf_counter() - self._start
+        return self.metrics
+
+
+def _quantile(values, q):
+    if not values:
+        return None
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[int(q * 100) - 1]
+
+
+# In-process store of finished job metrics. Keeps the last `max_jobs` jobs for
+# inspection plus running totals that cover every job since the last reset.
+class MetricsRegistry:
+    def __init__(self, max_jobs=10000):
+        self._jobs = deque(maxlen=max_jobs)
+        self._lock = threading.Lock()
+        self._reset_totals()
+
+    def _reset_totals(self):
+        self._status_counts = {}
+        self._stage_seconds = dict.fromkeys(STAGES, 0.0)
+        # Jobs that went through each stage
+        self._stage_jobs = dict.fromkeys(STAGES, 0)
+        self._downloaded_bytes = 0
+
+    def record(self, metrics):
+        with self._lock:
+            self._jobs.append(metrics)
+            self._status_counts[metrics.status] = (
+                self._status_counts.get(metrics.status, 0) + 1
+            )
+            for stage in STAGES:
+                seconds = getattr(metrics, f"{stage}_seconds")
+                if seconds:
+                    self._stage_seconds[stage] += seconds
+                    self._stage_jobs[stage] += 1
+            self._downloaded_bytes += metrics.downloaded_bytes
+
+    def jobs(self):
+        with self._lock:
+            return list(self._jobs)
+
+    def reset(self):
+        with self._lock:
+            self._jobs.clear()
+            self._reset_totals()
+
+    # Totals plus mean and percentiles of each stage over the kept jobs:
+    def summary(self):
+        with self._lock:
+            jobs = list(self._jobs)
+            summary = {
+                "jobs": dict(self._status_counts),
+                "downloaded_bytes": self._downloaded_bytes,
+                "stage_seconds_total": dict(self._stage_seconds),
+                "stage_jobs_total": dict(self._stage_jobs),
+            }
+
+        for stage in STAGES:
+            values = sorted(
+                v for v in (getattr(job, f"{stage}_seconds") for job in jobs) if v
+            )
+            summary[stage] = {
+                "mean": statistics.fmean(values) if values else None,
+                **{name: _quantile(values, q) for name, q in QUANTILES.items()},
+            }
+        speeds = [job.throughput for job in jobs if job.throughput]
+        summary["throughput_mean"] = statistics.fmean(speeds) if speeds else None
+        return summary
+
+    # Writes one JSON object per job to the file (appending):
+    def to_jsonl(self, path):
+        with open(path, "a", encoding="utf-8") as file:
+            for metrics in self.jobs():
+                file.write(json.dumps(metrics.to_dict()) + "\n")
+
+    # Writes the totals in Prometheus text format. The file is replaced
+    # atomically, suitable for node_exporter's textfile collector.
+    def to_prometheus(self, path):
+        summary = self.summary()
+        lines = [
+            "# HELP portableyt_jobs_total Download jobs by final status.",
+            "# TYPE portableyt_jobs_total counter",
+        ]
+        for status, count in sorted(summary["jobs"].items()):
+            lines.append(f'portableyt_jobs_total{{status="{status}"}} {count}')
+        lines += [
+            "# HELP portableyt_downloaded_bytes_total Bytes downloaded by all jobs.",
+            "# TYPE portableyt_downloaded_bytes_total counter",
+            f"portableyt_downloaded_bytes_total {summary['downloaded_bytes']}",
+        ]
+        # Quantiles over the recent jobs, sum and count (the time spent in
+        # each stage) over all of them
+        lines += [
+            "# HELP portableyt_stage_seconds Time of each stage per job.",
+            "# TYPE portableyt_stage_seconds summary",
+        ]
+        for stage in STAGES:
+            for name, quantile in QUANTILES.items():
+                value = summary[stage][name]
+                if value is not None:
+                    lines.append(
+                        f'portableyt_stage_seconds{{stage="{stage}",'
+                        f'quantile="{quantile}"}} {value}'
+                    )
+            lines += [
+                f'portableyt_stage_seconds_sum{{stage="{stage}"}} '
+                f'{summary["stage_seconds_total"][stage]}',
+                f'portableyt_stage_seconds_count{{stage="{stage}"}} '
+                f'{summary["stage_jobs_total"][stage]}',
+            ]
+
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as file:
+            file.write("\n".join(lines) + "\n")
+        os.replace(temp_path, path)
+
+
+# Registry used by the default download session
+REGISTRY = MetricsRegistry()
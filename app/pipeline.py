@@ -0,0 +1,164 @@
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from app.batch import (
+    BatchResult,
+    DEFAULT_WORKERS,
+    copy_duplicate,
+    find_archived,
+    record_archived,
+    split_duplicates,
+)
+from app.downloader import clean_youtube_url, get_default_downloader
+
+# Marks the end of the work for a transcode worker
+_STOP = object()
+
+
+# Batch engine with two stages: an I/O-bound pool that fetches the raw audio
+# and a CPU-bound pool (one FFmpeg process per core) that converts it to mp3.
+# The bounded queue between them makes the fetchers wait when the transcoders
+# fall behind, so the network and all cores are busy at the same time.
+# Same interface as BatchDownloader: run(urls) returns results in input order.
+class PipelinedBatchDownloader:
+    def __init__(
+        self,
+        output_folder,
+        download_workers=DEFAULT_WORKERS,
+        transcode_workers=None,
+        queue_size=None,
+        fetch=None,
+        transcode=None,
+        downloader=None,
+        archive=None,
+        force=False,
+        profile=None,
+    ):
+        self.output_folder = output_folder
+        self.download_workers = download_workers
+        self.transcode_workers = transcode_workers or os.cpu_count() or 1
+        if self.download_workers < 1 or self.transcode_workers < 1:
+            raise ValueError("worker counts must be at least 1")
+        self.queue_size = queue_size or self.transcode_workers * 2
+        downloader = downloader or get_default_downloader()
+        self.fetch = fetch or downloader.fetch
+        self.transcode = transcode or downloader.transcode
+        self.discard_fetched = downloader.discard_fetched
+        # Output profile (name or OutputProfile), None keeps the download default
+        self.profile = profile
+        if profile is not None:
+            self.fetch = partial(self.fetch, profile=profile)
+            self.transcode = partial(self.transcode, profile=profile)
+        self.archive = archive
+        self.force = force
+        self._cancel_event = threading.Event()
+
+    # Stops fetching new URLs, already fetched files are still converted:
+    def cancel(self):
+        self._cancel_event.set()
+
+    @property
+    def cancelled(self):
+        return self._cancel_event.is_set()
+
+    def run(self, urls, on_result=None):
+        self._cancel_event.clear()
+        urls = list(urls)
+        results = [BatchResult(index=i, url=url) for i, url in enumerate(urls, start=1)]
+        jobs, duplicates = split_duplicates(results)
+        fetched = queue.Queue(maxsize=self.queue_size)
+        print(
+            f"Pipelined batch of {len(jobs)} URLs: {self.download_workers} fetch "
+            f"workers, {self.transcode_workers} transcode workers"
+        )
+
+        def finish(result):
+            if on_result:
+                on_result(result)
+
+        # (Fetch worker) Downloads the raw audio and hands it to the transcoders:
+        def fetch_job(result):
+            if self._cancel_event.is_set():
+                result.cancelled = True
+                finish(result)
+                return
+            source_path = None
+            try:
+                clean_url = clean_youtube_url(result.url)
+                entry = None
+                if not self.force:
+                    entry = find_archived(
+                        self.archive, clean_url, self.output_folder, self.profile
+                    )
+                if entry:
+                    print(f"Already downloaded, skipping: {entry.path}")
+                    result.file_name = os.path.basename(entry.path)
+                    result.skipped = True
+                else:
+                    source_path = self.fetch(clean_url, self.output_folder)
+            except Exception as e:
+                print(f"Batch job {result.index} failed to fetch: {e}")
+                result.error = e
+            if source_path is None:
+                finish(result)
+                return
+            fetched.put((result, source_path))  # Blocks while the queue is full
+
+        # (Transcode worker) Converts fetched files until told to stop:
+        def transcode_loop():
+            while True:
+                item = fetched.get()
+                if item is _STOP:
+                    return
+                result, source_path = item
+                try:
+                    result.file_name = self.transcode(source_path)
+                    record_archived(
+                        self.archive,
+                        clean_youtube_url(result.url),
+                        os.path.join(self.output_folder, result.file_name),
+                    )
+                except Exception as e:
+                    print(f"Batch job {result.index} failed to transcode: {e}")
+                    result.error = e
+                finish(result)
+
+        # (Aborted run) Drops the fetched files that wait for a transcoder:
+        def discard_waiting():
+            while True:
+                try:
+                    result, source_path = fetched.get_nowait()
+                except queue.Empty:
+                    return
+                self.discard_fetched(source_path)
+                result.cancelled = True
+
+        transcoders = [
+            threading.Thread(target=transcode_loop, name=f"transcode-{n}", daemon=True)
+            for n in range(self.transcode_workers)
+        ]
+        for thread in transcoders:
+            thread.start()
+
+        try:
+            with ThreadPoolExecutor(
+                max_workers=self.download_workers, thread_name_prefix="fetch"
+            ) as executor:
+                for future in [executor.submit(fetch_job, r) for r in jobs]:
+                    future.result()
+        except BaseException:
+            discard_waiting()
+            raise
+        finally:
+            for _ in transcoders:
+                fetched.put(_STOP)
+            for thread in transcoders:
+                thread.join()
+
+        for result, original in duplicates:
+            copy_duplicate(result, original)
+            finish(result)
+        return results
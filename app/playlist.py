@@ -0,0 +1,62 @@
+from urllib.parse import parse_qs, urlparse
+
+from app.downloader import extract_video_id, normalize_url
+
+# Path prefixes of YouTube channel pages
+CHANNEL_PREFIXES = ("/@", "/channel/", "/c/", "/user/")
+
+# How deep channel -> tab -> playlist links are followed
+MAX_DEPTH = 3
+
+
+# Whether the link is a playlist or channel page rather than a single video.
+# A watch link with a list= parameter still counts as the single video.
+def is_playlist_url(url):
+    parsed = urlparse(normalize_url(url))
+    if "youtube.com" not in parsed.netloc:
+        return False
+    if parsed.path.rstrip("/") == "/playlist":
+        return "list" in parse_qs(parsed.query)
+    return parsed.path.startswith(CHANNEL_PREFIXES)
+
+
+# Yields the video links of a playlist or channel as yt-dlp discovers them.
+# Flat, lazy extraction: only the listing pages are fetched, one page at a
+# time, so the first links arrive within seconds and memory stays flat no
+# matter how long the playlist is.
+def iter_playlist_entries(url):
+    # Imported here like in app.downloader, yt-dlp is only loaded when needed
+    from yt_dlp import YoutubeDL
+
+    ydl_opts = {
+        "quiet": True,
+        "extract_flat": "in_playlist",
+        "lazy_playlist": True,
+        "skip_download": True,
+    }
+    with YoutubeDL(ydl_opts) as ydl:
+        info = ydl.extract_info(normalize_url(url), download=False, process=False)
+        yield from _iter_entries(ydl, info, 0)
+
+
+def _iter_entries(ydl, info, depth):
+    if info is None:
+        return
+    entry_type = info.get("_type", "video")
+
+    if entry_type == "playlist":
+        for entry in info.get("entries") or ():
+            yield from _iter_entries(ydl, entry, depth)
+        return
+
+    entry_url = info.get("webpage_url") or info.get("url")
+    if not entry_url:
+        return
+    if entry_type == "video" or info.get("ie_key") == "Youtube":
+        yield entry_url
+    elif extract_video_id(entry_url):
+        yield entry_url
+    elif depth < MAX_DEPTH:
+        # A link to another listing (channel tab, nested playlist), follow it
+        nested = ydl.extract_info(entry_url, download=False, process=False)
+        yield from _iter_entries(ydl, nested, depth + 1)
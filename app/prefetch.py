@@ -0,0 +1,92 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Optional
+
+from app.downloader import clean_youtube_url, estimate_size, get_default_downloader
+
+# How many extractions run at the same time (they are mostly waiting on HTTP)
+DEFAULT_PREFETCH_WORKERS = 8
+
+
+# What the prefetch learned about one URL before any media was fetched:
+@dataclass
+class VideoInfo:
+    url: str
+    title: Optional[str] = None
+    duration: Optional[float] = None
+    # Estimated size of the selected audio format in bytes
+    size: Optional[int] = None
+    error: Optional[Exception] = None
+    # Not checked, the batch was cancelled first
+    cancelled: bool = False
+
+    @property
+    def ok(self):
+        return self.error is None and not self.cancelled
+
+
+# Validation pass over a batch: runs the metadata extraction of every URL
+# in parallel, so bad, private or unavailable videos fail before anything is
+# downloaded. The info dicts land in the downloader's info cache, where the
+# downloads reuse them. on_info(info) is called from the worker threads.
+# Once `cancel_event` is set (or the caller is interrupted) the links not
+# checked yet are skipped and marked cancelled; extractions already running
+# finish, but are not reported.
+def prefetch_infos(
+    urls,
+    downloader=None,
+    workers=DEFAULT_PREFETCH_WORKERS,
+    profile=None,
+    on_info=None,
+    cancel_event=None,
+):
+    downloader = downloader or get_default_downloader()
+    cancel_event = cancel_event or threading.Event()
+    lock = threading.Lock()
+
+    def probe(url):
+        if cancel_event.is_set():
+            return VideoInfo(url=url, cancelled=True)
+        try:
+            info = downloader.probe(clean_youtube_url(url), profile=profile)
+            result = VideoInfo(
+                url=url,
+                title=info.get("title"),
+                duration=info.get("duration"),
+                size=estimate_size(info),
+            )
+        except Exception as e:
+            result = VideoInfo(url=url, error=e)
+        if cancel_event.is_set():
+            result.cancelled = True
+        elif on_info:
+            with lock:
+                on_info(result)
+        return result
+
+    urls = list(urls)
+    if not urls:
+        return []
+    executor = ThreadPoolExecutor(max_workers=min(workers, len(urls)))
+    try:
+        return list(executor.map(probe, urls))
+    except BaseException:
+        # Interrupted (Ctrl+C): the probes still waiting are dropped
+        cancel_event.set()
+        raise
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+# Shortest videos first (unknown durations last), which minimizes the mean
+# time until a job completes:
+def shortest_first(infos):
+    return sorted(
+        infos,
+        key=lambda info: (
+            info.duration is None,
+            info.duration or 0,
+            info.size or 0,
+        ),
+    )
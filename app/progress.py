@@ -0,0 +1,62 @@
+import threading
+from dataclasses import dataclass
+from typing import Optional
+
+# How often the window applies the posted updates (milliseconds)
+FRAME_MS = 100
+
+
+# One row of the batch list:
+@dataclass
+class ItemProgress:
+    key: int
+    name: str
+    status: str = "queued"
+    percent: Optional[float] = None
+    # Bytes per second
+    speed: Optional[float] = None
+
+
+# Row fields from a yt-dlp progress hook dict, conversion follows a finished
+# download:
+def progress_fields(d):
+    if d["status"] == "finished":
+        return {"status": "converting", "percent": 100.0, "speed": None}
+    fields = {"status": "downloading", "speed": d.get("speed")}
+    total = d.get("total_bytes") or d.get("total_bytes_estimate")
+    if total:
+        fields["percent"] = min(100.0, d.get("downloaded_bytes", 0) * 100 / total)
+    return fields
+
+
+# Thread-safe mailbox between the download workers and the window. Workers
+# post row changes and status messages at any rate; the window drains the
+# bus once per frame. Changes to the same row are merged and only the last
+# status message is kept, so the Tk event loop sees at most one update per
+# row per frame however many workers are running.
+class ProgressBus:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._changes = {}
+        self._status = None
+
+    # Changes row `key` (the row is created on its first post):
+    def post(self, key, **fields):
+        with self._lock:
+            changes = self._changes.get(key)
+            if changes is None:
+                self._changes[key] = fields
+            else:
+                changes.update(fields)
+
+    def post_status(self, message, color="gray"):
+        with self._lock:
+            self._status = (message, color)
+
+    # Returns ({key: changed fields} in order of first post, last status or
+    # None) and starts collecting anew:
+    def drain(self):
+        with self._lock:
+            changes, self._changes = self._changes, {}
+            status, self._status = self._status, None
+        return changes, status
@@ -0,0 +1,136 @@
+import tkinter as tk
+
+from app.progress import ItemProgress
+
+STATUS_COLORS = {
+    "queued": "gray",
+    "downloading": "orange",
+    "converting": "orange",
+    "retrying": "orange",
+    "done": "green",
+    "skipped": "gray",
+    "failed": "red",
+}
+
+# Column x positions (name, status, percent, speed) and their anchors
+COLUMNS = ((6, "w"), (260, "w"), (360, "e"), (440, "e"))
+
+
+def format_speed(speed):
+    if not speed:
+        return ""
+    if speed >= 1024 * 1024:
+        return f"{speed / (1024 * 1024):.1f} MB/s"
+    return f"{speed / 1024:.0f} KB/s"
+
+
+# Per-item batch list that stays fast with any number of items: a Canvas
+# holds text items for the visible rows only, scrolling and updates just
+# rewrite their texts from the row models.
+class ProgressList(tk.Frame):
+    def __init__(self, master, height=140, row_height=18, bg="#2b2b2b", **kwargs):
+        super().__init__(master, bg=bg, **kwargs)
+        self.row_height = row_height
+        self.visible = height // row_height
+        self.items = []
+        self._index = {}
+        self._top = 0
+        self._dirty = False
+
+        self.canvas = tk.Canvas(
+            self, height=height, width=450, bg=bg, highlightthickness=0
+        )
+        self.canvas.grid(row=0, column=0, sticky="nsew")
+        self.scrollbar = tk.Scrollbar(self, orient="vertical", command=self._on_scroll)
+        self.scrollbar.grid(row=0, column=1, sticky="ns")
+        self.grid_columnconfigure(0, weight=1)
+
+        # Fixed pool of text items, one set per visible row
+        self._rows = [
+            [
+                self.canvas.create_text(
+                    x,
+                    row * row_height + row_height // 2,
+                    anchor=anchor,
+                    fill="white",
+                    font=("Arial", 10),
+                )
+                for x, anchor in COLUMNS
+            ]
+            for row in range(self.visible)
+        ]
+
+        for widget in (self.canvas, self):
+            widget.bind("<MouseWheel>", self._on_wheel)
+            widget.bind("<Button-4>", lambda e: self.scroll_rows(-3))
+            widget.bind("<Button-5>", lambda e: self.scroll_rows(3))
+
+    # Applies the changes drained from a ProgressBus, then redraws once:
+    def apply(self, changes):
+        following = self._top + self.visible >= len(self.items)
+        for key, fields in changes.items():
+            index = self._index.get(key)
+            if index is None:
+                index = self._index[key] = len(self.items)
+                self.items.append(ItemProgress(key=key, name=str(key)))
+            item = self.items[index]
+            for name, value in fields.items():
+                setattr(item, name, value)
+            if self._top <= index < self._top + self.visible:
+                self._dirty = True
+        # Keep showing the newest rows unless the user scrolled up
+        if following and len(self.items) > self._top + self.visible:
+            self._top = len(self.items) - self.visible
+            self._dirty = True
+        if self._dirty:
+            self.redraw()
+
+    def clear(self):
+        self.items = []
+        self._index = {}
+        self._top = 0
+        self.redraw()
+
+    def scroll_rows(self, rows):
+        top = max(0, min(self._top + rows, len(self.items) - self.visible))
+        if top != self._top:
+            self._top = top
+            self.redraw()
+
+    def _on_wheel(self, event):
+        self.scroll_rows(-3 if event.delta > 0 else 3)
+
+    def _on_scroll(self, action, amount, unit=None):
+        if action == "moveto":
+            self.scroll_rows(int(float(amount) * len(self.items)) - self._top)
+        elif unit == "pages":
+            self.scroll_rows(int(amount) * self.visible)
+        else:
+            self.scroll_rows(int(amount))
+
+    def redraw(self):
+        self._dirty = False
+        for row, (name, status, percent, speed) in enumerate(self._rows):
+            index = self._top + row
+            if index >= len(self.items):
+                for text_id in (name, status, percent, speed):
+                    self.canvas.itemconfigure(text_id, text="")
+                continue
+            item = self.items[index]
+            self.canvas.itemconfigure(name, text=item.name[:40])
+            self.canvas.itemconfigure(
+                status,
+                text=item.status,
+                fill=STATUS_COLORS.get(item.status, "white"),
+            )
+            self.canvas.itemconfigure(
+                percent,
+                text="" if item.percent is None else f"{item.percent:.0f}%",
+            )
+            self.canvas.itemconfigure(speed, text=format_speed(item.speed))
+
+        total = len(self.items)
+        if total <= self.visible:
+            self.scrollbar.set(0, 1)
+        else:
+            self.scrollbar.set(self._top / total, (self._top + self.visible) / total)
@@ -0,0 +1,197 @@
+import ipaddress
+import re
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+# Hosts that are the same service as another host
+HOST_ALIASES = {"youtu.be": "youtube.com"}
+# Labels under which country domains hand out names (example.co.uk,
+# example.com.au), the site is one label further left
+SECOND_LEVEL_LABELS = ("ac", "co", "com", "edu", "go", "gov", "ne", "net", "or", "org")
+
+# Largest burst (in seconds of the rate) the bucket lets through at once
+BURST_SECONDS = 1.0
+
+_RATE_RE = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*([kmg]?)i?b?(?:/s)?\s*$", re.IGNORECASE)
+_RATE_UNITS = {"": 1, "k": 1024, "m": 1024**2, "g": 1024**3}
+
+
+# Bytes per second from "500K", "2M", "1.5MB/s" or a plain number.
+# "0", "" and None mean no limit.
+def parse_rate(text):
+    if text is None or str(text).strip() in ("", "0"):
+        return None
+    match = _RATE_RE.match(str(text))
+    if not match:
+        raise ValueError(f"Invalid rate {text!r}, use e.g. 500K or 2M")
+    rate = float(match.group(1)) * _RATE_UNITS[match.group(2).lower()]
+    return rate or None
+
+
+def format_rate(rate):
+    if not rate:
+        return "unlimited"
+    for unit in ("G", "M", "K"):
+        if rate >= _RATE_UNITS[unit.lower()]:
+            return f"{rate / _RATE_UNITS[unit.lower()]:g} {unit}B/s"
+    return f"{rate:g} B/s"
+
+
+# Scheduling key of a URL: the site's registered domain, without "www.",
+# "m." and similar prefixes. IP addresses are their own key.
+def host_key(url):
+    host = (urlparse(url).hostname or "").lower().rstrip(".")
+    try:
+        ipaddress.ip_address(host)
+        return host
+    except ValueError:
+        pass
+    parts = host.split(".")
+    keep = 2
+    if len(parts) > 2 and len(parts[-1]) == 2 and parts[-2] in SECOND_LEVEL_LABELS:
+        keep = 3
+    host = ".".join(parts[-keep:])
+    return HOST_ALIASES.get(host, host)
+
+
+# Global bandwidth budget. Callers reserve bytes and sleep for the returned
+# time, the balance may go negative so reservations are served in order.
+class TokenBucket:
+    def __init__(self, rate=None):
+        self._lock = threading.Lock()
+        self.set_rate(rate)
+
+    # Bytes per second, None for no limit. Can be changed at any time.
+    def set_rate(self, rate):
+        with self._lock:
+            self.rate = rate or None
+            self.burst = (self.rate or 0) * BURST_SECONDS
+            self._tokens = self.burst
+            self._last = time.monotonic()
+
+    # Takes `size` bytes from the bucket, returns how long to wait for them:
+    def reserve(self, size):
+        with self._lock:
+            if self.rate is None:
+                return 0.0
+            now = time.monotonic()
+            self._tokens = min(
+                self.burst, self._tokens + (now - self._last) * self.rate
+            )
+            self._last = now
+            self._tokens -= size
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+
+# Bandwidth share of one running job, handed out by TransferScheduler.job.
+# While transferring, the job is paced to an equal share of the global rate
+# so one job with large reads cannot starve the others.
+class JobShare:
+    def __init__(self, scheduler, host):
+        self.scheduler = scheduler
+        self.host = host
+        self._next = 0.0
+        self._seen = 0
+
+    def consume(self, size):
+        if size <= 0:
+            return
+        wait = self.scheduler.bucket.reserve(size)
+        share = self.scheduler._share_rate(self)
+        if share:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + size / share
+            wait = max(wait, start - now)
+        if wait > 0:
+            time.sleep(wait)
+
+    # Wraps an iterator of byte blocks, taking each block from the budget:
+    def throttle(self, chunks):
+        for chunk in chunks:
+            self.consume(len(chunk))
+            yield chunk
+
+    # For yt-dlp's progress_hooks: takes the bytes read since the last call
+    def progress_hook(self, d):
+        if d["status"] == "downloading":
+            downloaded = d.get("downloaded_bytes") or 0
+            if downloaded < self._seen:
+                # A new file of the same job (video and audio, a retry)
+                self._seen = 0
+            self.consume(downloaded - self._seen)
+            self._seen = downloaded
+        elif d["status"] == "finished":
+            self._seen = 0
+            self.scheduler._set_idle(self)
+
+
+# Shared by every download: one global bytes-per-second budget (TokenBucket),
+# at most `per_host` jobs against the same host at a time and equal shares
+# of the budget for the jobs that are transferring. Both limits can be
+# changed while downloads run.
+class TransferScheduler:
+    def __init__(self, rate=None, per_host=None):
+        self.bucket = TokenBucket(rate)
+        self.per_host = per_host or None
+        self._condition = threading.Condition()
+        self._host_jobs = {}
+        self._transferring = set()
+
+    @property
+    def rate(self):
+        return self.bucket.rate
+
+    def set_rate(self, rate):
+        self.bucket.set_rate(rate)
+        print(f"Bandwidth limit: {format_rate(rate)}")
+
+    def set_per_host(self, per_host):
+        if per_host is not None and per_host < 0:
+            raise ValueError(f"Connections per host must be at least 0: {per_host}")
+        with self._condition:
+            self.per_host = per_host or None
+            self._condition.notify_all()
+        print(f"Connections per host: {per_host or 'unlimited'}")
+
+    # Holds one of the host's slots for the whole job, waiting for one if
+    # the host is at its limit, and yields the job's JobShare.
+    @contextmanager
+    def job(self, url):
+        host = host_key(url)
+        with self._condition:
+            while self.per_host and self._host_jobs.get(host, 0) >= self.per_host:
+                self._condition.wait()
+            self._host_jobs[host] = self._host_jobs.get(host, 0) + 1
+        share = JobShare(self, host)
+        try:
+            yield share
+        finally:
+            with self._condition:
+                self._transferring.discard(share)
+                self._host_jobs[host] -= 1
+                if not self._host_jobs[host]:
+                    del self._host_jobs[host]
+                self._condition.notify_all()
+
+    def active_hosts(self):
+        with self._condition:
+            return dict(self._host_jobs)
+
+    # Bytes per second the share may use, None when there is no limit:
+    def _share_rate(self, share):
+        rate = self.bucket.rate
+        with self._condition:
+            self._transferring.add(share)
+            active = len(self._transferring)
+        return rate / active if rate else None
+
+    def _set_idle(self, share):
+        with self._condition:
+            self._transferring.discard(share)
+
+
+# Scheduler used by the default download session
+SCHEDULER = TransferScheduler()
@@ -0,0 +1,476 @@
+# Job server: `python -m app --serve` keeps the download workers (and
+# yt-dlp) loaded and takes work over a local HTTP/JSON API, so other programs
+# can queue links without starting the app for every batch. The jobs live in
+# their own persistent queue, unfinished ones continue after a restart.
+#
+#   POST /jobs        {"urls": [...], "output": "...", "profile": "opus",
+#                      "prefetch": false}, replies with the new job ids
+#   GET  /jobs        every job (?state=pending|running|done|failed)
+#   GET  /jobs/ID     one job, with percent and speed while it runs
+#   POST /jobs/retry  gives the failed jobs a fresh set of attempts
+#   GET  /events      job changes as JSON lines, at most one per job per frame
+#   GET  /limits      bandwidth limit and connections per host,
+#   PUT  /limits      {"rate": "2M", "per_host": 2} changes them (null: none)
+#   GET  /health      queue counts and the metrics summary
+#
+# There is no authentication, the server only listens on localhost unless
+# told otherwise. So that web pages cannot use it: request bodies must be
+# JSON (a cross-origin JSON request needs a CORS preflight, which is never
+# answered), the Host and Origin headers must name this machine (against DNS
+# rebinding) and jobs only write inside the server's output folder unless it
+# was started with --allow-any-output.
+import ipaddress
+import json
+import os
+import threading
+import time
+from dataclasses import asdict
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from app.batch import DEFAULT_WORKERS
+from app.client import DEFAULT_HOST, DEFAULT_PORT
+from app.downloader import PROFILES, get_data_dir
+from app.jobqueue import JobQueue, QueueRunner
+from app.metrics import REGISTRY
+from app.playlist import is_playlist_url
+from app.progress import FRAME_MS, ProgressBus, progress_fields
+from app.scheduler import parse_rate
+from app.urls import iter_links, iter_unique_urls
+
+# Queue file of the server inside the app data folder, apart from the one
+# the window and the command line use
+SERVER_QUEUE_FILE = "server-jobs.sqlite3"
+
+# Largest request body accepted (bytes)
+MAX_BODY = 16 * 1024 * 1024
+
+# An empty line goes out on idle event streams this often (seconds), which
+# is how disconnected clients are noticed
+HEARTBEAT_SECONDS = 15
+
+# Host names that are always this machine, next to the loopback addresses
+LOOPBACK_NAMES = ("localhost",)
+# Bind addresses that listen on every interface
+WILDCARD_HOSTS = ("", "0.0.0.0", "::")
+
+# Row status (as in the window's batch list) of each QueueRunner event
+EVENT_STATUS = {
+    "running": "downloading",
+    "retry": "retrying",
+    "done": "done",
+    "skipped": "skipped",
+    "failed": "failed",
+}
+
+
+# Error reply of a request: HTTP status and message
+class RequestError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def _ip_address(host):
+    try:
+        return ipaddress.ip_address(host)
+    except ValueError:
+        return None
+
+
+def is_loopback(host):
+    host = (host or "").lower()
+    address = _ip_address(host)
+    return host in LOOPBACK_NAMES if address is None else address.is_loopback
+
+
+# Connections per host from a PUT /limits value, None (or 0) for no limit:
+def parse_per_host(value):
+    if value is None:
+        return None
+    if isinstance(value, bool) or not str(value).strip().isdigit():
+        raise ValueError(
+            f"Invalid per_host {value!r}, use a whole number of at least 0"
+        )
+    return int(value)
+
+
+class JobServer:
+    def __init__(
+        self,
+        output_folder,
+        host=DEFAULT_HOST,
+        port=DEFAULT_PORT,
+        workers=DEFAULT_WORKERS,
+        archive=None,
+        force=False,
+        profile=None,
+        queue_path=None,
+        allow_any_output=False,
+    ):
+        self.output_folder = os.path.realpath(output_folder)
+        self.profile = profile
+        # Whether POST /jobs may name output folders outside output_folder
+        self.allow_any_output = allow_any_output
+        self.host = host
+        self.queue = JobQueue(
+            queue_path or os.path.join(get_data_dir(), SERVER_QUEUE_FILE)
+        )
+        self.queue.clear_finished(keep_failed=True)
+        self.runner = QueueRunner(
+            self.queue, workers=workers, archive=archive, force=force
+        )
+        self._lock = threading.Lock()
+        # Progress fields of the running jobs by id
+        self._live = {}
+        # One ProgressBus per connected /events client
+        self._subscribers = set()
+        # Counts submissions, event streams use it to tell when work arrived
+        self.submissions = 0
+        self._stopping = threading.Event()
+        self.httpd = ThreadingHTTPServer((host, port), JobRequestHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.job_server = self
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def stopping(self):
+        return self._stopping.is_set()
+
+    # Blocks until stop() (or Ctrl+C), the workers are ready before the
+    # first request is taken.
+    def serve(self):
+        print(f"Loading {self.runner.workers} download workers")
+        self.runner.downloader.warm_up(self.runner.workers, self.profile)
+        worker = threading.Thread(
+            target=self.runner.run,
+            kwargs={
+                "on_event": self._on_event,
+                "on_progress": self._on_progress,
+                "forever": True,
+            },
+            name="job-server-runner",
+            daemon=True,
+        )
+        worker.start()
+        print(f"Job server listening on {self.url}: {self.queue.counts()}")
+        try:
+            self.httpd.serve_forever(poll_interval=0.2)
+        finally:
+            # Running jobs finish, the pending ones wait for the next start
+            self._stopping.set()
+            self.runner.cancel()
+            worker.join()
+            self.httpd.server_close()
+            self.queue.close()
+            print("Job server stopped")
+
+    # Whether a Host or Origin header host name is one clients may use: this
+    # machine's loopback, the address the server was bound to, or any IP
+    # address when it listens on every interface (an IP address cannot be
+    # rebound to another site like a host name can).
+    def allowed_host(self, host):
+        if not host:
+            return False
+        host = host.lower()
+        if is_loopback(host) or host == self.host.lower():
+            return True
+        return self.host in WILDCARD_HOSTS and _ip_address(host) is not None
+
+    # Absolute output folder of a POST /jobs "output": relative folders are
+    # inside the server's output folder, others must be too unless
+    # allow_any_output is set.
+    def resolve_output(self, output_folder):
+        if not output_folder:
+            return self.output_folder
+        if not isinstance(output_folder, str):
+            raise RequestError(HTTPStatus.BAD_REQUEST, "output must be a folder path")
+        path = os.path.realpath(os.path.join(self.output_folder, output_folder))
+        if self.allow_any_output:
+            return path
+        try:
+            inside = (
+                os.path.commonpath([self.output_folder, path]) == self.output_folder
+            )
+        except ValueError:
+            # Another drive
+            inside = False
+        if not inside:
+            raise RequestError(
+                HTTPStatus.FORBIDDEN,
+                f"output must be inside {self.output_folder}"
+                " (start the server with --allow-any-output to lift this)",
+            )
+        return path
+
+    # Makes serve() return, from any other thread:
+    def stop(self):
+        self._stopping.set()
+        self.httpd.shutdown()
+
+    # Whether jobs are waiting, running or still being fed:
+    def busy(self):
+        return self.runner.feeding or self.queue.unfinished() > 0
+
+    # Queues links for download, returns the reply of POST /jobs. Video links
+    # are queued right away, playlists (and everything with prefetch) are fed
+    # in the background like in the window.
+    def submit(self, urls, output_folder=None, profile=None, prefetch=False):
+        if isinstance(urls, str):
+            urls = [urls]
+        if not isinstance(urls, list) or not all(isinstance(u, str) for u in urls):
+            raise RequestError(HTTPStatus.BAD_REQUEST, "urls must be a list of links")
+        profile = profile or self.profile
+        if profile is not None and profile not in PROFILES:
+            raise RequestError(
+                HTTPStatus.BAD_REQUEST,
+                f"Unknown profile {profile!r}, use one of {', '.join(PROFILES)}",
+            )
+        output_folder = self.resolve_output(output_folder)
+        urls = list(iter_unique_urls(iter_links(urls)))
+        if not urls:
+            raise RequestError(HTTPStatus.BAD_REQUEST, "no URLs given")
+
+        if prefetch:
+            videos, fed = [], urls
+        else:
+            videos = [url for url in urls if not is_playlist_url(url)]
+            fed = [url for url in urls if is_playlist_url(url)]
+        job_ids = self.queue.add(videos, output_folder, profile)
+        if fed:
+            self.runner.feed(fed, output_folder, profile, prefetch=prefetch)
+        # Only counted once the work is in, see handle_get_events
+        with self._lock:
+            self.submissions += 1
+        print(f"Queued {len(job_ids)} jobs, expanding {len(fed)} links")
+        return {"jobs": job_ids, "expanding": len(fed)}
+
+    def job_dict(self, job):
+        data = asdict(job)
+        with self._lock:
+            live = self._live.get(job.id, {})
+        data["percent"] = live.get("percent")
+        data["speed"] = live.get("speed")
+        return data
+
+    def subscribe(self):
+        bus = ProgressBus()
+        with self._lock:
+            self._subscribers.add(bus)
+        return bus
+
+    def unsubscribe(self, bus):
+        with self._lock:
+            self._subscribers.discard(bus)
+
+    # Records a change of a job and hands it to every event stream:
+    def _publish(self, job_id, fields):
+        with self._lock:
+            if fields.get("status") in ("done", "skipped", "failed"):
+                self._live.pop(job_id, None)
+            else:
+                self._live.setdefault(job_id, {}).update(fields)
+            for bus in self._subscribers:
+                bus.post(job_id, **fields)
+
+    # (Worker thread) QueueRunner events:
+    def _on_event(self, event, job):
+        fields = {"status": EVENT_STATUS[event], "speed": None}
+        if event == "running":
+            fields.update(name=job.url, percent=None, error=None)
+        elif event in ("done", "skipped"):
+            fields.update(name=job.file_name, percent=100.0)
+        else:
+            fields.update(error=job.last_error)
+        self._publish(job.id, fields)
+
+    # (Worker thread) Percent and speed of the running downloads:
+    def _on_progress(self, job, d):
+        self._publish(job.id, progress_fields(d))
+
+
+class JobRequestHandler(BaseHTTPRequestHandler):
+    server_version = "PortableYT"
+
+    @property
+    def job_server(self):
+        return self.server.job_server
+
+    def log_message(self, format, *args):
+        print(f"{self.address_string()} {format % args}")
+
+    def send_json(self, data, status=HTTPStatus.OK):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_json(self):
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+            if length < 0:
+                raise ValueError(f"negative Content-Length {length}")
+            if length > MAX_BODY:
+                raise RequestError(
+                    HTTPStatus.REQUEST_ENTITY_TOO_LARGE, "body too large"
+                )
+            data = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError as e:
+            raise RequestError(HTTPStatus.BAD_REQUEST, f"invalid body: {e}")
+        if not isinstance(data, dict):
+            raise RequestError(HTTPStatus.BAD_REQUEST, "expected a JSON object")
+        return data
+
+    # Refuses requests that could come from a web page, see the top of the
+    # module:
+    def check_origin(self, method):
+        server = self.job_server
+        host = urlsplit(f"//{self.headers.get('Host') or ''}").hostname
+        if not server.allowed_host(host):
+            raise RequestError(HTTPStatus.FORBIDDEN, f"host {host!r} not allowed")
+        origin = self.headers.get("Origin")
+        if origin is not None and not is_loopback(urlsplit(origin).hostname):
+            raise RequestError(HTTPStatus.FORBIDDEN, f"origin {origin!r} not allowed")
+        if method in ("post", "put"):
+            content_type = self.headers.get("Content-Type") or ""
+            if content_type.split(";")[0].strip().lower() != "application/json":
+                raise RequestError(
+                    HTTPStatus.UNSUPPORTED_MEDIA_TYPE,
+                    "Content-Type must be application/json",
+                )
+
+    # Routes the request to the handle_<method>_<first path part> method:
+    def dispatch(self, method):
+        url = urlsplit(self.path)
+        parts = [part for part in url.path.split("/") if part]
+        name = f"handle_{method}_{parts[0] if parts else 'root'}"
+        handler = getattr(self, name, None)
+        try:
+            self.check_origin(method)
+            if handler is None:
+                raise RequestError(HTTPStatus.NOT_FOUND, f"no route {url.path}")
+            handler(parts[1:], parse_qs(url.query))
+        except RequestError as e:
+            self.send_json({"error": str(e)}, e.status)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        except Exception as e:
+            print(f"Request {method.upper()} {url.path} failed: {e}")
+            self.send_json({"error": str(e)}, HTTPStatus.INTERNAL_SERVER_ERROR)
+
+    def do_GET(self):
+        self.dispatch("get")
+
+    def do_POST(self):
+        self.dispatch("post")
+
+    def do_PUT(self):
+        self.dispatch("put")
+
+    def handle_get_health(self, parts, query):
+        server = self.job_server
+        self.send_json(
+            {
+                "workers": server.runner.workers,
+                "busy": server.busy(),
+                "jobs": server.queue.counts(),
+                "metrics": REGISTRY.summary(),
+            }
+        )
+
+    def handle_get_jobs(self, parts, query):
+        server = self.job_server
+        if parts:
+            job = server.queue.get(self.job_id(parts[0]))
+            if job is None:
+                raise RequestError(HTTPStatus.NOT_FOUND, f"no job {parts[0]}")
+            self.send_json(server.job_dict(job))
+            return
+        state = query.get("state", [None])[0]
+        self.send_json([server.job_dict(job) for job in server.queue.jobs(state)])
+
+    def handle_post_jobs(self, parts, query):
+        server = self.job_server
+        if parts == ["retry"]:
+            self.send_json({"retried": server.queue.retry_failed()})
+            return
+        if parts:
+            raise RequestError(HTTPStatus.NOT_FOUND, f"no route {self.path}")
+        data = self.read_json()
+        reply = server.submit(
+            data.get("urls"),
+            data.get("output"),
+            data.get("profile"),
+            bool(data.get("prefetch")),
+        )
+        self.send_json(reply, HTTPStatus.ACCEPTED)
+
+    def handle_get_limits(self, parts, query):
+        scheduler = self.job_server.runner.downloader.scheduler
+        self.send_json(
+            {
+                "rate": scheduler.rate,
+                "per_host": scheduler.per_host,
+                "active_hosts": scheduler.active_hosts(),
+            }
+        )
+
+    def handle_put_limits(self, parts, query):
+        scheduler = self.job_server.runner.downloader.scheduler
+        data = self.read_json()
+        try:
+            if "rate" in data:
+                scheduler.set_rate(parse_rate(data["rate"]))
+            if "per_host" in data:
+                scheduler.set_per_host(parse_per_host(data["per_host"]))
+        except (TypeError, ValueError) as e:
+            raise RequestError(HTTPStatus.BAD_REQUEST, str(e))
+        self.handle_get_limits(parts, query)
+
+    # Streams {"job": id, <changed fields>} lines once per frame until the
+    # client disconnects. {"event": "idle", "jobs": counts} follows whenever
+    # the queue runs dry after work arrived.
+    def handle_get_events(self, parts, query):
+        server = self.job_server
+        bus = server.subscribe()
+        busy = server.busy()
+        submissions = server.submissions
+        try:
+            self.send_response(HTTPStatus.OK)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Cache-Control", "no-cache")
+            self.end_headers()
+            last_write = time.monotonic()
+            while not server.stopping:
+                changes, _ = bus.drain()
+                lines = [
+                    json.dumps({"job": job_id, **fields})
+                    for job_id, fields in changes.items()
+                ]
+                active = busy or changes or submissions != server.submissions
+                submissions = server.submissions
+                busy = server.busy()
+                if active and not busy:
+                    lines.append(
+                        json.dumps({"event": "idle", "jobs": server.queue.counts()})
+                    )
+                if lines or time.monotonic() - last_write > HEARTBEAT_SECONDS:
+                    self.wfile.write(("\n".join(lines) + "\n").encode("utf-8"))
+                    self.wfile.flush()
+                    last_write = time.monotonic()
+                time.sleep(FRAME_MS / 1000)
+        finally:
+            server.unsubscribe(bus)
+
+    def job_id(self, text):
+        try:
+            return int(text)
+        except ValueError:
+            raise RequestError(HTTPStatus.NOT_FOUND, f"no job {text}")
@@ -0,0 +1,268 @@
+# Staging area for work in progress. Every job downloads and converts in its
+# own folder under the staging root (local disk by default, a tmpfs or SSD
+# through PORTABLEYT_STAGING or --staging), and only the finished file is
+# moved into the output folder, atomically. The output folder never sees
+# .part files or leftover sources, and slow network folders only take one
+# sequential write per file.
+# A failed job keeps its folder so a retry can resume the partial download;
+# folders nobody touched for STALE_SECONDS are removed at startup. A process
+# holds a lock file in each job folder it works in, so another process
+# sharing the staging root neither works in nor removes it.
+import errno
+import hashlib
+import os
+import shutil
+import threading
+import time
+import uuid
+
+# Environment variable with the staging root
+STAGING_ENV = "PORTABLEYT_STAGING"
+# Default staging root inside the app data folder
+STAGING_DIR = "staging"
+# Job folders older than this (newest file inside) belong to a dead process
+STALE_SECONDS = 6 * 3600
+# Disk space a job needs per byte of source: the source and the converted
+# file exist side by side while FFmpeg runs
+SPACE_FACTOR = 2
+# Space that is always left free on the staging and output drives
+MIN_FREE_BYTES = 64 * 1024 * 1024
+# Lock file inside a job folder, held by the process working in it
+LOCK_FILE = ".lock"
+
+
+class NotEnoughSpace(OSError):
+    pass
+
+
+# The job folder is in use by another process (retried like a busy network):
+class JobDirInUse(OSError):
+    pass
+
+
+# Takes an exclusive lock on an open file without waiting, False when another
+# process holds it. The system drops the lock when the process dies.
+def try_lock(file):
+    try:
+        if os.name == "nt":
+            import msvcrt
+
+            file.seek(0)
+            msvcrt.locking(file.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        return False
+    return True
+
+
+# Seconds since anything in `path` (or `path` itself) was modified:
+def _idle_seconds(path):
+    newest = os.path.getmtime(path)
+    for folder, _, files in os.walk(path):
+        for name in files:
+            try:
+                newest = max(newest, os.path.getmtime(os.path.join(folder, name)))
+            except OSError:
+                pass
+    return time.time() - newest
+
+
+def _device(path):
+    while not os.path.exists(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    return os.stat(path).st_dev, path
+
+
+class Staging:
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        os.makedirs(self.root, exist_ok=True)
+        self._condition = threading.Condition()
+        # Bytes reserved by admitted jobs, per device
+        self._reserved = {}
+        self._admitted = 0
+        # Job folders this process works in: path -> [lock file, jobs]
+        self._held = {}
+        self._held_lock = threading.Lock()
+
+    # Folder of a job, the same for every attempt at it so that partial
+    # downloads are picked up again. The folder is held for this process
+    # until leave() or discard(); raises JobDirInUse when another process
+    # works in it.
+    def job_dir(self, *key):
+        digest = hashlib.sha1("|".join(map(str, key)).encode("utf-8")).hexdigest()
+        path = os.path.join(self.root, f"job-{digest[:16]}")
+        with self._held_lock:
+            held = self._held.get(path)
+            if held is not None:
+                held[1] += 1
+                return path
+            os.makedirs(path, exist_ok=True)
+            lock_file = self._lock(path)
+            if lock_file is None:
+                raise JobDirInUse(
+                    errno.EBUSY, "The job is running in another process", path
+                )
+            self._held[path] = [lock_file, 1]
+        return path
+
+    # The locked lock file of a job folder, None when another process has it:
+    def _lock(self, job_dir):
+        lock_file = open(os.path.join(job_dir, LOCK_FILE), "a+")
+        if not try_lock(lock_file):
+            lock_file.close()
+            return None
+        return lock_file
+
+    # Lets go of a job folder from job_dir() and keeps its files for a retry:
+    def leave(self, job_dir):
+        with self._held_lock:
+            held = self._held[job_dir]
+            held[1] -= 1
+            if held[1] == 0:
+                del self._held[job_dir]
+                held[0].close()
+
+    # Removes a job folder. One held by this process is let go of; one held
+    # by another process is left alone, returns whether it was removed.
+    def discard(self, job_dir):
+        with self._held_lock:
+            held = self._held.pop(job_dir, None)
+            lock_file = held[0] if held else self._lock(job_dir)
+            if lock_file is None:
+                return False
+            if os.name == "nt":
+                # Open files cannot be removed
+                lock_file.close()
+            shutil.rmtree(job_dir, ignore_errors=True)
+            lock_file.close()
+        return True
+
+    # Removes the job folders of crashed or killed runs, returns how many:
+    def cleanup_stale(self, max_age=STALE_SECONDS):
+        removed = 0
+        for entry in os.scandir(self.root):
+            if not entry.name.startswith("job-") or not entry.is_dir():
+                continue
+            try:
+                if _idle_seconds(entry.path) < max_age:
+                    continue
+                if self.discard(entry.path):
+                    removed += 1
+            except OSError:
+                continue
+        if removed:
+            print(f"Removed {removed} stale staging folders from {self.root}")
+        return removed
+
+    # {device: [existing path, bytes]} a job with a `size` bytes source needs:
+    def _needs(self, size, output_folder):
+        needs = {}
+        for folder, amount in (
+            (self.root, (size or 0) * SPACE_FACTOR),
+            (output_folder, size or 0),
+        ):
+            device, existing = _device(os.path.abspath(folder))
+            entry = needs.setdefault(device, [existing, 0])
+            entry[1] += amount
+        return needs
+
+    # (With the condition held) Waits until `needs` fit next to what the
+    # other jobs reserved, `held` is the reservation of an admitted job that
+    # grows. Raises NotEnoughSpace when no other job could free space.
+    def _wait_for_space(self, needs, held=None):
+        growing = held is not None
+        held = held or {}
+        waiting = False
+        while True:
+            short = [
+                (path, amount)
+                for device, (path, amount) in needs.items()
+                if shutil.disk_usage(path).free
+                - (self._reserved.get(device, 0) - held.get(device, 0))
+                < amount + MIN_FREE_BYTES
+            ]
+            if not short:
+                return
+            # Jobs other than the waiting one that will give space back
+            if self._admitted - growing <= 0:
+                path, amount = short[0]
+                raise NotEnoughSpace(
+                    errno.ENOSPC,
+                    f"Not enough disk space for a {-(-amount // 2**20)} MB job",
+                    path,
+                )
+            if not waiting:
+                print(f"Waiting for disk space on {short[0][0]}")
+                waiting = True
+            # Woken by finished jobs, space freed elsewhere is noticed too
+            self._condition.wait(5)
+
+    # Waits until `size` bytes (the source estimate, None when unknown) fit
+    # on the staging drive and the output drive next to what the running
+    # jobs reserved, and holds them for the job. Raises NotEnoughSpace when
+    # the job cannot fit even with nothing else running.
+    def reserve(self, size, output_folder):
+        needs = self._needs(size, output_folder)
+        with self._condition:
+            self._wait_for_space(needs)
+            for device, (_, amount) in needs.items():
+                self._reserved[device] = self._reserved.get(device, 0) + amount
+            self._admitted += 1
+        return {device: amount for device, (_, amount) in needs.items()}
+
+    # Sizes a reservation made without a known size once the format is
+    # selected, waiting like reserve(). The reservation is updated in place;
+    # on NotEnoughSpace it stays as it was and is released as usual.
+    def resize(self, reservation, size, output_folder):
+        needs = self._needs(size, output_folder)
+        with self._condition:
+            self._wait_for_space(needs, reservation)
+            for device, (_, amount) in needs.items():
+                self._reserved[device] = (
+                    self._reserved.get(device, 0) - reservation.get(device, 0) + amount
+                )
+            reservation.clear()
+            reservation.update(
+                {device: amount for device, (_, amount) in needs.items()}
+            )
+            self._condition.notify_all()
+
+    # Gives back what reserve() returned once the job's file is finalized:
+    def release(self, reservation):
+        with self._condition:
+            for device, amount in reservation.items():
+                self._reserved[device] -= amount
+            self._admitted -= 1
+            self._condition.notify_all()
+
+    # Moves a finished file into the output folder and returns its new path.
+    # On the same drive this is a rename; across drives the file is copied
+    # under a hidden name first and then renamed, so the output folder only
+    # ever holds complete files.
+    def finalize(self, path, output_folder):
+        os.makedirs(output_folder, exist_ok=True)
+        name = os.path.basename(path)
+        target = os.path.join(output_folder, name)
+        try:
+            os.replace(path, target)
+            return target
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+        temp = os.path.join(output_folder, f".{name}.{uuid.uuid4().hex[:8]}.partial")
+        try:
+            shutil.copyfile(path, temp)
+            os.replace(temp, target)
+        except BaseException:
+            if os.path.exists(temp):
+                os.remove(temp)
+            raise
+        os.remove(path)
+        return target
@@ -0,0 +1,111 @@
+import queue
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+# How often finished tasks are handed to the Tk thread (milliseconds)
+POLL_MS = 50
+
+
+# Background work the window starts. Short tasks (thumbnail lookups) share
+# one small pool; tasks submitted under a key are latest-wins: a newer task
+# with the same key cancels the older one if it has not started yet, and
+# drops its result if it has. Long ones (downloads, batches) get their own
+# daemon thread from start_thread, so they neither hold up the short tasks
+# nor keep the process alive once the window is closed. Callbacks run on the
+# Tk thread (results are polled with `after`), so workers never touch
+# widgets. Only use from the Tk thread.
+class TaskExecutor:
+    def __init__(self, root, workers=4):
+        self.root = root
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="ui-task"
+        )
+        self._results = queue.SimpleQueue()
+        self._latest = {}
+        self._debounced = {}
+        self._closed = False
+        self._poll_id = root.after(POLL_MS, self._poll)
+
+    # Runs fn(*args) in the pool, then on_done(result) or on_error(exception)
+    # on the Tk thread. key=None tasks are never superseded.
+    def submit(self, key, fn, *args, on_done=None, on_error=None):
+        if self._closed:
+            return None
+        previous = self._latest.pop(key, None)
+        if previous is not None:
+            previous.cancel()
+        future = self._executor.submit(fn, *args)
+        if key is not None:
+            self._latest[key] = future
+        future.add_done_callback(
+            lambda f: self._results.put((key, f, on_done, on_error))
+        )
+        return future
+
+    # Runs fn(*args) on a thread of its own, with the same callbacks as
+    # submit():
+    def start_thread(self, fn, *args, on_done=None, on_error=None, name=None):
+        if self._closed:
+            return None
+        future = Future()
+        future.set_running_or_notify_cancel()
+
+        def run():
+            try:
+                future.set_result(fn(*args))
+            except BaseException as e:
+                future.set_exception(e)
+
+        future.add_done_callback(
+            lambda f: self._results.put((None, f, on_done, on_error))
+        )
+        threading.Thread(target=run, name=name, daemon=True).start()
+        return future
+
+    # Calls fn() on the Tk thread once `delay_ms` passed without another
+    # debounce of the same key (typing, pasting):
+    def debounce(self, key, delay_ms, fn):
+        after_id = self._debounced.pop(key, None)
+        if after_id is not None:
+            self.root.after_cancel(after_id)
+
+        def fire():
+            self._debounced.pop(key, None)
+            fn()
+
+        self._debounced[key] = self.root.after(delay_ms, fire)
+
+    def _poll(self):
+        while True:
+            try:
+                key, future, on_done, on_error = self._results.get_nowait()
+            except queue.Empty:
+                break
+            if future.cancelled():
+                continue
+            if key is not None:
+                if self._latest.get(key) is not future:
+                    # A newer task with the same key took over
+                    continue
+                del self._latest[key]
+            error = future.exception()
+            if error is None:
+                if on_done:
+                    on_done(future.result())
+            elif on_error:
+                on_error(error)
+            else:
+                print(f"Background task failed: {error}")
+        self._poll_id = self.root.after(POLL_MS, self._poll)
+
+    # Stops the polling and pending debounces, cancels the tasks that have
+    # not started and lets the running ones (and threads) finish without
+    # callbacks.
+    def shutdown(self):
+        self._closed = True
+        self.root.after_cancel(self._poll_id)
+        for after_id in self._debounced.values():
+            self.root.after_cancel(after_id)
+        self._debounced.clear()
+        self._latest.clear()
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,114 @@
+import os
+import threading
+from collections import OrderedDict
+from io import BytesIO
+
+import customtkinter as ctk
+import requests
+from PIL import Image
+from requests.adapters import HTTPAdapter
+
+from app.downloader import get_data_dir
+
+THUMBNAIL_URL = "https://img.youtube.com/vi/{video_id}/hqdefault.jpg"
+THUMBNAIL_SIZE = (250, 150)
+
+
+# Loads video thumbnails for the window, which calls load() from its
+# background pool (app.tasks). Images are fetched over one pooled HTTP
+# session, decoded and resized off the Tk main thread and cached both in
+# memory (LRU of finished CTkImages) and on disk (resized JPEGs, size capped).
+class ThumbnailService:
+    def __init__(
+        self,
+        size=THUMBNAIL_SIZE,
+        memory_items=64,
+        disk_bytes=20 * 1024 * 1024,
+        cache_dir=None,
+        workers=2,
+        timeout=3,
+    ):
+        self.size = size
+        self.memory_items = memory_items
+        self.disk_bytes = disk_bytes
+        self.timeout = timeout
+        self.cache_dir = cache_dir or os.path.join(get_data_dir(), "thumbnails")
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        self.session = requests.Session()
+        self.session.mount("https://", HTTPAdapter(pool_maxsize=workers))
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+
+    # Finished image from the memory cache, or None (cheap, for the main thread):
+    def get_cached(self, video_id):
+        with self._lock:
+            image = self._memory.get(video_id)
+            if image is not None:
+                self._memory.move_to_end(video_id)
+            return image
+
+    # (Worker thread) The thumbnail as a CTkImage, from the caches or the
+    # network. Raises when it cannot be loaded.
+    def load(self, video_id):
+        try:
+            image = self.get_cached(video_id)
+            if image is not None:
+                return image
+
+            cache_path = os.path.join(self.cache_dir, f"{video_id}.jpg")
+            if os.path.isfile(cache_path):
+                print(f"Thumbnail from disk cache: {video_id}")
+                os.utime(cache_path)  # Most recently used files are trimmed last
+                with Image.open(cache_path) as cached:
+                    pil_image = cached.convert("RGB")
+            else:
+                print(f"Fetching thumbnail for video ID: {video_id}")
+                response = self.session.get(
+                    THUMBNAIL_URL.format(video_id=video_id), timeout=self.timeout
+                )
+                response.raise_for_status()
+                with Image.open(BytesIO(response.content)) as downloaded:
+                    pil_image = downloaded.convert("RGB").resize(self.size)
+                # Written aside and moved into place, an interrupted save
+                # leaves no truncated image in the cache
+                temp_path = f"{cache_path}.tmp"
+                try:
+                    pil_image.save(temp_path, "JPEG", quality=90)
+                    os.replace(temp_path, cache_path)
+                except OSError as e:
+                    print(f"Could not cache the thumbnail: {e}")
+                self._trim_disk()
+
+            image = ctk.CTkImage(
+                light_image=pil_image, dark_image=pil_image, size=self.size
+            )
+            with self._lock:
+                self._memory[video_id] = image
+                while len(self._memory) > self.memory_items:
+                    self._memory.popitem(last=False)
+            return image
+        except Exception as e:
+            print(f"Exception while loading thumbnail: {e}")
+            raise
+
+    # Removes the least recently used files once the disk cache is over its cap:
+    def _trim_disk(self):
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_file():
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.disk_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+    def close(self):
+        self.session.close()
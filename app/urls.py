@@ -0,0 +1,67 @@
+# Link parsing for batch input: one precompiled matcher for every YouTube
+# link form and a streaming, deduplicating reader for link lists of any size.
+import base64
+import re
+import sys
+
+# watch?v=, youtu.be/, shorts/, embed/, live/ and v/ links on www, m, music
+# and the no-cookie domain, with or without scheme (case-insensitive, the ID
+# itself is not). The link starts at a host boundary, so other hosts
+# (notyoutube.com, youtube.com.example) and paths (example.com/youtu.be/...)
+# do not match. Group 1 is the video ID.
+VIDEO_ID_RE = re.compile(
+    r"(?<![\w.@/-])"
+    r"(?i:(?:https?://)?(?:(?:www|m|music)\.)?"
+    r"(?:youtube(?:-nocookie)?\.com/"
+    r"(?:watch/?\?(?:[^#\s]*?[&;])?v=|shorts/|embed/|live/|v/)"
+    r"|youtu\.be/))"
+    r"([A-Za-z0-9_-]{11})(?![A-Za-z0-9_-])"
+)
+
+
+# The 11 character video ID of a YouTube link, None for anything else
+# (playlists, channels, other sites):
+def video_id(url):
+    match = VIDEO_ID_RE.search(url)
+    return match.group(1) if match else None
+
+
+def canonical_url(video_id):
+    return f"https://www.youtube.com/watch?v={video_id}"
+
+
+# Yields the links of text lines (several per line allowed, separated by
+# whitespace), reading one line at a time.
+def iter_links(lines):
+    for line in lines:
+        yield from line.split()
+
+
+# Links of a file (or stdin for "-"), read line by line:
+def iter_file_links(path):
+    if path == "-":
+        yield from iter_links(sys.stdin)
+        return
+    with open(path, encoding="utf-8") as file:
+        yield from iter_links(file)
+
+
+# Dedupe key of a video ID: the integer its 11 base64 characters encode
+# rather than the string, about half the memory per remembered video
+def _id_key(video_id):
+    return int.from_bytes(base64.urlsafe_b64decode(video_id + "A"), "big")
+
+
+# Turns YouTube video links into their canonical watch URL and drops every
+# repeat of a video (or of the same other link) as the links stream through.
+# Only the keys of the links seen so far are kept in memory.
+def iter_unique_urls(links):
+    seen = set()
+    search = VIDEO_ID_RE.search
+    for link in links:
+        match = search(link)
+        key = _id_key(match.group(1)) if match else link
+        if key in seen:
+            continue
+        seen.add(key)
+        yield canonical_url(match.group(1)) if match else link
@@ -0,0 +1,206 @@
+# Offline throughput benchmark: serves synthetic audio from a local HTTP server
+# and runs the download paths against it at several concurrency levels.
+#
+#   python -m benchmarks.bench_offline --files 16 --seconds 60 --concurrency 1,2,4,8
+#   python -m benchmarks.bench_offline --output new.json --compare old.json
+#
+# Results (wall time, jobs/s, bytes/s and per-stage latency) are saved as JSON
+# so runs on the same machine can be compared for regressions.
+import argparse
+import contextlib
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+from app.batch import BatchDownloader
+from app.downloader import Downloader
+from app.metrics import MetricsRegistry
+from app.pipeline import PipelinedBatchDownloader
+from benchmarks.mediaserver import MediaServer, find_ffmpeg, generate_media
+
+# "stream" is the batch engine with downloads piped into FFmpeg, "chunked"
+# the batch engine with files of 16 MB and up (--seconds 1100 at 128 kbps)
+# fetched over several connections
+ENGINES = ("batch", "pipeline", "stream", "chunked")
+
+
+def prepare_media(directory, files, seconds, bitrate_kbps):
+    template = os.path.join(directory, "template.m4a")
+    encoded = generate_media(template, seconds, bitrate_kbps)
+    names = []
+    for n in range(files):
+        name = f"track-{n:04d}.m4a"
+        shutil.copyfile(template, os.path.join(directory, name))
+        names.append(name)
+    os.remove(template)
+    return names, encoded
+
+
+# One timed pass of an engine over every file:
+def run_pass(engine_name, concurrency, urls, transcode):
+    output_folder = tempfile.mkdtemp(prefix="bench-out-")
+    registry = MetricsRegistry()
+    downloader = Downloader(
+        metrics=registry,
+        stream=engine_name == "stream",
+        chunked=engine_name == "chunked",
+    )
+
+    # Without transcoding the fetched file is the end result of a job
+    def fetch_only(url, folder):
+        return downloader.fetch(url, folder, final=True)
+
+    def download(url, folder):
+        if transcode:
+            return downloader.download(url, folder)
+        return os.path.basename(fetch_only(url, folder))
+
+    try:
+        if engine_name == "single":
+            engine = None
+        elif engine_name == "pipeline":
+            engine = PipelinedBatchDownloader(
+                output_folder,
+                download_workers=concurrency,
+                downloader=downloader,
+                fetch=None if transcode else fetch_only,
+                transcode=None if transcode else os.path.basename,
+            )
+        else:
+            engine = BatchDownloader(
+                output_folder, workers=concurrency, download=download
+            )
+
+        start = time.perf_counter()
+        if engine is None:
+            download(urls[0], output_folder)
+            failed = 0
+        else:
+            results = engine.run(urls)
+            failed = sum(1 for result in results if not result.ok)
+        wall = time.perf_counter() - start
+    finally:
+        downloader.close()
+        shutil.rmtree(output_folder, ignore_errors=True)
+
+    summary = registry.summary()
+    jobs = 1 if engine is None else len(urls)
+    return {
+        "engine": engine_name,
+        "concurrency": concurrency,
+        "jobs": jobs,
+        "failed": failed,
+        "wall_seconds": wall,
+        "jobs_per_second": jobs / wall,
+        "bytes_per_second": summary["downloaded_bytes"] / wall,
+        "stages": {
+            stage: summary[stage]
+            for stage in ("extract", "download", "transcode", "total")
+        },
+    }
+
+
+def print_run(run):
+    stages = "  ".join(
+        f"{stage} p50 {values['p50']:.3f}s"
+        for stage, values in run["stages"].items()
+        if values["p50"] is not None
+    )
+    print(
+        f"{run['engine']:<9} x{run['concurrency']:<3} {run['wall_seconds']:8.2f}s"
+        f"  {run['jobs_per_second']:7.2f} jobs/s"
+        f"  {run['bytes_per_second'] / 1e6:8.2f} MB/s"
+        f"  failed {run['failed']}  {stages}"
+    )
+
+
+# Prints how much faster (>1) or slower (<1) each run is than in the old file:
+def compare(results, previous_path):
+    with open(previous_path, encoding="utf-8") as file:
+        previous = json.load(file)
+    old_runs = {(r["engine"], r["concurrency"]): r for r in previous["runs"]}
+    print(f"\nCompared to {previous_path}:")
+    for run in results["runs"]:
+        old = old_runs.get((run["engine"], run["concurrency"]))
+        if old:
+            ratio = old["wall_seconds"] / run["wall_seconds"]
+            print(f"{run['engine']:<9} x{run['concurrency']:<3} speedup {ratio:5.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the download paths against a local media server"
+    )
+    parser.add_argument("--files", type=int, default=8, help="files per pass")
+    parser.add_argument(
+        "--seconds", type=float, default=60, help="audio length of each file"
+    )
+    parser.add_argument("--bitrate", type=int, default=128, help="source kbps")
+    parser.add_argument(
+        "--latency", type=float, default=0.05, help="server delay per request (s)"
+    )
+    parser.add_argument(
+        "--bandwidth", type=float, help="server bytes per second per connection"
+    )
+    parser.add_argument("--concurrency", default="1,2,4,8")
+    parser.add_argument("--engines", default=",".join(ENGINES))
+    parser.add_argument(
+        "--fetch-only", action="store_true", help="skip the MP3 transcode stage"
+    )
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--compare", metavar="OLD_JSON")
+    args = parser.parse_args()
+
+    media_dir = tempfile.mkdtemp(prefix="bench-media-")
+    try:
+        names, encoded = prepare_media(
+            media_dir, args.files, args.seconds, args.bitrate
+        )
+        transcode = encoded and not args.fetch_only
+        if not encoded:
+            print("FFmpeg not found: serving random bytes, transcode is skipped")
+
+        results = {
+            "created_at": time.time(),
+            "platform": platform.platform(),
+            "python": sys.version.split()[0],
+            "ffmpeg": find_ffmpeg(),
+            "params": {**vars(args), "transcode": transcode},
+            "runs": [],
+        }
+        with MediaServer(
+            media_dir, latency=args.latency, bytes_per_second=args.bandwidth
+        ) as server:
+            urls = [server.url(name) for name in names]
+            engines = args.engines.split(",")
+            if not transcode and "stream" in engines:
+                # Streaming only changes how the transcode gets its input
+                print("Without transcoding the stream engine is skipped")
+                engines.remove("stream")
+            passes = [("single", 1)] + [
+                (engine, int(concurrency))
+                for engine in engines
+                for concurrency in args.concurrency.split(",")
+            ]
+            for engine, concurrency in passes:
+                # Library logging goes to stderr, the report to stdout
+                with contextlib.redirect_stdout(sys.stderr):
+                    run = run_pass(engine, concurrency, urls, transcode)
+                results["runs"].append(run)
+                print_run(run)
+    finally:
+        shutil.rmtree(media_dir, ignore_errors=True)
+
+    with open(args.output, "w", encoding="utf-8") as file:
+        json.dump(results, file, indent=2)
+    print(f"Results saved to {args.output}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+# Per-job overhead of a fresh YoutubeDL per file versus a warm Downloader session.
+#
+#   python -m benchmarks.bench_session              (offline, setup cost only)
+#   python -m benchmarks.bench_session --url URL    (adds a real metadata request)
+import argparse
+import statistics
+import time
+
+from yt_dlp import YoutubeDL
+
+from app.downloader import Downloader, build_outtmpl, build_ydl_opts
+
+
+# What download_audio did for every file before the session existed:
+def cold_job(url):
+    ydl_opts = build_ydl_opts(build_outtmpl("."))
+    with YoutubeDL(ydl_opts) as ydl:
+        ydl.get_info_extractor("Youtube")
+        if url:
+            ydl.extract_info(url, download=False)
+
+
+def warm_job(downloader, url):
+    with downloader._checkout() as ydl:
+        ydl.params["outtmpl"]["default"] = build_outtmpl(".")
+        ydl.get_info_extractor("Youtube")
+        if url:
+            ydl.extract_info(url, download=False)
+
+
+def measure(job, runs):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        job()
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def report(name, timings):
+    print(
+        f"{name:<6} mean {statistics.mean(timings):9.3f} ms"
+        f"   median {statistics.median(timings):9.3f} ms"
+        f"   min {min(timings):9.3f} ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Per-job overhead of cold YoutubeDL instances vs a warm session"
+    )
+    parser.add_argument("--runs", type=int, default=50)
+    parser.add_argument("--url", help="also extract metadata of this video per job")
+    args = parser.parse_args()
+
+    runs = args.runs if not args.url else min(args.runs, 10)
+    print(f"Per-job overhead over {runs} jobs")
+
+    report("cold", measure(lambda: cold_job(args.url), runs))
+    with Downloader() as downloader:
+        warm_job(downloader, None)  # Warm-up, paid once per worker
+        report("warm", measure(lambda: warm_job(downloader, args.url), runs))
+
+
+if __name__ == "__main__":
+    main()
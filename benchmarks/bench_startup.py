@@ -0,0 +1,61 @@
+# Process startup cost of the headless CLI versus the GUI.
+#
+#   python -m benchmarks.bench_startup [--runs N]
+#
+# Every run starts a fresh interpreter, so the numbers include interpreter
+# startup and are comparable to one cron invocation.
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+# Heavy modules whose presence is reported for each entry point
+WATCHED_MODULES = ("customtkinter", "tkinter", "PIL", "requests", "pyperclip", "yt_dlp")
+
+ENTRY_POINTS = {
+    "python": "pass",
+    "cli": "import app.cli",
+    "gui": "import customtkinter, app.gui",
+}
+
+
+def time_import(code, runs):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], check=True)
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def loaded_modules(code):
+    probe = (
+        f"{code}\nimport json, sys\n"
+        f"print(json.dumps([m for m in {WATCHED_MODULES!r} if m in sys.modules]))"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", probe], check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Import time of the CLI entry point vs the GUI entry point"
+    )
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    for name, code in ENTRY_POINTS.items():
+        timings = time_import(code, args.runs)
+        print(
+            f"{name:<7} median {statistics.median(timings):8.1f} ms"
+            f"   min {min(timings):8.1f} ms"
+            f"   loads: {', '.join(loaded_modules(code)) or '-'}"
+        )
+
+
+if __name__ == "__main__":
+    main()
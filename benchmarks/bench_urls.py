@@ -0,0 +1,95 @@
+# Link ingestion speed: how many links per second the streaming parser
+# (app.urls) reads, canonicalizes and dedupes from a large link list.
+#
+#   python -m benchmarks.bench_urls [--lines 1000000] [--unique 200000]
+#
+# The list mixes every link form (watch with extra parameters, youtu.be,
+# shorts, music, embed) plus playlists and repeats. The in-memory path (whole
+# text, split(), clean_youtube_url per link) is timed for comparison.
+import argparse
+import os
+import random
+import string
+import tempfile
+import time
+import tracemalloc
+
+from app.downloader import clean_youtube_url, extract_video_id
+from app.urls import iter_file_links, iter_unique_urls
+
+LINK_FORMS = (
+    "https://www.youtube.com/watch?v={id}&t=42s&si=abcdef",
+    "youtu.be/{id}?si=abcdef",
+    "https://youtube.com/shorts/{id}",
+    "https://music.youtube.com/watch?v={id}&feature=share",
+    "https://www.youtube-nocookie.com/embed/{id}?start=10",
+    "https://m.youtube.com/watch?feature=shared&v={id}",
+)
+ID_CHARS = string.ascii_letters + string.digits + "-_"
+
+
+def write_links(path, lines, unique, seed=1):
+    rng = random.Random(seed)
+    ids = ["".join(rng.choices(ID_CHARS, k=11)) for _ in range(unique)]
+    with open(path, "w", encoding="utf-8") as file:
+        for n in range(lines):
+            if n % 1000 == 0:
+                file.write(f"https://www.youtube.com/playlist?list=PL{n}\n")
+            else:
+                file.write(rng.choice(LINK_FORMS).format(id=rng.choice(ids)) + "\n")
+
+
+def streaming(path):
+    return sum(1 for _ in iter_unique_urls(iter_file_links(path)))
+
+
+# Batch input before app.urls: the whole text in memory, then clean_youtube_url
+def legacy(path):
+    with open(path, encoding="utf-8") as file:
+        links = file.read().split()
+    seen = set()
+    for link in links:
+        url = clean_youtube_url(link)
+        seen.add(extract_video_id(url) or url)
+    return len(seen)
+
+
+# Speed and memory come from separate passes, tracing every allocation
+# would slow the timed pass down several times over.
+def measure(function, path, lines):
+    start = time.perf_counter()
+    result = function(path)
+    seconds = time.perf_counter() - start
+    tracemalloc.start()
+    function(path)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(
+        f"{function.__name__:<10} {lines / seconds:12,.0f} links/s"
+        f"   {seconds:7.2f} s   peak {peak / 1e6:7.1f} MB   unique {result:,}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Links parsed per second")
+    parser.add_argument("--lines", type=int, default=1000000)
+    parser.add_argument("--unique", type=int, default=200000)
+    parser.add_argument(
+        "--skip-legacy", action="store_true", help="only time the streaming parser"
+    )
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(prefix="bench-urls-"), "links.txt")
+    try:
+        write_links(path, args.lines, args.unique)
+        print(f"{args.lines:,} lines, {os.path.getsize(path) / 1e6:.1f} MB")
+        measure(streaming, path, args.lines)
+        if not args.skip_legacy:
+            measure(legacy, path, args.lines)
+    finally:
+        os.remove(path)
+        os.rmdir(os.path.dirname(path))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+# Local stand-in for a media host: serves synthetic audio files over HTTP with
+# configurable latency and bandwidth, including byte range requests (or,
+# like some hosts, ignoring them).
+import os
+import re
+import shutil
+import subprocess
+import threading
+import time
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+from app.downloader import get_ffmpeg_paths
+
+_RANGE_RE = re.compile(r"bytes=(\d*)-(\d*)$")
+
+
+# FFmpeg used to generate the media: the bundled one, else the one on PATH
+def find_ffmpeg():
+    ffmpeg_path, ffprobe_path = get_ffmpeg_paths()
+    if os.path.isfile(ffmpeg_path):
+        return ffmpeg_path
+    return shutil.which("ffmpeg")
+
+
+# Writes `seconds` of a sine tone encoded as AAC in an m4a container, with
+# the index (moov) up front so FFmpeg can read it from a pipe (the stream
+# engine) instead of seeking to the end.
+# Without FFmpeg the file is filled with random bytes of the same size, which
+# is enough for fetch-only runs but cannot be transcoded.
+def generate_media(path, seconds, bitrate_kbps=128, ffmpeg_path=None):
+    ffmpeg_path = ffmpeg_path or find_ffmpeg()
+    if ffmpeg_path:
+        subprocess.run(
+            [
+                ffmpeg_path,
+                "-y",
+                "-loglevel",
+                "error",
+                "-f",
+                "lavfi",
+                "-i",
+                f"sine=frequency=440:duration={seconds}",
+                "-c:a",
+                "aac",
+                "-b:a",
+                f"{bitrate_kbps}k",
+                "-movflags",
+                "+faststart",
+                path,
+            ],
+            check=True,
+        )
+        return True
+
+    with open(path, "wb") as file:
+        file.write(os.urandom(int(seconds * bitrate_kbps * 1000 / 8)))
+    return False
+
+
+class MediaRequestHandler(SimpleHTTPRequestHandler):
+    latency = 0.0
+    bytes_per_second = None
+    chunk_size = 64 * 1024
+    # Answer range requests with 206, else always 200 with the whole file
+    ranges = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def end_headers(self):
+        if self.ranges:
+            self.send_header("Accept-Ranges", "bytes")
+        super().end_headers()
+
+    def do_GET(self):
+        if self.latency:
+            time.sleep(self.latency)
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return
+
+        size = os.path.getsize(path)
+        start, end = 0, size - 1
+        match = self.ranges and _RANGE_RE.match(self.headers.get("Range", ""))
+        if match and (match.group(1) or match.group(2)):
+            if match.group(1):
+                start = int(match.group(1))
+                end = int(match.group(2)) if match.group(2) else size - 1
+            else:
+                start = max(size - int(match.group(2)), 0)
+            end = min(end, size - 1)
+            if start > end:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{size}")
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        else:
+            self.send_response(200)
+
+        self.send_header("Content-Type", self.guess_type(path))
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("ETag", f'"{size}-{int(os.path.getmtime(path))}"')
+        self.end_headers()
+
+        with open(path, "rb") as file:
+            file.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = file.read(min(self.chunk_size, remaining))
+                if not chunk:
+                    break
+                try:
+                    self.wfile.write(chunk)
+                except (BrokenPipeError, ConnectionResetError):
+                    return
+                remaining -= len(chunk)
+                if self.bytes_per_second:
+                    time.sleep(len(chunk) / self.bytes_per_second)
+
+
+# HTTP server for `directory` on a free local port, running on a background
+# thread while used as a context manager.
+class MediaServer:
+    def __init__(self, directory, latency=0.0, bytes_per_second=None, ranges=True):
+        handler = type(
+            "Handler",
+            (MediaRequestHandler,),
+            {
+                "latency": latency,
+                "bytes_per_second": bytes_per_second,
+                "ranges": ranges,
+            },
+        )
+        self.httpd = ThreadingHTTPServer(
+            ("127.0.0.1", 0), partial(handler, directory=directory)
+        )
+        self.httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def url(self, name):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/{name}"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -1,7 +1,15 @@
-import customtkinter as ctk
-from app.gui import App
+import sys
 
 if __name__ == "__main__":
+    # With arguments run headless, the GUI stack is only imported for the window
+    if len(sys.argv) > 1:
+        from app.cli import main
+
+        sys.exit(main())
+
+    import customtkinter as ctk
+    from app.gui import App
+
     ctk.set_appearance_mode("dark")
     ctk.set_default_color_theme("blue")
     app = App()
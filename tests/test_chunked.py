@@ -0,0 +1,173 @@
+# Ranged downloads (app.chunked) against the local media server: joining the
+# ranges, resuming an interrupted download, a file that changed on the server
+# and servers that answer ranges with 200.
+import os
+import threading
+import time
+import urllib.request
+
+import pytest
+
+from app import chunked, downloader
+from app.chunked import RangeNotSupported, download_chunked
+from app.downloader import Downloader
+from app.staging import Staging
+from benchmarks.mediaserver import MediaServer
+
+# Split into 4 ranges of RANGE_SIZE bytes
+RANGE_SIZE = 64 * 1024
+SIZE = 4 * RANGE_SIZE
+
+
+@pytest.fixture(autouse=True)
+def small_ranges(monkeypatch):
+    # Files of a few hundred KB are split like large ones
+    monkeypatch.setattr(chunked, "CHUNKED_MIN_SIZE", RANGE_SIZE)
+    monkeypatch.setattr(chunked, "MIN_RANGE_SIZE", RANGE_SIZE)
+    monkeypatch.setattr(downloader, "CHUNKED_MIN_SIZE", RANGE_SIZE)
+    # A failed range fails the download right away
+    monkeypatch.setattr(chunked, "RANGE_ATTEMPTS", 1)
+
+
+@pytest.fixture
+def media(tmp_path):
+    folder = tmp_path / "media"
+    folder.mkdir()
+    data = os.urandom(SIZE)
+    (folder / "a.m4a").write_bytes(data)
+    return folder, data
+
+
+# open_range for app.chunked over urllib. Ranges are logged to `requests`;
+# ranges from `fail_from` on fail, once the others are done.
+def opener(url, requests=None, fail_from=None):
+    def open_range(start, end, validator):
+        if fail_from is not None and start >= fail_from:
+            time.sleep(0.5)
+            raise ConnectionResetError("connection dropped")
+        if requests is not None:
+            requests.append((start, end))
+        headers = {"Range": f"bytes={start}-{end}"}
+        if validator:
+            headers["If-Range"] = validator
+        return urllib.request.urlopen(urllib.request.Request(url, headers=headers))
+
+    return open_range
+
+
+def leftovers(path):
+    folder, name = os.path.split(path)
+    if not os.path.isdir(folder):
+        return []
+    return sorted(entry for entry in os.listdir(folder) if entry != name)
+
+
+# Downloads the first 3 ranges of the file to `path` and fails on the last
+def interrupted(url, path):
+    with pytest.raises(ConnectionResetError):
+        download_chunked(opener(url, fail_from=3 * RANGE_SIZE), path)
+    assert leftovers(path) == [
+        "out.m4a.part0",
+        "out.m4a.part1",
+        "out.m4a.part2",
+        "out.m4a.ranges",
+    ]
+
+
+def test_join(media, tmp_path):
+    folder, data = media
+    path = str(tmp_path / "downloads" / "out.m4a")
+    requests = []
+    with MediaServer(str(folder)) as server:
+        assert download_chunked(opener(server.url("a.m4a"), requests), path)
+    with open(path, "rb") as file:
+        assert file.read() == data
+    assert sorted(requests)[1:] == [
+        (start, start + RANGE_SIZE - 1) for start in range(0, SIZE, RANGE_SIZE)
+    ]
+    assert leftovers(path) == []
+
+
+def test_small_file_is_not_split(media, tmp_path, monkeypatch):
+    monkeypatch.setattr(chunked, "CHUNKED_MIN_SIZE", SIZE + 1)
+    folder, data = media
+    path = str(tmp_path / "downloads" / "out.m4a")
+    with MediaServer(str(folder)) as server:
+        assert not download_chunked(opener(server.url("a.m4a")), path)
+    assert not os.path.exists(path)
+    assert leftovers(path) == []
+
+
+def test_resume(media, tmp_path):
+    folder, data = media
+    path = str(tmp_path / "downloads" / "out.m4a")
+    requests = []
+    with MediaServer(str(folder)) as server:
+        interrupted(server.url("a.m4a"), path)
+        assert download_chunked(opener(server.url("a.m4a"), requests), path)
+    with open(path, "rb") as file:
+        assert file.read() == data
+    # The probe and the missing range only
+    assert requests == [(0, 0), (3 * RANGE_SIZE, SIZE - 1)]
+    assert leftovers(path) == []
+
+
+def test_changed_file_starts_over(media, tmp_path):
+    folder, data = media
+    path = str(tmp_path / "downloads" / "out.m4a")
+    requests = []
+    with MediaServer(str(folder)) as server:
+        interrupted(server.url("a.m4a"), path)
+        # Same size, new ETag
+        changed = os.urandom(SIZE)
+        (folder / "a.m4a").write_bytes(changed)
+        os.utime(folder / "a.m4a", (time.time() + 10, time.time() + 10))
+        assert download_chunked(opener(server.url("a.m4a"), requests), path)
+    with open(path, "rb") as file:
+        assert file.read() == changed
+    assert len(requests) == 5
+    assert leftovers(path) == []
+
+
+def test_file_changing_during_download(media, tmp_path):
+    folder, data = media
+    path = str(tmp_path / "downloads" / "out.m4a")
+    probed = threading.Event()
+
+    with MediaServer(str(folder)) as server:
+        open_range = opener(server.url("a.m4a"))
+
+        def changing(start, end, validator):
+            if probed.is_set():
+                os.utime(folder / "a.m4a", (time.time() + 10, time.time() + 10))
+            probed.set()
+            return open_range(start, end, validator)
+
+        with pytest.raises(RangeNotSupported):
+            download_chunked(changing, path)
+    assert leftovers(path) == []
+
+
+def test_server_without_ranges(media, tmp_path):
+    folder, data = media
+    path = str(tmp_path / "downloads" / "out.m4a")
+    with MediaServer(str(folder)) as server:
+        interrupted(server.url("a.m4a"), path)
+    # The same file from a host that stopped answering ranges
+    with MediaServer(str(folder), ranges=False) as server:
+        with pytest.raises(RangeNotSupported):
+            download_chunked(opener(server.url("a.m4a")), path)
+    assert leftovers(path) == []
+
+
+def test_downloader_falls_back_to_one_piece(media, tmp_path, monkeypatch):
+    monkeypatch.setenv("PORTABLEYT_HOME", str(tmp_path / "home"))
+    folder, data = media
+    output = tmp_path / "output"
+    staging = Staging(str(tmp_path / "staging"))
+    with MediaServer(str(folder), ranges=False) as server:
+        with Downloader(chunked=True, staging=staging) as session:
+            session.fetch(server.url("a.m4a"), str(output), final=True)
+    assert os.listdir(output) == ["a.m4a"]
+    assert (output / "a.m4a").read_bytes() == data
+    assert os.listdir(staging.root) == []